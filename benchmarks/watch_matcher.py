@@ -0,0 +1,74 @@
+"""
+Microbenchmark: filtering watchdog events with `invocations.watch.Matcher`.
+
+Compares the combined-regex `Matcher` against testing each regex in turn (as
+watchdog's ``RegexMatchingEventHandler`` does), using two handlers shaped like
+those of ``docs.watch_docs``. Run as ``python benchmarks/watch_matcher.py
+[events]``; prints events per second for each approach.
+"""
+
+import re
+import sys
+import time
+
+from invocations.watch import Matcher
+
+
+HANDLERS = [
+    (
+        [r"\./README.rst", r"\./sites/www"],
+        [r".*/\..*\.swp", r"\./sites/www/_build"],
+    ),
+    (
+        [r"\./sites/docs", r"\./mypackage/"],
+        [r".*/\..*\.swp", r"\./sites/docs/_build"],
+    ),
+]
+PATHS = [
+    "./mypackage/core.py",
+    "./mypackage/.core.py.swp",
+    "./sites/docs/index.rst",
+    "./sites/docs/_build/html/index.html",
+    "./sites/www/changelog.rst",
+    "./tests/core.py",
+    "./.git/index",
+    "./README.rst",
+]
+
+
+def per_regex(regexes, ignore_regexes):
+    regexes = [re.compile(x) for x in regexes]
+    ignore_regexes = [re.compile(x) for x in ignore_regexes]
+
+    def match(*paths):
+        for path in paths:
+            for regex in ignore_regexes:
+                if regex.match(path):
+                    return False
+        for path in paths:
+            for regex in regexes:
+                if regex.match(path):
+                    return True
+        return False
+
+    return match
+
+
+def rate(matchers, events):
+    paths = (PATHS * (events // len(PATHS) + 1))[:events]
+    start = time.perf_counter()
+    for path in paths:
+        for matcher in matchers:
+            matcher(path)
+    return events / (time.perf_counter() - start)
+
+
+def main(events=200000):
+    before = rate([per_regex(*x) for x in HANDLERS], events)
+    after = rate([Matcher(*x) for x in HANDLERS], events)
+    print("per-regex: {:,.0f} events/s".format(before))
+    print("combined:  {:,.0f} events/s".format(after))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -1,5 +1,8 @@
+import os
 from importlib import metadata
 
+from . import profiling
+
 __version__ = metadata.version("invocations")
 
 
@@ -10,3 +13,8 @@ __version__ = metadata.version("invocations")
 from warnings import filterwarnings
 
 filterwarnings(action="ignore", category=SyntaxWarning, module=".*")
+
+
+# Opt-in profiling of the whole session; see invocations.profiling.
+if os.environ.get(profiling.ENV_VAR):
+    profiling.enable(os.environ[profiling.ENV_VAR])
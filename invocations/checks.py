@@ -4,12 +4,43 @@ Tasks for common project sanity-checking such as linting or type checking.
 .. versionadded:: 1.2
 """
 
-from invoke import task
+import configparser
+import hashlib
+import json
+import os
+import re
+import shlex
+import sys
+import time
+from fnmatch import fnmatch
+from importlib.metadata import PackageNotFoundError, distributions, version
 
+from build import BuildException
+from build._builder import _read_pyproject_toml
+from invoke import task, Context, Exit, Result
+from tabulate import tabulate
 
-@task(name="blacken", aliases=["format"], iterable=["folders"])
+from .jobs import default_jobs
+from .util import cache_path, changed_files, parallel
+
+
+@task(
+    name="blacken",
+    aliases=["format"],
+    iterable=["folders", "exclude"],
+    optional=["changed"],
+)
 def blacken(
-    c, line_length=79, folders=None, check=False, diff=False, find_opts=None
+    c,
+    line_length=79,
+    folders=None,
+    check=False,
+    diff=False,
+    find_opts=None,
+    exclude=None,
+    workers=None,
+    changed=None,
+    report=None,
 ):
     r"""
     Run black on the current source tree (all ``.py`` files).
@@ -30,12 +61,51 @@ def blacken(
         ./vendor\*"``, add ``-mtime N``, or etc. Honors the
         ``blacken.find_opts`` config option.
 
+        When given, files are found via the legacy ``find | xargs black``
+        pipeline, and ``exclude``, ``workers`` and the cache described below
+        don't apply.
+    :param list exclude:
+        Shell-style glob patterns (e.g. ``*/vendor/*``); files and folders
+        whose path or name matches any of them are skipped. Honors the
+        ``blacken.exclude`` config option. Default: ``[]``.
+    :param int workers:
+        How many ``black`` processes to run at once, each handling a share of
+        the files. Honors the ``blacken.workers`` config option. Default: as
+        many as this machine can handle (see `invocations.jobs.default_jobs`.)
+    :param changed:
+        Only run on files which git says were added or modified since this
+        base ref (e.g. ``origin/main``); or, given as a bare flag on the CLI
+        (i.e. ``True``), since ``HEAD``. Untracked files count as changed.
+        Files must still be within ``folders`` and not excluded; implies
+        ignoring ``find_opts``. Default: ``None`` (all files).
+    :param str report:
+        Set to ``"json"`` to also write a machine-readable report to
+        ``reports/blacken.json`` in the cache directory. It includes each
+        file's status (``unchanged``, ``reformatted``, ``would reformat``,
+        ``error``, or ``cached`` if skipped as unchanged), each ``black``
+        batch's files, exit code and wall time, and the total wall time.
+        Implies ignoring ``find_opts``. Default: ``None``.
+
+    Files are found by walking ``folders`` in Python. Files which haven't
+    changed (going by modification time and size) since ``black`` last
+    reformatted them, or passed them under ``check``, with the same line
+    length, ``black`` version and ``[tool.black]`` settings in
+    ``pyproject.toml``, are skipped, whether checking or formatting; this
+    index lives in ``blacken.json`` in the cache directory (see
+    `invocations.util.cache_path`) and may be deleted at any time.
+
     .. versionadded:: 1.2
     .. versionchanged:: 1.4
         Added the ``find_opts`` argument.
     .. versionchanged:: 3.2
         Added the ``format`` alias.
+    .. versionchanged:: 4.1
+        Added the ``exclude``, ``workers``, ``changed`` and ``report``
+        arguments, and switched from ``find | xargs`` to finding files in
+        Python (unless ``find_opts`` is given) and skipping those which are
+        unchanged since the last run.
     """
+    _check_report(report)
     config = c.config.get("blacken", {})
     default_folders = ["."]
     configured_folders = config.get("folders", default_folders)
@@ -50,36 +120,566 @@ def blacken(
         black_command_line = "{} --check".format(black_command_line)
     if diff:
         black_command_line = "{} --diff".format(black_command_line)
-    if find_opts:
-        find_opts = " {}".format(find_opts)
-    else:
-        find_opts = ""
+    if find_opts and not (changed or report):
+        cmd = "find {} -name '*.py' {} | xargs {}".format(
+            " ".join(folders), find_opts, black_command_line
+        )
+        return c.run(cmd, pty=True)
+
+    start = time.time()
+    exclude = exclude or config.get("exclude", [])
+    workers = workers or config.get("workers", None) or default_jobs(c)
+    files = python_files(folders, exclude)
+    if changed:
+        wanted = _changed_python_files(c, changed)
+        files = [x for x in files if os.path.normpath(x) in wanted]
+        if not files:
+            print("No changed Python files to format.")
+            return []
+    index_path = cache_path(c, "blacken.json")
+    # Anything affecting black's output invalidates the index; --check and
+    # --diff don't, as files black left well formatted are so either way.
+    key = "-l {} ({}) {}".format(
+        line_length, _black_version(), _black_config()
+    )
+    index = _load_index(index_path, key)
+    stale = [x for x in files if index.get(x) != _stamp(x)]
+    # Round-robin, so each batch gets a mix of (likely) big and small files
+    count = int(workers)
+    batches = [stale[i::count] for i in range(count)]
+    batches = [x for x in batches if x]
+
+    def run(batch):
+        began = time.time()
+        result = c.run(
+            "{} {}".format(black_command_line, _quoted(batch)),
+            hide=True,
+            warn=True,
+            in_stream=False,
+        )
+        return result, time.time() - began
+
+    if not stale:
+        print("All {} files unchanged since last run.".format(len(files)))
+    runs = parallel(run, batches, len(batches))
+    results = [x[0] for x in runs]
+    for batch, result in zip(batches, results):
+        if not c.config.run.hide:
+            print(result.stdout, end="")
+            print(result.stderr, end="", file=sys.stderr)
+        # Only a passing --check, or black actually (re)writing the files,
+        # proves them well formatted; --diff alone exits 0 regardless.
+        if result.ok and (check or not diff):
+            # Stat again, as black may have just rewritten these
+            index.update((x, _stamp(x)) for x in batch)
+    _save_index(index_path, key, {x: index[x] for x in files if x in index})
+    if report:
+        statuses = dict.fromkeys(files, "cached")
+        batch_data = []
+        for batch, (result, elapsed) in zip(batches, runs):
+            statuses.update(_black_statuses(batch, result.stderr))
+            batch_data.append(
+                {
+                    "files": batch,
+                    "seconds": elapsed,
+                    "exited": result.exited,
+                }
+            )
+        _write_report(
+            c,
+            report,
+            "blacken",
+            {
+                "command": black_command_line,
+                "seconds": time.time() - start,
+                "batches": batch_data,
+                "files": statuses,
+            },
+        )
+    failures = [x for x in results if x.failed]
+    if failures and not c.config.run.warn:
+        raise Exit(code=failures[0].exited)
+    return results
+
+
+# How black (on stderr) reports what it did with each file that it didn't
+# leave alone.
+_BLACK_STATUSES = {
+    "would reformat ": "would reformat",
+    "reformatted ": "reformatted",
+    "error: cannot format ": "error",
+}
+
+
+def _black_statuses(batch, stderr):
+    """
+    Return ``{path: status}`` for ``batch``, per black's ``stderr``.
+    """
+    statuses = dict.fromkeys(batch, "unchanged")
+    # black prints paths normalized (e.g. 'a.py' when given './a.py'), or
+    # absolute when outside its idea of the project root.
+    names = {}
+    for path in batch:
+        normalized = os.path.normpath(path)
+        names[normalized] = names[os.path.abspath(normalized)] = path
+    for line in stderr.splitlines():
+        for prefix, status in _BLACK_STATUSES.items():
+            if not line.startswith(prefix):
+                continue
+            offset = len(prefix)
+            rest = line[offset:]
+            # Errors look like 'error: cannot format <path>: <reason>'
+            for name, path in names.items():
+                if rest == name or rest.startswith(name + ": "):
+                    statuses[path] = status
+    return statuses
+
+
+def _check_report(report):
+    if report not in (None, "json"):
+        raise Exit("Unknown report format {!r}!".format(report))
+
+
+def _write_report(c, report, name, data):
+    """
+    Write ``data`` as a ``report``-format report, returning its path.
+
+    Reports live in ``reports/<name>.json`` within the cache directory, and
+    get ``checker`` and ``time`` (when the report was written) keys added.
+    """
+    path = cache_path(c, "reports", "{}.json".format(name))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = dict(data, checker=name, time=time.time())
+    with open(path, "w") as fd:
+        json.dump(data, fd, indent=2, sort_keys=True)
+    print("Wrote {} report to {}".format(name, path))
+    return path
+
+
+def python_files(folders, exclude=()):
+    """
+    Return sorted paths of the ``.py`` files within ``folders``.
 
-    cmd = "find {} -name '*.py'{} | xargs {}".format(
-        " ".join(folders), find_opts, black_command_line
+    Paths are as ``find`` would spell them, e.g. ``./foo/bar.py`` when
+    searching ``.``. Files and folders whose path or name match any of the
+    ``exclude`` glob patterns are skipped (and not descended into.)
+
+    .. versionadded:: 4.1
+    """
+
+    found = []
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [
+                x
+                for x in dirs
+                if not _excluded(os.path.join(root, x), exclude)
+            ]
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith(".py") and not _excluded(path, exclude):
+                    found.append(path)
+    return sorted(set(found))
+
+
+def _excluded(path, exclude):
+    """
+    Whether ``path``'s name, or the path itself, matches any ``exclude`` glob.
+
+    Paths are also compared in normalized form, so e.g. ``./build/x.py``
+    matches ``build/*``.
+    """
+    name = os.path.basename(path)
+    normalized = os.path.normpath(path)
+    return any(
+        fnmatch(path, x)
+        or fnmatch(name, x)
+        or fnmatch(normalized, os.path.normpath(x))
+        for x in exclude
     )
-    c.run(cmd, pty=True)
 
 
-@task
-def lint(c):
+def _within_excluded(path, exclude):
+    """
+    Whether ``path``, or any folder it's within, is `_excluded`.
+    """
+    while path and path != os.curdir:
+        if _excluded(path, exclude):
+            return True
+        path = os.path.dirname(path)
+    return False
+
+
+def _black_version():
+    try:
+        return version("black")
+    except PackageNotFoundError:
+        return None
+
+
+def _black_config():
+    """
+    Return black's settings from ``./pyproject.toml``, as a JSON string.
+    """
+    try:
+        config = _read_pyproject_toml("pyproject.toml")
+    except BuildException:
+        config = {}
+    return json.dumps(config.get("tool", {}).get("black", {}), sort_keys=True)
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _load_index(path, key):
+    """
+    Load a ``{path: stamp}`` index of known-good files, if it matches ``key``.
+    """
+    try:
+        with open(path) as fd:
+            data = json.load(fd)
+    except (OSError, ValueError):
+        return {}
+    if data.get("key") != key:
+        return {}
+    return data.get("files", {})
+
+
+def _save_index(path, key, files):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as fd:
+        json.dump({"key": key, "files": files}, fd)
+
+
+def _quoted(paths):
+    """
+    Return ``paths`` as shell-quoted, space-separated command arguments.
+    """
+    return " ".join(shlex.quote(x) for x in paths)
+
+
+def _changed_python_files(c, changed):
+    """
+    Return the set of changed ``.py`` files per a ``changed`` task argument.
+    """
+    base = changed if isinstance(changed, str) else "HEAD"
+    return {x for x in changed_files(c, base) if x.endswith(".py")}
+
+
+@task(optional=["changed"])
+def lint(c, changed=None, cache=False, report=None):
     """
     Apply linting.
 
+    :param changed:
+        Only lint ``.py`` files which git says were added or modified since
+        this base ref (or ``HEAD``, when given as a bare CLI flag.) See
+        `blacken` for details. Default: ``None`` (lint everything.)
+    :param bool cache:
+        Whether to cache each file's diagnostics, keyed on a hash of its
+        contents, the versions of ``flake8`` and its plugins, and the
+        project's flake8 config files. Files to lint are found per flake8's
+        configured ``exclude`` & ``extend-exclude`` settings; only those
+        missing from the cache are handed to ``flake8``, and cached
+        diagnostics are replayed for the rest. Entries live under
+        ``lint/`` in the cache directory (see
+        `invocations.util.cache_path`); the least recently used ones are
+        evicted past ``lint.cache_size`` entries (default: ``10000``).
+        Honors the ``lint.cache`` config option. Default: ``False``.
+    :param str report:
+        Set to ``"json"`` to also write a machine-readable report to
+        ``reports/lint.json`` in the cache directory. It includes each file's
+        status (``clean`` or ``failed``), its diagnostics, whether they came
+        from the cache, plus the overall exit code and wall time. Default:
+        ``None``.
+
     .. versionadded:: 3.2
+    .. versionchanged:: 4.1
+        Added the ``changed``, ``cache`` and ``report`` arguments, and started
+        returning the `Result`.
     """
     # TODO: configurable and/or switch to ruff
-    c.run("flake8", warn=True, pty=True)
+    _check_report(report)
+    start = time.time()
+    config = c.config.get("lint", {})
+    cache = cache or config.get("cache", False)
+    files = None
+    exclude = _flake8_excludes()
+    if changed:
+        # flake8 lints files named explicitly even if its config excludes them
+        files = sorted(
+            x
+            for x in _changed_python_files(c, changed)
+            if not _within_excluded(x, exclude)
+        )
+        if not files:
+            print("No changed Python files to lint.")
+            return
+    if not (cache or report):
+        cmd = "flake8"
+        if files:
+            cmd += " " + _quoted(files)
+        return c.run(cmd, warn=True, pty=True)
+    if files is None:
+        files = python_files(["."], exclude)
+    files = [os.path.normpath(x) for x in files]
+    hits = set()
+    if cache:
+        result, hits = _cached_lint(c, files, config.get("cache_size", 10000))
+    else:
+        result = c.run(
+            "flake8 {}".format(_quoted(files)), warn=True, hide=True
+        )
+        if not c.config.run.hide:
+            print(result.stdout, end="")
+            print(result.stderr, end="", file=sys.stderr)
+    if report:
+        diagnostics = {x: [] for x in files}
+        for line in result.stdout.splitlines():
+            path = line.split(":", 1)[0]
+            if path in diagnostics:
+                diagnostics[path].append(line)
+        statuses = {
+            path: {
+                "status": "failed" if lines else "clean",
+                "diagnostics": lines,
+                "cached": path in hits,
+            }
+            for path, lines in diagnostics.items()
+        }
+        _write_report(
+            c,
+            report,
+            "lint",
+            {
+                "command": result.command,
+                "exited": result.exited,
+                "seconds": time.time() - start,
+                "files": statuses,
+            },
+        )
+    return result
+
+
+# flake8's own default 'exclude' setting.
+_FLAKE8_EXCLUDE = [
+    ".svn",
+    "CVS",
+    ".bzr",
+    ".hg",
+    ".git",
+    "__pycache__",
+    ".tox",
+    ".nox",
+    ".eggs",
+    "*.egg",
+]
+# Where flake8 looks for config, in order; the first with a section wins.
+_FLAKE8_CONFIGS = ["setup.cfg", "tox.ini", ".flake8"]
 
 
-@task(default=True)
-def all_(c):
+def _flake8_config():
+    """
+    Return the ``[flake8]`` section flake8 would use here, as a dict.
+    """
+    for name in _FLAKE8_CONFIGS:
+        parser = configparser.RawConfigParser()
+        try:
+            parser.read(name)
+        except configparser.Error:
+            continue
+        if parser.has_section("flake8"):
+            return dict(parser["flake8"])
+    return {}
+
+
+def _flake8_excludes():
+    """
+    Return the exclude patterns flake8 is configured with, plus our cache dir.
+
+    As with flake8, a configured ``exclude`` replaces its defaults and
+    ``extend-exclude`` adds to them.
+    """
+    config = _flake8_config()
+
+    def patterns(*keys):
+        for key in keys:
+            if key in config:
+                return [x for x in re.split(r"[,\s]+", config[key]) if x]
+        return None
+
+    exclude = patterns("exclude")
+    if exclude is None:
+        exclude = list(_FLAKE8_EXCLUDE)
+    exclude += patterns("extend-exclude", "extend_exclude") or []
+    return exclude + [".invocations"]
+
+
+def _flake8_setup():
+    """
+    Describe the installed flake8 and its plugins, e.g. for cache keys.
+    """
+    found = set()
+    for dist in distributions():
+        groups = {x.group for x in dist.entry_points}
+        name = dist.metadata["Name"]
+        if name == "flake8" or any(x.startswith("flake8.") for x in groups):
+            found.add("{} {}".format(name, dist.version))
+    return ", ".join(sorted(found)) or "flake8"
+
+
+def _lint_cache_keys(files):
+    """
+    Return ``{path: key}`` for ``files``, per path, contents & flake8 setup.
+
+    Paths are part of the key as flake8's results may depend on them (e.g.
+    ``per-file-ignores``), even for files with identical contents.
+    """
+    setup = hashlib.sha256(_flake8_setup().encode())
+    for name in _FLAKE8_CONFIGS:
+        if os.path.exists(name):
+            with open(name, "rb") as fd:
+                setup.update(name.encode() + b"\0" + fd.read())
+    keys = {}
+    for path in files:
+        digest = setup.copy()
+        digest.update(os.path.normpath(path).encode() + b"\0")
+        with open(path, "rb") as fd:
+            digest.update(fd.read())
+        keys[path] = digest.hexdigest()
+    return keys
+
+
+def _cached_lint(c, files, size):
+    """
+    Run flake8 on whichever of ``files`` lack cached diagnostics.
+
+    :returns:
+        A ``(result, hits)`` tuple: a `Result` combining cached & fresh
+        diagnostics, and the set of files whose diagnostics were cached.
+    """
+    root = cache_path(c, "lint")
+    keys = _lint_cache_keys(files)
+    found, misses = {}, []
+    for path in files:
+        entry = root / keys[path]
+        try:
+            with open(entry) as fd:
+                found[path] = json.load(fd)
+            os.utime(entry)  # Mark as recently used
+        except (OSError, ValueError):
+            misses.append(path)
+    cmd = "flake8"
+    if misses:
+        cmd = "flake8 {}".format(_quoted(misses))
+        result = c.run(cmd, warn=True, hide=True)
+        lines = result.stdout.splitlines()
+        # 1 means 'found problems'; anything else, the run itself went wrong
+        if result.exited not in (0, 1):
+            if not c.config.run.hide:
+                print(result.stdout, end="")
+                print(result.stderr, end="", file=sys.stderr)
+            return result, set(found)
+        root.mkdir(parents=True, exist_ok=True)
+        for path in misses:
+            # Stored sans path, which is already part of the key
+            prefix = path + ":"
+            start = len(prefix)
+            found[path] = [x[start:] for x in lines if x.startswith(prefix)]
+            with open(root / keys[path], "w") as fd:
+                json.dump(found[path], fd)
+        _evict(root, size)
+    output = "".join(
+        "{}:{}\n".format(path, x) for path in files for x in found[path]
+    )
+    if not c.config.run.hide:
+        print(output, end="")
+    result = Result(stdout=output, command=cmd, exited=1 if output else 0)
+    return result, set(found) - set(misses)
+
+
+def _evict(root, size):
+    """
+    Delete all but the ``size`` most recently used entries under ``root``.
+    """
+    entries = sorted(root.iterdir(), key=lambda x: x.stat().st_mtime)
+    for entry in entries[: max(len(entries) - size, 0)]:
+        entry.unlink()
+
+
+@task(default=True, optional=["changed"])
+def all_(c, changed=None, report=None):
     """
     Run all common formatters/linters for the project.
 
+    Runs ``black --check`` (via `blacken`), ``flake8`` (via `lint`) and any
+    extra checkers concurrently. Each checker's output is buffered and then
+    printed in one block. A table of each checker's status and run time
+    follows. Exits non-zero if any checker failed.
+
+    Returns a dict mapping checker names to lists of their `Result` objects.
+
+    Extra checkers come from the ``checks.extra`` config setting. It maps
+    names to shell commands, e.g. ``{"mypy": "mypy mypackage"}``.
+
+    :param changed:
+        Only check files changed since the given base ref (or ``HEAD``); see
+        `blacken`. Not applied to extra checkers. Default: ``None``.
+    :param str report:
+        Handed to `blacken` and `lint`, e.g. ``"json"`` to have each write a
+        report file. Default: ``None``.
+
     .. versionadded:: 3.2
+    .. versionchanged:: 4.1
+        Added the ``changed`` and ``report`` arguments and the
+        ``checks.extra`` setting, and switched from serially reformatting &
+        linting to concurrently checking.
     """
-    # TODO: contextmanager config, if we don't already have that
-    c.config.run.echo = True
-    blacken(c)
-    lint(c)
+    checkers = [
+        (
+            "black",
+            lambda ctx: blacken(
+                ctx, check=True, changed=changed, report=report
+            ),
+        ),
+        ("flake8", lambda ctx: lint(ctx, changed=changed, report=report)),
+    ]
+    extra = c.config.get("checks", {}).get("extra", {})
+    for name, command in sorted(extra.items()):
+        # (No stdin: concurrent checkers can't sensibly share it)
+        checkers.append(
+            (name, lambda ctx, cmd=command: ctx.run(cmd, in_stream=False))
+        )
+
+    def run(checker):
+        ctx = Context(config=c.config.clone())
+        ctx.config.run.hide = True
+        ctx.config.run.warn = True
+        start = time.time()
+        outcome = checker[1](ctx)
+        if not isinstance(outcome, list):
+            outcome = [] if outcome is None else [outcome]
+        return outcome, time.time() - start
+
+    outcomes = parallel(run, checkers, len(checkers))
+    rows, failures, by_name = [], [], {}
+    for (name, _), (results, elapsed) in zip(checkers, outcomes):
+        by_name[name] = results
+        print("=== {} ===".format(name))
+        for result in results:
+            print(result.stdout, end="")
+            print(result.stderr, end="", file=sys.stderr)
+        failed = [x for x in results if x.failed]
+        failures.extend(failed)
+        status = "FAILED" if failed else "passed" if results else "skipped"
+        rows.append((name, status, elapsed))
+    headers = ["Checker", "Status", "Seconds"]
+    print(tabulate(rows, headers=headers, floatfmt=".2f"))
+    if failures and not c.config.run.warn:
+        raise Exit(code=failures[0].exited)
+    return by_name
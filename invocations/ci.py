@@ -26,8 +26,16 @@ Thus, the pattern is:
     your own config files.
 """
 
+import hashlib
+import json
+import os
+import shlex
+import sys
+
 from invoke import task, Collection
 
+from .util import cache_path
+
 
 @task
 def make_sudouser(c):
@@ -35,6 +43,12 @@ def make_sudouser(c):
     Create a passworded sudo-capable user.
 
     Used by other tasks to execute the test suite so sudo tests work.
+
+    Does nothing if the user already exists (e.g. in a reused container).
+
+    .. versionchanged:: 4.1
+        Skip creation when the user already exists, and do everything in a
+        single ``sudo`` call.
     """
     user = c.ci.sudo.user
     password = c.ci.sudo.password
@@ -43,12 +57,17 @@ def make_sudouser(c):
     # "--groups xxx" for (non-passwordless) sudo access, eg 'sudo' group on
     # Debian, plus any others, eg shared group membership with regular user for
     # writing out artifact files (assuming $HOME is g+w, which it is on Circle)
-    c.sudo(
-        "useradd {} --create-home --groups {}".format(user, ",".join(groups))
+    useradd = "useradd {} --create-home --groups {}".format(
+        user, ",".join(groups)
+    )
+    # Password set noninteractively via chpasswd, in the same (root) shell
+    chpasswd = "echo {} | chpasswd".format(
+        shlex.quote("{}:{}".format(user, password))
     )
-    # Password set noninteractively via chpasswd (assumes invoking user itself
-    # is able to passwordless sudo; this is true on CircleCI)
-    c.run("echo {}:{} | sudo chpasswd".format(user, password))
+    script = "id -u {} >/dev/null 2>&1 || {{ {} && {}; }}".format(
+        user, useradd, chpasswd
+    )
+    c.sudo("sh -c {}".format(shlex.quote(script)))
 
 
 @task
@@ -75,20 +94,119 @@ def sudo_run(c, command):
 
 
 @task
-def make_sshable(c):
+def make_sshable(c, snapshot=False):
     """
     Set up passwordless SSH keypair & authorized_hosts access to localhost.
+
+    Does nothing if the user already has an ``id_rsa`` key.
+
+    :param bool snapshot:
+        Whether to restore the user's ``.ssh`` directory from a snapshot
+        tarball saved by an earlier run, instead of generating a new key; and
+        to save such a snapshot after generating one. Snapshots live in the
+        ``ci`` folder of the cache directory (see
+        `invocations.util.cache_path`; point CI caching at it), are named
+        after a hash of the ``ci.sudo`` config, and are checked against a
+        SHA-256 sidecar file before use; bad ones are ignored and replaced.
+        Honors the ``ci.snapshot`` config option. Default: ``False``.
+
+    .. versionchanged:: 4.1
+        Skip setup when a key already exists, do everything in a single
+        `sudo_run` call, and added the ``snapshot`` argument.
     """
+    snapshot = snapshot or c.ci.get("snapshot", False)
     user = c.ci.sudo.user
     home = "~{}".format(user)
     # Run sudo() as the new sudo user; means less chown'ing, etc.
     c.config.sudo.user = user
     c.config.sudo.password = c.ci.sudo.password
+    if snapshot and restore_snapshot(c, snapshot_path(c)):
+        return
     ssh_dir = "{}/.ssh".format(home)
-    for cmd in ("mkdir {0}", "chmod 0700 {0}"):
-        sudo_run(c, cmd.format(ssh_dir, user))
-    sudo_run(c, "ssh-keygen -t rsa -f {}/id_rsa -N ''".format(ssh_dir))
-    sudo_run(c, f"cp {ssh_dir}/id_rsa.pub {ssh_dir}/authorized_keys")
+    # One su session for all steps; skipped entirely if a key already exists
+    steps = [
+        "mkdir -p {0}",
+        "chmod 0700 {0}",
+        "ssh-keygen -q -t rsa -f {0}/id_rsa -N ''",
+        "cp {0}/id_rsa.pub {0}/authorized_keys",
+    ]
+    script = "test -f {}/id_rsa || ({})".format(
+        ssh_dir, " && ".join(steps).format(ssh_dir)
+    )
+    sudo_run(c, script)
+    if snapshot:
+        save_snapshot(c, snapshot_path(c))
+
+
+def snapshot_path(c):
+    """
+    Return the ``.ssh`` snapshot path for the current ``ci.sudo`` config.
+
+    .. versionadded:: 4.1
+    """
+    config = c.ci.sudo
+    settings = json.dumps({x: config[x] for x in config}, sort_keys=True)
+    key = hashlib.sha256(settings.encode()).hexdigest()[:16]
+    return cache_path(c, "ci", "sshable-{}.tar.gz".format(key)).resolve()
+
+
+def _digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _digest_path(path):
+    return path.with_name(path.name + ".sha256")
+
+
+def save_snapshot(c, path):
+    """
+    Save the CI user's ``.ssh`` directory as a tarball at ``path``.
+
+    The tarball is made as root, then handed to the invoking user, alongside
+    a ``<path>.sha256`` file holding its checksum.
+
+    .. versionadded:: 4.1
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    quoted = shlex.quote(str(path))
+    script = "tar -C ~{} -czf {} .ssh && chown {}:{} {}".format(
+        c.ci.sudo.user, quoted, os.getuid(), os.getgid(), quoted
+    )
+    c.run("sudo sh -c {}".format(shlex.quote(script)))
+    _digest_path(path).write_text(_digest(path) + "\n")
+
+
+def restore_snapshot(c, path):
+    """
+    Restore the CI user's ``.ssh`` directory from a tarball at ``path``.
+
+    Nothing is restored over an existing ``id_rsa`` key.
+
+    :returns:
+        ``True`` if the snapshot exists and matches its checksum file (and
+        thus was restored), ``False`` otherwise.
+
+    .. versionadded:: 4.1
+    """
+    try:
+        expected = _digest_path(path).read_text().strip()
+        valid = _digest(path) == expected
+    except OSError:
+        return False
+    if not valid:
+        print("Ignoring corrupt snapshot {}!".format(path), file=sys.stderr)
+        return False
+    user = c.ci.sudo.user
+    unpack = "tar -C ~{0} -xzf {1} && chown -R {0}: ~{0}/.ssh".format(
+        user, shlex.quote(str(path))
+    )
+    script = "test -f ~{}/.ssh/id_rsa || ({})".format(user, unpack)
+    c.run("sudo sh -c {}".format(shlex.quote(script)))
+    return True
 
 
 ns = Collection(make_sudouser, sudo_run, make_sshable)
@@ -99,7 +217,8 @@ ns.configure(
                 "user": "invoker",
                 "password": "secret",
                 "groups": ["sudo", "circleci"],
-            }
+            },
+            "snapshot": False,
         }
     }
 )
@@ -5,13 +5,20 @@ Tasks for managing Sphinx documentation trees.
 from os.path import join, isdir
 from tempfile import mkdtemp
 from shutil import rmtree
+import re
 import sys
 
 from invoke import task, Collection, Context
 
+from . import profiling
+from .jobs import default_jobs
 from .watch import make_handler, observe
 
 
+# Sphinx's parallelism flag, in any of its spellings: -j N, -jN, --jobs N...
+_JOBS_OPT = re.compile(r"(?:^|\s)(?:-j|--jobs\b)")
+
+
 # Underscored func name to avoid shadowing kwargs in build()
 @task(name="clean")
 def _clean(c):
@@ -41,6 +48,7 @@ def _browse(c):
         "nitpick": "Build with stricter warnings/errors enabled",
         "source": "Source directory; overrides config setting",
         "target": "Output directory; overrides config setting",
+        "jobs": "Parallel sphinx-build processes (default: machine-sized)",
     },
 )
 def build(
@@ -51,9 +59,21 @@ def build(
     opts=None,
     source=None,
     target=None,
+    jobs=None,
 ):
     """
     Build the project's Sphinx docs.
+
+    Unless ``opts`` already sets ``-j``/``--jobs`` (in any spelling), Sphinx
+    is asked to build with ``jobs`` processes, defaulting to however many
+    this machine can handle (see `invocations.jobs.default_jobs`.) Sphinx
+    itself falls back to serial builds when an extension isn't parallel-safe,
+    but warns about it, which is fatal under ``-W``; so when warnings are
+    errors (e.g. ``nitpick``), parallel builds only happen if ``jobs`` is
+    given explicitly.
+
+    .. versionchanged:: 4.1
+        Added the ``jobs`` argument.
     """
     if clean:
         _clean(c)
@@ -61,6 +81,14 @@ def build(
         opts = ""
     if nitpick:
         opts += " -n -W -T"
+    if jobs:
+        jobs = int(jobs)
+    elif "-W" in opts.split():
+        jobs = 1
+    else:
+        jobs = default_jobs(c)
+    if jobs > 1 and not _JOBS_OPT.search(opts):
+        opts += " -j {}".format(jobs)
     cmd = "sphinx-build{} {} {}".format(
         (" " + opts) if opts else "",
         source or c.sphinx.source,
@@ -143,7 +171,12 @@ www = _site("www", "the main project website.")
 def sites(c):
     """
     Build both doc sites w/ maxed nitpicking.
+
+    .. versionchanged:: 4.1
+        Honor the ``invocations.profile`` setting (see
+        `invocations.profiling`.)
     """
+    profiling.configure(c)
     # TODO: This is super lolzy but we haven't actually tackled nontrivial
     # in-Python task calling yet, so we do this to get a copy of 'our' context,
     # which has been updated with the per-collection config data of the
@@ -6,6 +6,92 @@ in multiple other modules.
 """
 
 import os
+from collections import namedtuple
+from functools import lru_cache
+
+from .jobs import cpu_count
+
+
+#: What we know about the CI environment we're running under; see
+#: `ci_environment`.
+#:
+#: .. versionadded:: 4.1
+CIEnvironment = namedtuple(
+    "CIEnvironment", "provider node_index node_total tool_cache cpus"
+)
+
+# Known CI providers, as: name, sentinel env var (must be non-empty), env vars
+# for this node's index & the total node count in parallel builds, whether
+# that index starts at 1, and an env var naming the provider's tool cache.
+_PROVIDERS = [
+    ("circleci", "CIRCLECI", "CIRCLE_NODE_INDEX", "CIRCLE_NODE_TOTAL", 0, ""),
+    ("travis", "TRAVIS", "", "", 0, "CASHER_DIR"),
+    ("github", "GITHUB_ACTIONS", "", "", 0, "RUNNER_TOOL_CACHE"),
+    ("gitlab", "GITLAB_CI", "CI_NODE_INDEX", "CI_NODE_TOTAL", 1, ""),
+    (
+        "buildkite",
+        "BUILDKITE",
+        "BUILDKITE_PARALLEL_JOB",
+        "BUILDKITE_PARALLEL_JOB_COUNT",
+        0,
+        "",
+    ),
+    (
+        "azure",
+        "TF_BUILD",
+        "SYSTEM_JOBPOSITIONINPHASE",
+        "SYSTEM_TOTALJOBSINPHASE",
+        1,
+        "AGENT_TOOLSDIRECTORY",
+    ),
+    ("jenkins", "JENKINS_URL", "", "", 0, ""),
+]
+
+
+def _int(name):
+    try:
+        return int(os.environ.get(name, ""))
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=None)
+def ci_environment():
+    """
+    Identify the CI provider we're running under, and what it offers us.
+
+    Providers are recognized by their (non-empty) sentinel env vars, e.g.
+    ``CIRCLECI`` or ``GITHUB_ACTIONS``. Parallel node info is normalized so
+    ``node_index`` always starts at 0; it and ``node_total`` are ``None`` when
+    the provider (or build) doesn't say. ``tool_cache`` is where the provider
+    keeps preinstalled or cached toolchains (e.g. GitHub's
+    ``RUNNER_TOOL_CACHE``), or ``None`` when unknown; it is *not* a place for
+    project caches such as our own (see ``invocations.util.cache_path``.)
+    ``cpus`` is how many CPUs this process may use.
+
+    The result is computed once per process; call
+    ``ci_environment.cache_clear()`` to force a fresh look at ``os.environ``.
+
+    :returns: A `CIEnvironment`, or ``None`` if we don't appear to be on CI.
+
+    .. versionadded:: 4.1
+    """
+    for name, sentinel, index, total, base, cache in _PROVIDERS:
+        if not os.environ.get(sentinel, False):
+            continue
+        node_index, node_total = _int(index), _int(total)
+        if node_index is None or node_total is None:
+            node_index = node_total = None
+        else:
+            node_index -= base
+        return CIEnvironment(
+            provider=name,
+            node_index=node_index,
+            node_total=node_total,
+            tool_cache=os.environ.get(cache) or None,
+            cpus=cpu_count(),
+        )
+    return None
 
 
 def in_ci():
@@ -15,8 +101,9 @@ def in_ci():
     Checks for CI system env vars such as ``CIRCLECI`` or ``TRAVIS`` -
     specifically whether they exist and are non-empty. The actual value is not
     currently relevant, as long as it's not the empty string.
+
+    .. versionchanged:: 4.1
+        Recognize more CI providers (see `ci_environment`), and only check the
+        environment once per process.
     """
-    for sentinel in ("CIRCLECI", "TRAVIS"):
-        if os.environ.get(sentinel, False):
-            return True
-    return False
+    return ci_environment() is not None
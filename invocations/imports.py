@@ -0,0 +1,199 @@
+"""
+Import-dependency indexing of Python source trees.
+
+Used to answer "which test modules could possibly care about this changed
+file?", e.g. so file-watching test tasks need only rerun affected tests.
+
+.. versionadded:: 4.1
+"""
+
+import ast
+import os
+from collections import defaultdict
+from pathlib import Path
+
+
+def _is_test_module(path):
+    """
+    Does ``path`` look like a runnable test module (vs support code)?
+    """
+    path = Path(path)
+    if path.suffix != ".py" or path.name == "conftest.py":
+        return False
+    return not any(x.startswith("_") for x in path.parts)
+
+
+def find_test_modules(root="tests"):
+    """
+    Return sorted list of test module paths found under ``root``.
+
+    Anything whose filename or parent directories begin with an underscore
+    (e.g. ``tests/_support/``), plus ``conftest.py`` files, is skipped.
+    """
+    found = []
+    for path in Path(root).rglob("*.py"):
+        if _is_test_module(path.relative_to(root)):
+            found.append(str(path))
+    return sorted(found)
+
+
+class ImportIndex:
+    """
+    Index of which modules import which, across one or more source folders.
+
+    Module names are derived from file paths relative to each folder's
+    *parent*, so e.g. indexing ``src/mypkg`` yields names like
+    ``mypkg.sub``, and indexing ``tests`` yields ``tests.main``. Only imports
+    of modules which are themselves part of the index are tracked (i.e.
+    third-party and stdlib imports are ignored.)
+
+    :param folders: Iterable of directory paths to scan for ``.py`` files.
+    :param str tests:
+        Which folder holds test modules; it is indexed too, if not already
+        present in ``folders``. Default: ``"tests"``.
+    """
+
+    def __init__(self, folders, tests="tests"):
+        self.tests = Path(tests)
+        self.folders = [Path(x) for x in folders]
+        if self.tests not in self.folders:
+            self.folders.append(self.tests)
+        # Module name <-> file path
+        self.paths = {}
+        self.names = {}
+        # Module name -> raw (unresolved) names imported by that module
+        self.raw = {}
+        for folder in self.folders:
+            for root, dirs, files in os.walk(folder):
+                dirs[:] = [x for x in dirs if not x.startswith(".")]
+                for name in files:
+                    if name.endswith(".py"):
+                        self._add(Path(root, name), folder)
+
+    def _add(self, path, folder):
+        parts = list(path.relative_to(folder.parent).with_suffix("").parts)
+        is_package = parts[-1] == "__init__"
+        if is_package:
+            parts.pop()
+        name = ".".join(parts)
+        self.paths[name] = path
+        self.names[path] = name
+        self.raw[name] = self._parse(path, name, is_package)
+
+    def _parse(self, path, name, is_package):
+        try:
+            tree = ast.parse(path.read_bytes(), filename=str(path))
+        except (OSError, SyntaxError, ValueError):
+            return set()
+        package = name if is_package else name.rpartition(".")[0]
+        imported = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imported.update(x.name for x in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module or ""
+                if node.level:
+                    anchor = package.split(".") if package else []
+                    anchor = anchor[: len(anchor) - (node.level - 1)]
+                    base = ".".join(anchor + ([base] if base else []))
+                if base:
+                    imported.add(base)
+                # 'from pkg import thing' may be importing submodule 'thing'
+                imported.update(
+                    "{}.{}".format(base, x.name) if base else x.name
+                    for x in node.names
+                )
+        return imported
+
+    def _resolve(self, name):
+        """
+        Yield indexed modules executed by importing ``name`` (incl. parents).
+        """
+        parts = name.split(".")
+        for i in range(len(parts), 0, -1):
+            candidate = ".".join(parts[:i])
+            if candidate in self.paths:
+                yield candidate
+
+    def _folder_for(self, path):
+        for folder in self.folders:
+            try:
+                path.relative_to(folder)
+            except ValueError:
+                continue
+            return folder
+
+    def update(self, path):
+        """
+        (Re-)index a single file, e.g. after it has been modified or created.
+
+        Deleted files are dropped from the index; paths outside the indexed
+        folders, or which aren't Python files, are ignored.
+        """
+        path = Path(os.path.normpath(path))
+        folder = self._folder_for(path)
+        if folder is None or path.suffix != ".py":
+            return
+        if path.exists():
+            self._add(path, folder)
+        elif path in self.names:
+            name = self.names.pop(path)
+            del self.paths[name]
+            del self.raw[name]
+
+    def dependents(self, name):
+        """
+        Return set of module names which import ``name``, transitively.
+
+        The result includes ``name`` itself.
+        """
+        reverse = defaultdict(set)
+        for importer, imported in self.raw.items():
+            for each in imported:
+                for target in self._resolve(each):
+                    reverse[target].add(importer)
+        seen, todo = {name}, [name]
+        while todo:
+            for importer in reverse[todo.pop()]:
+                if importer not in seen:
+                    seen.add(importer)
+                    todo.append(importer)
+        return seen
+
+    def affected_tests(self, path):
+        """
+        Return sorted list of test module paths affected by a change to
+        ``path``.
+
+        Returns ``None`` when there's no way to tell - e.g. the changed file
+        is a ``conftest.py``, or a Python file which isn't in the index - in
+        which case callers should assume everything is affected. Directories
+        and non-Python files (e.g. ``__pycache__/*.pyc``) affect nothing.
+        """
+        path = Path(os.path.normpath(path))
+        if path.name == "conftest.py":
+            return None
+        if path.suffix != ".py" or path.is_dir():
+            return []
+        name = self.names.get(path)
+        if name is None:
+            return None
+        return sorted(
+            str(self.paths[x])
+            for x in self.dependents(name)
+            if self._is_test(self.paths[x])
+        )
+
+    def refresh(self, path):
+        """
+        `update` the index for ``path``, then return its `affected_tests`.
+        """
+        self.update(path)
+        return self.affected_tests(path)
+
+    def _is_test(self, path):
+        try:
+            relative = path.relative_to(self.tests)
+        except ValueError:
+            return False
+        return _is_test_module(relative)
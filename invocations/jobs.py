@@ -0,0 +1,107 @@
+"""
+How much concurrency this machine (or container) can sensibly handle.
+
+Used to size the worker pools of tasks which can spread work across threads or
+subprocesses, e.g. ``invocations.checks.blacken`` or
+``invocations.packaging.release.test_install``.
+
+.. versionadded:: 4.1
+"""
+
+import math
+import os
+
+
+#: Roughly how much memory, in bytes, to budget per concurrent job.
+MEMORY_PER_JOB = 512 * 1024**2
+
+_CGROUP = "/sys/fs/cgroup"
+_MEMINFO = "/proc/meminfo"
+
+
+def _read(path):
+    try:
+        with open(path) as fd:
+            return fd.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_cpus():
+    """
+    Return the cgroup CPU quota (as a possibly fractional CPU count) or None.
+    """
+    # cgroup v2: "<quota> <period>", quota may be "max"
+    line = _read(os.path.join(_CGROUP, "cpu.max"))
+    if line:
+        quota, _, period = line.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+    # cgroup v1: quota of -1 means unlimited
+    quota = _read(os.path.join(_CGROUP, "cpu", "cpu.cfs_quota_us"))
+    period = _read(os.path.join(_CGROUP, "cpu", "cpu.cfs_period_us"))
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def cpu_count():
+    """
+    Return how many CPUs this process may actually use.
+
+    That is, the smallest of: the CPUs in this process' affinity mask (where
+    supported; otherwise all of them) and its cgroup CPU quota, if any
+    (rounded up.)
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not all platforms have it
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpus()
+    if quota:
+        cpus = min(cpus, math.ceil(quota))
+    return max(cpus, 1)
+
+
+def available_memory():
+    """
+    Return how many bytes of memory are available to us, or None if unknown.
+
+    Uses the smaller of the kernel's ``MemAvailable`` estimate and any cgroup
+    memory limit (minus current usage).
+    """
+    found = []
+    for line in (_read(_MEMINFO) or "").splitlines():
+        if line.startswith("MemAvailable:"):
+            found.append(int(line.split()[1]) * 1024)
+    for limit, usage in (
+        ("memory.max", "memory.current"),
+        ("memory/memory.limit_in_bytes", "memory/memory.usage_in_bytes"),
+    ):
+        limit = _read(os.path.join(_CGROUP, limit))
+        usage = _read(os.path.join(_CGROUP, usage))
+        # v1 signals 'unlimited' with an absurdly huge number, which is fine
+        if limit and limit.isdigit() and usage and usage.isdigit():
+            found.append(max(int(limit) - int(usage), 0))
+    return min(found) if found else None
+
+
+def default_jobs(c=None, memory_per_job=MEMORY_PER_JOB):
+    """
+    Return a sensible default number of concurrent jobs.
+
+    Honors the ``invocations.jobs`` config setting, if ``c`` (a ``Context``) is
+    given and it's set. Otherwise, this is `cpu_count`, further limited so
+    each job gets about ``memory_per_job`` bytes of `available_memory`.
+    Always at least 1.
+    """
+    if c is not None:
+        configured = c.config.get("invocations", {}).get("jobs", None)
+        if configured:
+            return int(configured)
+    jobs = cpu_count()
+    memory = available_memory()
+    if memory is not None:
+        jobs = min(jobs, memory // memory_per_job)
+    return max(jobs, 1)
@@ -8,10 +8,14 @@ This module assumes:
 """
 
 import getpass
+import json
 import logging
 import os
 import re
+import sys
+import time
 import venv
+from contextlib import contextmanager, nullcontext
 from functools import partial
 from io import StringIO
 from pathlib import Path
@@ -33,9 +37,11 @@ from twine.commands.check import check as twine_check
 
 from .semantic_version_monkey import Version
 
+from .. import profiling
 from ..console import confirm
 from ..environment import in_ci
-from ..util import tmpdir
+from ..jobs import default_jobs
+from ..util import cache_path, parallel, tmpdir, tmpdir_pool
 
 
 debug = logging.getLogger("invocations.packaging.release").debug
@@ -278,12 +284,106 @@ def status(c):
     return actions, state
 
 
+#: Filename (within the cache directory) for ``release.all``'s stage timings.
+TIMINGS_FILENAME = "release-timings.json"
+
+# The _StageTimer of an in-progress `all_` run, if any.
+_timer = None
+
+
+class _StageTimer:
+    """
+    Records how long each (possibly nested) stage of a release takes.
+    """
+
+    def __init__(self):
+        # [name, seconds] pairs in the order stages began; nested stages are
+        # named after their parents, e.g. "publish/build".
+        self.stages = []
+        self._names = []
+
+    @contextmanager
+    def stage(self, name):
+        self._names.append(name)
+        entry = ["/".join(self._names), None]
+        self.stages.append(entry)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry[1] = time.perf_counter() - start
+            self._names.pop()
+
+    @property
+    def total(self):
+        return sum(x[1] for x in self.stages if "/" not in x[0])
+
+
+def _stage(name):
+    """
+    Time the wrapped block as a stage of the in-progress `all_`, if any.
+    """
+    return _timer.stage(name) if _timer is not None else nullcontext()
+
+
+def _project_version():
+    try:
+        pyproject = Path.cwd() / "pyproject.toml"
+        return _read_pyproject_toml(pyproject)["project"]["version"]
+    except Exception:
+        return "unknown"
+
+
+def _report_timings(c, timer, dry_run, completed):
+    """
+    Print ``timer``'s stages as a table & store them (keyed by version).
+
+    Dry runs are stored under e.g. ``1.2.3+dry``, so they don't clobber the
+    timings of the real release.
+
+    Failing to store them is only reported, not raised, as this runs while
+    handling the release's own errors (which it mustn't mask.)
+    """
+    rows = list(timer.stages) + [["total", timer.total]]
+    print(tabulate(rows, headers=["Stage", "Seconds"], floatfmt=".2f"))
+    path = cache_path(c, TIMINGS_FILENAME)
+    try:
+        with open(path) as fd:
+            data = json.load(fd)
+    except (OSError, ValueError):
+        data = {}
+    key = _project_version() + ("+dry" if dry_run else "")
+    data[key] = {
+        "time": time.time(),
+        "dry_run": dry_run,
+        "completed": completed,
+        "stages": dict(timer.stages),
+        "total": timer.total,
+    }
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as fd:
+            json.dump(data, fd, indent=1, sort_keys=True)
+    except Exception as e:
+        print(
+            "Unable to store timings in {}: {}".format(path, e),
+            file=sys.stderr,
+        )
+
+
 # TODO: thought we had automatic trailing underscore stripping but...no?
 @task(name="all", default=True)
 def all_(c, dry_run=False):
     """
     Catchall version-bump/tag/changelog/PyPI upload task.
 
+    Each stage (``prepare``, ``publish`` & ``push``), and each step within
+    ``publish`` (build, rebuild, ``twine check``, ``test_install`` &
+    ``upload``), is timed. The timings are printed as a table when done (even
+    on failure) and stored under the released version (plus ``+dry`` for dry
+    runs) in ``release-timings.json`` in the cache directory (see
+    `invocations.util.cache_path`), to help spot slowdowns across releases.
+
     :param bool dry_run:
         Handed to all subtasks which themselves have a ``dry_run`` flag.
 
@@ -292,10 +392,27 @@ def all_(c, dry_run=False):
         ``prepare``.
     .. versionchanged:: 2.1
         Added the ``dry_run`` flag.
+    .. versionchanged:: 4.1
+        Honor the ``invocations.profile`` setting (see
+        `invocations.profiling`.)
+    .. versionchanged:: 4.1
+        Time each stage and report on it.
     """
-    prepare(c, dry_run=dry_run)
-    publish(c, dry_run=dry_run)
-    push(c, dry_run=dry_run)
+    global _timer
+    profiling.configure(c)
+    _timer = timer = _StageTimer()
+    completed = False
+    try:
+        with _stage("prepare"):
+            prepare(c, dry_run=dry_run)
+        with _stage("publish"):
+            publish(c, dry_run=dry_run)
+        with _stage("push"):
+            push(c, dry_run=dry_run)
+        completed = True
+    finally:
+        _timer = None
+        _report_timings(c, timer, dry_run, completed)
 
 
 @task
@@ -700,7 +817,12 @@ def publish(
 
         Defaults to a temporary directory which is cleaned up after the run
         finishes.
+
+    .. versionchanged:: 4.1
+        Honor the ``invocations.profile`` setting (see
+        `invocations.profiling`.)
     """
+    profiling.configure(c)
     # Don't hide by default, this step likes to be verbose most of the time.
     c.config.run.hide = False
     # Including echoing!
@@ -719,7 +841,8 @@ def publish(
     with tmpdir(skip_cleanup=dry_run, explicit=directory) as tmp:
         # Build default archives
         builder = partial(build, c, sdist=sdist, wheel=wheel, directory=tmp)
-        builder()
+        with _stage("build"):
+            builder()
         # Rebuild with env (mostly for Fabric 2)
         # TODO: code smell; implies this really wants to be class/hook based?
         # TODO: or at least invert sometime so it's easier to say "do random
@@ -729,7 +852,8 @@ def publish(
             old_environ = os.environ.copy()
             os.environ.update(rebuild_with_env)
             try:
-                builder()
+                with _stage("rebuild"):
+                    builder()
             finally:
                 os.environ.update(old_environ)
                 for key in rebuild_with_env:
@@ -738,18 +862,21 @@ def publish(
         # Use twine's check command on built artifacts (at present this just
         # validates long_description)
         print(c.config.run.echo_format.format(command="twine check"))
-        failure = twine_check(dists=[os.path.join(tmp, "*")])
+        with _stage("twine check"):
+            failure = twine_check(dists=[os.path.join(tmp, "*")])
         if failure:
             raise Exit(1)
         # Test installation of built artifacts into virtualenvs (even during
         # dry run)
-        test_install(c, directory=tmp)
+        with _stage("test_install"):
+            test_install(c, directory=tmp)
         # Do the thing! (Maybe.)
-        upload(c, directory=tmp, index=index, sign=sign, dry_run=dry_run)
+        with _stage("upload"):
+            upload(c, directory=tmp, index=index, sign=sign, dry_run=dry_run)
 
 
 @task
-def test_install(c, directory, verbose=False, skip_import=False):
+def test_install(c, directory, verbose=False, skip_import=False, jobs=None):
     """
     Test installation of build artifacts found in ``$directory``.
 
@@ -759,6 +886,18 @@ def test_install(c, directory, verbose=False, skip_import=False):
     :param bool skip_import:
         If True, don't try importing the installed module or checking it for
         type hints.
+    :param int jobs:
+        How many archives to test at once, each in its own virtualenv.
+        Default: as many as this machine can handle (see
+        `invocations.jobs.default_jobs`.)
+
+    Temporary directories (one per virtualenv) honor the
+    ``invocations.tmpdir`` settings, e.g. to put them on a tmpfs or clean
+    them up in the background; see `invocations.util.tmpdir_pool`.
+
+    .. versionchanged:: 4.1
+        Added the ``jobs`` argument, started testing archives concurrently,
+        and started honoring ``invocations.tmpdir`` settings.
     """
     # TODO: wants contextmanager or similar for only altering a setting within
     # a given scope or block - this may pollute subsequent subroutine calls
@@ -770,8 +909,13 @@ def test_install(c, directory, verbose=False, skip_import=False):
     archives = get_archives(directory)
     if not archives:
         raise Exit(f"No archive files found in {directory}!")
-    for archive in archives:
-        with tmpdir() as tmp:
+
+    tmpdirs = tmpdir_pool(c)
+    # Just our own directories' figures, as the pool may be shared
+    stats = {}
+
+    def install(archive):
+        with tmpdirs.tmpdir(stats=stats) as tmp:
             # Make temp venv
             builder.create(tmp)
             # Obligatory: make inner pip match outer pip (version obtained from
@@ -799,12 +943,24 @@ def test_install(c, directory, verbose=False, skip_import=False):
                     # Use some other dir (our cwd is probably the project root,
                     # whose local $package dir may confuse mypy into a false
                     # positive!)
-                    with tmpdir() as tmp2:
+                    with tmpdirs.tmpdir(stats=stats) as tmp2:
                         mypy_check = f"{envbin / 'mypy'} -c 'import {package}'"
                         c.run(f"cd {tmp2} && {mypy_check}")
 
+    jobs = int(jobs) if jobs else default_jobs(c)
+    parallel(install, archives, min(jobs, len(archives)))
+
     if verbose:
         c.config.run.hide = old_hide
+        msg = "Temp dirs: {} created in {:.2f}s, {} cleaned up in {:.2f}s"
+        print(
+            msg.format(
+                stats.get("created", 0),
+                stats.get("create_seconds", 0),
+                stats.get("cleaned", 0),
+                stats.get("cleanup_seconds", 0),
+            )
+        )
 
 
 def get_archives(directory: Union[str, Path]) -> list[Path]:
@@ -0,0 +1,194 @@
+"""
+Opt-in timing spans around subprocesses and task calls, for profiling.
+
+When enabled, every `Context.run <invoke.context.Context.run>` and
+`Context.sudo <invoke.context.Context.sudo>` call, and every task call (be it
+by Invoke's executor or one task calling another), is recorded as a span. At
+interpreter exit, the spans are written out as a Chrome trace (JSON) file,
+which can be loaded into e.g. ``chrome://tracing`` or https://ui.perfetto.dev
+to see where a release or docs build spends its time.
+
+Profiling may be enabled in any of these ways:
+
+- by setting the ``INVOCATIONS_PROFILE`` env var to the trace file's path,
+  which takes effect when ``invocations`` is imported, and thus covers the
+  entire session;
+- by calling `enable` (e.g. from a ``tasks.py``);
+- by setting the ``invocations.profile`` config setting to the trace file's
+  path (or to ``True``, meaning ``profile.json`` in the cache directory; see
+  ``invocations.util.cache_path``.) As config is only available to tasks,
+  this takes effect partway through the first long-running task which calls
+  `configure`, e.g. ``invocations.packaging.release.all_``.
+
+.. versionadded:: 4.1
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+from invoke import Context, Task
+
+from .util import cache_path
+
+
+#: Env var which, if set to a path, enables profiling on import.
+ENV_VAR = "INVOCATIONS_PROFILE"
+#: Default filename (within the cache directory) for trace data.
+FILENAME = "profile.json"
+#: Span names for commands are truncated to this many characters.
+NAME_LENGTH = 60
+
+_profiler = None
+_originals = {}
+
+
+class Profiler:
+    """
+    Thread-safe collector of Chrome trace "complete" (``"X"``) events.
+
+    :param path: Where `dump` writes the trace by default.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.events = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def _now(self):
+        # Trace timestamps are in microseconds
+        return (time.perf_counter() - self._start) * 1e6
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """
+        Context-manage a span named ``name``, in category ``category``.
+
+        Yields the ``args`` dict stored with the span, so callers may add
+        details (such as an exit code) once they're known. Exceptions escaping
+        the span are noted in it before being re-raised.
+        """
+        start = self._now()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = "{}: {}".format(type(e).__name__, e)
+            raise
+        finally:
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start,
+                "dur": self._now() - start,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def dump(self, path=None):
+        """
+        Write the trace recorded so far to ``path`` (default: ``self.path``).
+        """
+        path = Path(path or self.path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            events = list(self.events)
+        with open(path, "w") as fd:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fd)
+        return path
+
+
+def _command_name(command):
+    command = " ".join(command.split())
+    if len(command) > NAME_LENGTH:
+        command = command[: NAME_LENGTH - 3] + "..."
+    return command
+
+
+def _wrap_runner(method, category):
+    @wraps(method)
+    def wrapper(self, command, **kwargs):
+        with _profiler.span(
+            _command_name(command), category, command=command
+        ) as args:
+            result = method(self, command, **kwargs)
+            if result is not None:
+                args["exited"] = result.exited
+            return result
+
+    return wrapper
+
+
+def _wrap_task(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with _profiler.span(self.name, "task"):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def enabled():
+    """
+    Return the active `Profiler`, or ``None`` if profiling isn't enabled.
+    """
+    return _profiler
+
+
+def enable(path):
+    """
+    Start recording spans, to be written to ``path`` at interpreter exit.
+
+    Does nothing (besides returning the active `Profiler`) if profiling is
+    already enabled.
+    """
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+    _profiler = Profiler(path)
+    _originals["run"] = Context.run
+    _originals["sudo"] = Context.sudo
+    _originals["task"] = Task.__call__
+    Context.run = _wrap_runner(Context.run, "run")
+    Context.sudo = _wrap_runner(Context.sudo, "sudo")
+    Task.__call__ = _wrap_task(Task.__call__)
+    atexit.register(_profiler.dump)
+    return _profiler
+
+
+def disable():
+    """
+    Stop recording spans, without writing them out.
+
+    :returns:
+        The formerly active `Profiler` (or ``None``), e.g. to
+        `~Profiler.dump`.
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        atexit.unregister(profiler.dump)
+        Context.run = _originals.pop("run")
+        Context.sudo = _originals.pop("sudo")
+        Task.__call__ = _originals.pop("task")
+    return profiler
+
+
+def configure(c):
+    """
+    Enable profiling if the ``invocations.profile`` setting asks for it.
+    """
+    setting = c.config.get("invocations", {}).get("profile", None)
+    if not setting:
+        return enabled()
+    path = cache_path(c, FILENAME) if setting is True else setting
+    return enable(path)
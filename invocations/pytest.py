@@ -2,7 +2,25 @@
 Pytest-using variant of testing.py. Will eventually replace the latter.
 """
 
-from invoke import task
+import json
+import os
+import re
+import shlex
+import shutil
+import sys
+import threading
+import time
+from importlib import import_module
+
+from invoke import task, Context, Exit, Result
+from tabulate import tabulate
+
+from . import profiling, timings
+from .environment import ci_environment
+from .imports import ImportIndex, find_test_modules
+from .jobs import default_jobs
+from .util import cache_path, changed_lines, parallel, tmpdir
+from .watch import watch
 
 
 @task
@@ -17,6 +35,10 @@ def test(
     opts="",
     pty=True,
     warnings=True,
+    warm=False,
+    workers=None,
+    shard=None,
+    record_timings=False,
 ):
     """
     Run pytest with given options.
@@ -59,12 +81,102 @@ def test(
         will be given. Default: ``True``.
 
         .. versionadded:: 2.0
+
+    :param bool warm:
+        Run pytest in a ``fork()`` of the current (already warmed-up) Python
+        process, instead of a fresh subprocess. Mostly useful for repeated
+        runs, e.g. via `watch_tests`. The first warm run forks a copy of this
+        process to serve as the template for the rest, so forking always
+        happens in a single-threaded process. Ignores ``pty``. Falls back to
+        a subprocess on platforms lacking ``fork()``. Default: ``False``.
+
+        .. versionadded:: 4.1
+
+    :param workers:
+        Number of processes to spread tests across, or ``"auto"`` for as many
+        as this machine can handle (see `invocations.jobs.default_jobs`).
+        Uses ``pytest-xdist`` (i.e. ``-n <workers>``, which handles ``auto``
+        itself) when the ``pytest`` being run has it. Otherwise, modules under
+        ``tests/`` are split between that many concurrent pytest processes,
+        whose output is printed (grouped per process) once all have finished,
+        followed by a per-process summary and the combined test counts;
+        processes which collected no tests (exit code 5) don't count as
+        failures. If ``opts`` enables ``pytest-cov``, each writes its own data
+        file and they are merged via ``coverage combine`` afterwards. Can
+        only be combined with ``module`` when ``pytest-xdist`` is available.
+        Default: ``None`` (no parallelism).
+
+        .. versionadded:: 4.1
+
+    :param str shard:
+        Only run one slice of the test modules in ``tests/``, given as
+        ``"INDEX/TOTAL"`` (e.g. ``2/4`` for the second of four; ``INDEX``
+        starts at 1.) Modules are divided so each slice should take about the
+        same time to run, based on timings recorded by earlier runs (see
+        ``record_timings``), or on file size for modules lacking any. Implies
+        ``record_timings``. Can't be combined with ``module``. Default:
+        ``None``.
+
+        May also be ``"auto"``, to use the parallel node index & count of
+        the CI provider we're running under (see
+        `invocations.environment.ci_environment`); outside CI, or on CI
+        without parallelism, everything runs (i.e. ``1/1``.)
+
+        .. versionadded:: 4.1
+
+    :param bool record_timings:
+        Whether to record per-test durations from this run into the timings
+        file (``timings.json`` in the cache directory; see
+        `invocations.util.cache_path`), for use by ``shard`` and the
+        ``timings`` task. Honors the ``tests.record_timings`` config option.
+        Default: ``False``.
+
+        .. versionadded:: 4.1
     """
     # TODO: really need better tooling around these patterns
     # TODO: especially the problem of wanting to be configurable, but
     # sometimes wanting to override one's config via kwargs; and also needing
     # non-None defaults in the kwargs to inform the parser (or have to
     # configure it explicitly...?)
+    flags = _flags(verbose, color, capture, opts, k, x, warnings)
+    modstr = ""
+    if module is not None:
+        modstr = " tests/{}.py".format(module)
+    timings_file = cache_path(c, timings.FILENAME)
+    if not record_timings:
+        config = c.config.get("tests", {})
+        record_timings = config.get("record_timings", False)
+    modules = None
+    if shard:
+        if module is not None:
+            raise Exit("The 'module' and 'shard' options are exclusive!")
+        modules = _shard_modules(shard, timings_file)
+        if not modules:
+            print("Shard {} has no test modules to run!".format(shard))
+            return
+        modstr = " " + " ".join(modules)
+        record_timings = True
+    cmd = "pytest {}".format(flags)
+    if workers:
+        if _has_xdist(c):
+            modstr += " -n {}".format(workers)
+        elif module is not None:
+            raise Exit(
+                "Can't spread one module across workers without pytest-xdist!"
+            )
+        else:
+            modules = modules or find_test_modules()
+            return _run_sharded(
+                c, cmd, workers, modules, timings_file, record_timings
+            )
+    if not record_timings:
+        return _run(c, cmd + modstr, pty, warm)
+    with timings.recording(timings_file) as xml_dir:
+        junit = _junit_flags(os.path.join(xml_dir, "results.xml"))
+        return _run(c, cmd + junit + modstr, pty, warm)
+
+
+def _flags(verbose, color, capture, opts, k, x, warnings):
     flags = []
     if verbose:
         flags.append("--verbose")
@@ -79,10 +191,284 @@ def test(
         flags.append("-x")
     if not warnings and not ("--disable-warnings" in opts if opts else False):
         flags.append("--disable-warnings")
-    modstr = ""
-    if module is not None:
-        modstr = " tests/{}.py".format(module)
-    c.run("pytest {}{}".format(" ".join(flags), modstr), pty=pty)
+    return " ".join(flags)
+
+
+def _run(c, cmd, pty, warm):
+    if warm and hasattr(os, "fork"):
+        return _run_forked(c, cmd)
+    return c.run(cmd, pty=pty)
+
+
+def _junit_flags(path):
+    return " -o junit_family=xunit1 --junitxml={}".format(path)
+
+
+def _shard_modules(shard, timings_file):
+    """
+    Return the test modules making up shard ``"INDEX/TOTAL"`` (or ``auto``).
+    """
+    if shard == "auto":
+        env = ci_environment()
+        if env is None or env.node_total is None:
+            shard = "1/1"
+        else:
+            shard = "{}/{}".format(env.node_index + 1, env.node_total)
+    try:
+        index, total = (int(x) for x in shard.split("/"))
+    except ValueError:
+        raise Exit("Shard must look like INDEX/TOTAL, not {!r}!".format(shard))
+    if not 1 <= index <= total:
+        raise Exit("Shard index must be between 1 and {}!".format(total))
+    durations = timings.file_durations(
+        find_test_modules(), timings.typical(timings.load(timings_file))
+    )
+    return timings.partition(durations, total)[index - 1]
+
+
+def _worker_count(c, workers):
+    if workers == "auto":
+        return default_jobs(c)
+    try:
+        count = int(workers)
+    except ValueError:
+        count = 0
+    if count < 1:
+        msg = "Workers must be 'auto' or a positive integer, not {!r}!"
+        raise Exit(msg.format(workers))
+    return count
+
+
+def _has_xdist(c):
+    """
+    Whether the ``pytest`` on our ``$PATH`` has the ``pytest-xdist`` plugin.
+
+    (As opposed to the interpreter running Invoke, which may differ.)
+    """
+    result = c.run("pytest -VV", hide=True, warn=True)
+    return "xdist" in result.stdout + result.stderr
+
+
+# Pytest's final summary line, e.g. '==== 3 passed, 1 warning in 0.12s ===='
+_SUMMARY = re.compile(r"^=* ?((?:\d+ \w+(?:, )?)+) in [\d.]+s")
+_ANSI = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def _outcomes(stdout):
+    """
+    Return ``{outcome: count}`` from pytest's final summary in ``stdout``.
+    """
+    for line in reversed(_ANSI.sub("", stdout).splitlines()):
+        match = _SUMMARY.match(line)
+        if match:
+            pairs = (x.split(" ", 1) for x in match.group(1).split(", "))
+            # Pluralize so e.g. '1 warning' & '2 warnings' can be summed
+            return {
+                x if x.endswith(("ed", "s")) else x + "s": int(count)
+                for count, x in pairs
+            }
+    return {}
+
+
+def _run_sharded(c, cmd, workers, modules, timings_file, record):
+    """
+    Run pytest command line ``cmd`` across ``workers`` chunks of ``modules``.
+    """
+    count = _worker_count(c, workers)
+    shards = [modules[i::count] for i in range(count)]
+    shards = [x for x in shards if x]
+    cover = "--cov" in cmd
+
+    with timings.recording(timings_file) as xml_dir:
+
+        def run(numbered):
+            num, shard = numbered
+            flags = ""
+            if record:
+                path = os.path.join(xml_dir, "shard{}.xml".format(num))
+                flags = _junit_flags(path)
+            env = {"COVERAGE_FILE": ".coverage.shard{}".format(num)}
+            return c.run(
+                "{}{} {}".format(cmd, flags, " ".join(shard)),
+                hide=True,
+                warn=True,
+                pty=False,
+                in_stream=False,
+                env=env if cover else {},
+            )
+
+        results = parallel(run, enumerate(shards), len(shards))
+    rows, totals = [], {}
+    for num, (shard, result) in enumerate(zip(shards, results)):
+        print("=== pytest shard {}/{} ===".format(num + 1, len(results)))
+        print(result.stdout, end="")
+        print(result.stderr, end="", file=sys.stderr)
+        outcomes = _outcomes(result.stdout)
+        for name, count in outcomes.items():
+            totals[name] = totals.get(name, 0) + count
+        # 5 means 'no tests collected', e.g. a shard of only helper modules
+        status = {0: "passed", 5: "no tests"}.get(result.exited, "FAILED")
+        summary = ", ".join("{} {}".format(v, k) for k, v in outcomes.items())
+        rows.append((num + 1, len(shard), status, result.exited, summary))
+    print(
+        tabulate(
+            rows, headers=["Shard", "Modules", "Status", "Exit code", "Tests"]
+        )
+    )
+    failures = [x for x in results if x.exited not in (0, 5)]
+    print(
+        "Combined: {} ({} of {} shards failed)".format(
+            ", ".join("{} {}".format(v, k) for k, v in totals.items())
+            or "no tests",
+            len(failures),
+            len(results),
+        )
+    )
+    if cover:
+        c.run("coverage combine", warn=True)
+    if failures and not c.config.run.warn:
+        raise Exit(code=failures[0].exited)
+    return results
+
+
+def _fresh_modules(c):
+    """
+    Return top-level names of modules a warm test run must import afresh.
+    """
+    names = {"tests", "conftest"}
+    package = c.config.get("tests", {}).get("package")
+    if package:
+        names.add(package)
+    return names
+
+
+def _run_pytest(args, env, fresh):  # pragma: no cover
+    """
+    Run pytest with ``args`` in this (freshly forked) process, then exit.
+    """
+    code = 1
+    try:
+        for name in list(sys.modules):
+            if name.split(".")[0] in fresh:
+                del sys.modules[name]
+        os.environ.update(env)
+        import pytest
+
+        code = int(pytest.main(args))
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+class _WarmServer:
+    """
+    A forked copy of this process, which forks again for each test run.
+
+    The copy is made while this process is still single-threaded (and
+    stays so), so that the per-run forks never happen in a process with
+    other threads (e.g. a file watcher's) that might hold locks.
+    """
+
+    def __init__(self):
+        request_read, request_write = os.pipe()
+        result_read, result_write = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.pid = os.fork()
+        if self.pid == 0:  # pragma: no cover
+            os.close(request_write)
+            os.close(result_read)
+            code = 0
+            try:
+                with os.fdopen(request_read) as requests, os.fdopen(
+                    result_write, "w"
+                ) as results:
+                    self._serve(requests, results)
+            except BaseException:  # E.g. Ctrl-C
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(request_read)
+        os.close(result_write)
+        self._requests = os.fdopen(request_write, "w")
+        self._results = os.fdopen(result_read)
+        self._lock = threading.Lock()
+
+    def _serve(self, requests, results):  # pragma: no cover
+        for line in requests:
+            pid = os.fork()
+            if pid == 0:
+                _run_pytest(**json.loads(line))
+            _, status = os.waitpid(pid, 0)
+            results.write("{}\n".format(os.waitstatus_to_exitcode(status)))
+            results.flush()
+
+    def run(self, args, env, fresh):
+        """
+        Run pytest with ``args`` in a fork, returning its exit code.
+
+        ``env`` is applied to the fork's ``os.environ``, and modules under
+        the top-level names in ``fresh`` are evicted from its
+        ``sys.modules`` so they get reimported.
+        """
+        request = dict(args=args, env=env, fresh=sorted(fresh))
+        with self._lock:
+            self._requests.write(json.dumps(request) + "\n")
+            self._requests.flush()
+            code = self._results.readline()
+        if not code:
+            raise Exit("The warm test server went away!")
+        return int(code)
+
+
+_warm = None
+
+
+def _warm_server():
+    """
+    Return this process' `_WarmServer`, starting it if necessary.
+
+    Call this before starting any threads, so the server is forked from a
+    single-threaded process.
+    """
+    global _warm
+    if _warm is None:
+        _warm = _WarmServer()
+    return _warm
+
+
+def _run_forked(c, cmd):
+    """
+    Run pytest command line ``cmd`` in a fork of a warmed-up process.
+
+    Anything already imported (pytest itself, heavy third-party dependencies,
+    etc) when the `_WarmServer` started is inherited for free; the project's
+    own package and tests are evicted from ``sys.modules`` in each fork so
+    they're always reimported. ``c.config.run.env`` is honored.
+    """
+    if c.config.run.echo:
+        print(c.config.run.echo_format.format(command=cmd))
+    env = dict(c.config.run.env)
+    code = _warm_server().run(shlex.split(cmd)[1:], env, _fresh_modules(c))
+    if code and not c.config.run.warn:
+        raise Exit(code=code)
+    return code
+
+
+def _preload(c):
+    """
+    Import pytest & anything listed in ``tests.preload``, to warm up forks.
+    """
+    for name in ["pytest"] + list(
+        c.config.get("tests", {}).get("preload", [])
+    ):
+        try:
+            import_module(name)
+        except ImportError as e:
+            print(
+                "Unable to preload {!r}: {}".format(name, e), file=sys.stderr
+            )
 
 
 @task(help=test.help)
@@ -96,17 +482,37 @@ def integration(
     color=True,
     capture="sys",
     module=None,
+    workers=None,
 ):
     """
     Run the integration test suite. May be slow!
 
     See ``pytest.test`` for description of most arguments.
+
+    :param workers:
+        When given (and ``module`` isn't), run each module under
+        ``integration/`` as its own pytest process, at most this many (or
+        ``"auto"``; see `test`) at a time. Each process gets a private
+        temporary directory (via ``TMPDIR``), and its output is printed once
+        all are done, followed by a per-module summary table. Integration
+        tests tend to spend most of their time waiting on I/O, so this can be
+        worthwhile even with more workers than CPUs. Default: ``None``.
+
+        .. versionadded:: 4.1
     """
+    if workers and module is None:
+        flags = _flags(verbose, color, capture, opts, k, x, True)
+        return _run_modules(
+            c,
+            "pytest {}".format(flags),
+            find_test_modules("integration"),
+            workers,
+        )
     opts = opts or ""
     opts += " integration/"
     if module is not None:
         opts += "{}.py".format(module)
-    test(
+    return test(
         c,
         opts=opts,
         pty=pty,
@@ -118,6 +524,46 @@ def integration(
     )
 
 
+def _run_modules(c, cmd, modules, workers):
+    """
+    Run pytest command line ``cmd`` on each of ``modules`` concurrently.
+    """
+    if not modules:
+        print("No test modules found!")
+        return []
+
+    def run(module):
+        with tmpdir(c=c) as tmp:
+            start = time.time()
+            result = c.run(
+                "{} {}".format(cmd, module),
+                hide=True,
+                warn=True,
+                pty=False,
+                in_stream=False,
+                env={"TMPDIR": tmp},
+            )
+            return result, time.time() - start
+
+    runs = parallel(run, modules, _worker_count(c, workers))
+    rows = []
+    for module, (result, elapsed) in zip(modules, runs):
+        print("=== {} ===".format(module))
+        print(result.stdout, end="")
+        print(result.stderr, end="", file=sys.stderr)
+        status = "passed" if result.ok else "FAILED"
+        rows.append((module, status, result.exited, "{:.2f}".format(elapsed)))
+    print(tabulate(rows, headers=["Module", "Status", "Exit code", "Seconds"]))
+    results = [x[0] for x in runs]
+    failures = [x for x in results if x.failed]
+    if failures and not c.config.run.warn:
+        raise Exit(
+            "{} of {} modules failed!".format(len(failures), len(results)),
+            code=failures[0].exited,
+        )
+    return results
+
+
 @task(iterable=["additional_testers"])
 def coverage(
     c,
@@ -126,6 +572,8 @@ def coverage(
     tester=None,
     codecov=False,
     additional_testers=None,
+    parallel=False,
+    since=None,
 ):
     """
     Run pytest with coverage enabled.
@@ -150,9 +598,45 @@ def coverage(
         List of additional test functions to call besides ``tester``. If given,
         implies the use of ``--cov-append`` on these subsequent test runs.
 
+    :param bool parallel:
+        Whether to run ``tester`` and ``additional_testers`` concurrently
+        instead of one after another. Each gets its own coverage data file
+        (and hidden output, printed per tester once all are done); the data
+        is then merged with ``coverage combine`` and reported on via the
+        ``coverage`` tool directly. Default: ``False``.
+
+    :param str since:
+        Git ref (e.g. ``origin/main``) to run incrementally against: only the
+        tests whose recorded coverage touched files changed since that ref
+        (plus any changed test modules) are rerun, and their fresh data is
+        merged into the cached data of the last full run, so the report
+        still covers everything. If there's no cached data yet, a full run
+        (recording per-test contexts; requires ``coverage`` 5+ and
+        ``pytest-cov`` 2.8+) is done to create it. ``additional_testers``
+        are not used in this mode. Default: ``None``.
+
+        .. note::
+            The cache (``coverage`` in the cache directory; see
+            `invocations.util.cache_path`) is not updated by incremental
+            runs; delete it to force a fresh full run, e.g. after merging.
+            It remembers the commit it was recorded at, and if ``since`` is
+            some other commit, changes are looked for since the former
+            instead (as anything else would give a wrong report.)
+
     .. versionchanged:: 2.4
         Added the ``additional_testers`` argument.
+    .. versionchanged:: 4.1
+        Added the ``parallel`` and ``since`` arguments, and honor the
+        ``invocations.profile`` setting (see `invocations.profiling`.)
     """
+    profiling.configure(c)
+    if since is not None:
+        _incremental_coverage(c, since, tester or test, report, opts)
+        return _after_coverage(c, report, codecov)
+    if parallel and additional_testers:
+        testers = [tester or test] + list(additional_testers)
+        _parallel_coverage(c, testers, report, opts)
+        return _after_coverage(c, report, codecov)
     my_opts = "--cov --no-cov-on-fail --cov-report={}".format(report)
     if opts:
         my_opts += " " + opts
@@ -164,6 +648,10 @@ def coverage(
         my_opts += " --cov-append"
         for tester in additional_testers:
             tester(c, opts=my_opts)
+    _after_coverage(c, report, codecov)
+
+
+def _after_coverage(c, report, codecov):
     if report == "html":
         c.run("open htmlcov/index.html")
     if codecov:
@@ -172,3 +660,342 @@ def coverage(
         c.run("coverage xml")
         # Upload to Codecov
         c.run("codecov")
+
+
+# Coverage.py subcommands equivalent to pytest-cov report types, where the
+# two differ.
+_REPORT_COMMANDS = {
+    "term": "coverage report",
+    "term-missing": "coverage report -m",
+}
+
+
+def _coverage_data():
+    """
+    Return coverage's ``CoverageData`` class, if it's new enough for us.
+    """
+    try:
+        import coverage
+    except ImportError:
+        sys.exit("You need to 'pip install coverage' to use this!")
+    if coverage.version_info < (5,):
+        sys.exit("You need coverage 5+ (for per-test contexts) to use this!")
+    return coverage.CoverageData
+
+
+def _affected_nodes(data_file, changes):
+    """
+    Return test node IDs/paths to rerun given ``changed_lines`` output.
+
+    Every test which touched *any* line of a changed file is rerun, not just
+    those touching changed lines: lines may have moved, and the cached data
+    (numbered as of the base) can't be merged with fresh data for that file.
+
+    Returns ``None`` if a full rerun is needed (e.g. a conftest changed.)
+    """
+    data = _coverage_data()(basename=str(data_file))
+    data.read()
+    measured = set(data.measured_files())
+    test_modules = set(find_test_modules())
+    targets = set()
+    for path, lines in changes.items():
+        if not path.endswith(".py"):
+            continue
+        if os.path.basename(path) == "conftest.py":
+            return None
+        if path in test_modules:
+            targets.add(path)
+        filename = os.path.abspath(path)
+        if filename not in measured:
+            continue
+        for contexts in data.contexts_by_lineno(filename).values():
+            # Contexts look like 'tests/foo.py::test_bar|run'
+            targets.update(x.rpartition("|")[0] for x in contexts if x)
+    return sorted(targets)
+
+
+def _selectable(nodes):
+    """
+    Return which of ``nodes`` pytest can be asked to run.
+
+    Tests from deleted modules are dropped, and node IDs within modules
+    which are themselves being rerun are redundant (and may name tests which
+    no longer exist.)
+    """
+    modules = {x for x in nodes if "::" not in x}
+    selected = []
+    for node in nodes:
+        module = node.partition("::")[0]
+        if not os.path.exists(module):
+            continue
+        if node == module or module not in modules:
+            selected.append(node)
+    return selected
+
+
+def _without_contexts(source, dest, nodes, changed=()):
+    """
+    Copy coverage data file ``source`` to ``dest``, minus ``nodes``' data.
+
+    ``nodes`` are test node IDs or module paths, as from `_affected_nodes`;
+    the contexts of those tests (and of any tests within those modules) are
+    left out, as they're about to be rerun and their old data may be stale.
+    Likewise, nothing is kept for the files named in ``changed``, whose
+    cached line numbers may no longer be right.
+    """
+    CoverageData = _coverage_data()
+    old = CoverageData(basename=str(source))
+    old.read()
+    new = CoverageData(basename=str(dest))
+    prefixes = tuple(x + "::" for x in nodes)
+    nodes = set(nodes)
+    changed = {os.path.abspath(x) for x in changed}
+    files = [x for x in old.measured_files() if x not in changed]
+    for context in sorted(old.measured_contexts()):
+        node = context.rpartition("|")[0]
+        if node in nodes or node.startswith(prefixes):
+            continue
+        old.set_query_contexts(["^{}$".format(re.escape(context))])
+        new.set_context(context)
+        if old.has_arcs():
+            arcs = {x: old.arcs(x) for x in files}
+            new.add_arcs({k: v for k, v in arcs.items() if v})
+        else:
+            lines = {x: old.lines(x) for x in files}
+            new.add_lines({k: v for k, v in lines.items() if v})
+    tracers = {x: old.file_tracer(x) for x in files}
+    new.add_file_tracers({k: v for k, v in tracers.items() if v})
+    new.write()
+
+
+def _commit(c, ref):
+    """
+    Return the commit SHA which git ref ``ref`` resolves to, or ``None``.
+    """
+    cmd = "git rev-parse --verify --quiet {}".format(
+        shlex.quote(ref + "^{commit}")
+    )
+    result = c.run(cmd, hide=True, warn=True)
+    return result.stdout.strip() if result.ok else None
+
+
+def _incremental_coverage(c, since, tester, report, opts):
+    cached = cache_path(c, "coverage")
+    # The commit the cached data was recorded at
+    recorded = cache_path(c, "coverage.commit")
+    my_opts = "--cov --no-cov-on-fail --cov-context=test"
+    if opts:
+        my_opts += " " + opts
+    base = None
+    if cached.exists() and recorded.exists():
+        base = _commit(c, recorded.read_text().strip())
+    if base is not None and base != _commit(c, since):
+        # Diffing from anywhere else would misattribute the cached data
+        msg = "Cached coverage data is from {}, not {}; diffing from there."
+        print(msg.format(base[:12], since))
+        since = base
+    if base is not None:
+        if os.path.exists(".coverage.new"):
+            os.remove(".coverage.new")  # Leftover from a previous run
+        changes = changed_lines(c, since)
+        nodes = _affected_nodes(cached, changes)
+        if nodes is not None:
+            selected = _selectable(nodes)
+            if not selected:
+                print("No tests affected by changes since {}".format(since))
+            else:
+                print("Rerunning {} affected tests".format(len(selected)))
+                # Fresh data goes to a side file, for merging with the cache
+                ctx = Context(config=c.config.clone())
+                env = dict(c.config.run.env, COVERAGE_FILE=".coverage.new")
+                ctx.config.run.env = env
+                selected = " ".join(shlex.quote(x) for x in selected)
+                tester(
+                    ctx, opts="{} --cov-report= {}".format(my_opts, selected)
+                )
+            _without_contexts(cached, ".coverage.cached", nodes, changes)
+            # Name the files to combine, so leftovers (e.g. from sharded
+            # runs) don't sneak in.
+            parts = [".coverage.cached"]
+            if os.path.exists(".coverage.new"):
+                parts.append(".coverage.new")
+            c.run("coverage combine {}".format(" ".join(parts)))
+            c.run(_REPORT_COMMANDS.get(report, "coverage {}".format(report)))
+            return
+    print("Doing a full run to (re)create cached coverage data.")
+    tester(c, opts="{} --cov-report={}".format(my_opts, report))
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy(".coverage", cached)
+    recorded.write_text("{}\n".format(_commit(c, "HEAD") or ""))
+
+
+class _RecordingContext(Context):
+    """
+    A ``Context`` which remembers the results of its runs.
+
+    Lets us show the (hidden) output of, and notice failures in, testers which
+    don't return their ``Result``.
+    """
+
+    def __init__(self, config):
+        super().__init__(config=config)
+        self._set(results=[])
+
+    def run(self, command, **kwargs):
+        result = super().run(command, **kwargs)
+        self.results.append(result)
+        return result
+
+
+def _parallel_coverage(c, testers, report, opts):
+    """
+    Run ``testers`` concurrently, each with own data file, then combine.
+    """
+    c.run("coverage erase")
+    # Empty report type == no report from pytest-cov; we report at the end.
+    my_opts = "--cov --no-cov-on-fail --cov-report="
+    if opts:
+        my_opts += " " + opts
+
+    def run(numbered):
+        num, tester = numbered
+        ctx = _RecordingContext(config=c.config.clone())
+        ctx.config.run.hide = True
+        ctx.config.run.warn = True
+        ctx.config.run.in_stream = False
+        env = dict(c.config.run.env, COVERAGE_FILE=".coverage.{}".format(num))
+        ctx.config.run.env = env
+        outcome = tester(ctx, opts=my_opts)
+        # Prefer what actually ran; testers needn't return their results.
+        if ctx.results:
+            return ctx.results
+        return outcome if isinstance(outcome, list) else [outcome]
+
+    outcomes = parallel(run, enumerate(testers), len(testers))
+    failed = False
+    for tester, outcome in zip(testers, outcomes):
+        name = getattr(tester, "name", None) or getattr(
+            tester, "__name__", repr(tester)
+        )
+        print("=== {} ===".format(name))
+        for result in outcome:
+            if isinstance(result, Result):
+                print(result.stdout, end="")
+                print(result.stderr, end="", file=sys.stderr)
+                failed = failed or result.failed
+    # Failed runs may have left no data (cf --no-cov-on-fail)
+    if c.run("coverage combine", warn=failed).ok:
+        c.run(_REPORT_COMMANDS.get(report, "coverage {}".format(report)))
+    if failed and not c.config.run.warn:
+        raise Exit("At least one test run failed!")
+
+
+@task
+def watch_tests(c, module=None, opts="", affected=False, warm=False):
+    """
+    Watch source & test trees for changes, rerunning `test` as necessary.
+
+    Honors the ``tests.package`` setting re: which source directory to watch.
+
+    :param str module: Handed to `test`; see its docs.
+    :param str opts: Handed to `test`; see its docs.
+    :param bool affected:
+        Only rerun test modules importing (directly or not) whichever file
+        changed, instead of the whole suite. See
+        `invocations.imports.ImportIndex` for details. Default: ``False``.
+    :param bool warm:
+        Keep this process warm - with pytest, plus any modules named in the
+        ``tests.preload`` config setting (e.g. slow-to-import third-party
+        dependencies), already imported - and ``fork()`` it for each test run,
+        so reruns skip interpreter startup. The project's own package and
+        tests are still reimported every run. Default: ``False``.
+
+    .. versionadded:: 4.1
+    """
+    package = c.config.get("tests", {}).get("package")
+    patterns = [r"\./tests/"]
+    if package:
+        patterns.append(r"\./{}/".format(package))
+    ignores = [r".*/\..*\.swp"]
+    kwargs = {"module": module, "opts": opts, "warm": warm}
+    if warm and hasattr(os, "fork"):
+        _preload(c)
+        # Fork the server now, before the watcher starts any threads
+        _warm_server()
+    # Don't exit the watch loop just because tests currently fail
+    c.config.run.warn = True
+    test(c, **kwargs)
+    if not affected:
+        watch(c, test, patterns, ignores, **kwargs)
+        return
+    index = ImportIndex([package] if package else [])
+
+    def rerun(c, path, **kwargs):
+        modules = index.refresh(path)
+        if modules is None:
+            test(c, **kwargs)
+        elif modules:
+            print("Rerunning tests affected by {}".format(path))
+            selected = " ".join([opts] + modules if opts else modules)
+            test(c, opts=selected, warm=warm)
+        else:
+            print("No tests affected by {}".format(path))
+
+    watch(c, rerun, patterns, ignores, pass_path=True, **kwargs)
+
+
+@task(name="timings")
+def timings_report(c, top=10, baseline=None, ratio=1.2, runs=10):
+    """
+    Report on test durations recorded via ``test --record-timings``.
+
+    Displays the slowest tests (by median recorded duration), tests whose
+    latest run was notably slower than their baseline, and the total time
+    taken by recent test runs.
+
+    :param int top: How many of the slowest tests to list. Default: ``10``.
+    :param str baseline:
+        Path to another timings file (e.g. one saved from a main branch
+        build) to compare against. By default, each test's latest duration
+        is compared against its own earlier ones.
+    :param float ratio:
+        How many times slower than baseline a test must now be in order to
+        be reported. Default: ``1.2``.
+    :param int runs:
+        How many of the most recent test runs to summarize. Default: ``10``.
+
+    .. versionadded:: 4.1
+    """
+    data = timings.load(cache_path(c, timings.FILENAME))
+    if not data["tests"]:
+        raise Exit("No timings recorded yet! Try 'test --record-timings'.")
+    print("Slowest tests:\n")
+    rows = [
+        (node, "{:.3f}s".format(seconds))
+        for node, seconds in timings.slowest(data, int(top))
+    ]
+    print(tabulate(rows, headers=["Test", "Typical"]))
+    if baseline is not None:
+        baseline = timings.load(baseline)
+    slower = timings.slowdowns(data, baseline=baseline, ratio=float(ratio))
+    print("\nTests which got slower:\n")
+    if slower:
+        rows = [
+            (node, "{:.3f}s".format(before), "{:.3f}s".format(after))
+            for node, before, after in slower
+        ]
+        print(tabulate(rows, headers=["Test", "Baseline", "Latest"]))
+    else:
+        print("None!")
+    print("\nRecent test runs:\n")
+    runs = int(runs)
+    recent = data["runs"][-runs:]
+    rows = [
+        (
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(run["time"])),
+            run["tests"],
+            "{:.2f}s".format(run["seconds"]),
+        )
+        for run in recent
+    ]
+    print(tabulate(rows, headers=["When", "Tests", "Total"]))
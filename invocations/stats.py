@@ -0,0 +1,117 @@
+"""
+Constant-memory statistics accumulators, for tasks tallying many results.
+
+.. versionadded:: 4.1
+"""
+
+from collections import Counter
+
+
+class RunningStats:
+    """
+    Streaming count/min/max/mean of numeric values, plus mode & percentiles.
+
+    Mode and percentiles are derived from a tally of each distinct value, so
+    memory use is bounded by how many *distinct* values are added, not how
+    many values overall; callers should discretize (e.g. round to whole
+    seconds) values which would otherwise rarely repeat.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.counts = Counter()
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.counts[self._bucket(value)] += 1
+
+    def _bucket(self, value):
+        """
+        Return the value to tally ``value`` under, for mode & percentiles.
+        """
+        return value
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    @property
+    def mode(self):
+        """
+        The most common value (the largest such, if there's a tie.)
+        """
+        if not self.counts:
+            return None
+        return max(self.counts.items(), key=lambda x: (x[1], x[0]))[0]
+
+    def percentile(self, pct):
+        """
+        Return the nearest-rank ``pct``-th percentile (0-100) of all values.
+        """
+        if not self.count:
+            return None
+        # Nearest-rank: smallest value with at least pct% of values <= it
+        rank = max(1, -(-self.count * pct // 100))
+        seen = 0
+        for value in sorted(self.counts):
+            seen += self.counts[value]
+            if seen >= rank:
+                return value
+
+
+def _quantize(value, figures):
+    """
+    Round ``value`` to ``figures`` significant figures.
+    """
+    if value == 0:
+        return 0
+    return float("{:.{}g}".format(value, figures))
+
+
+class Histogram(RunningStats):
+    """
+    `RunningStats` variant for continuous values, e.g. durations.
+
+    Count, min, max and mean are exact, but values are tallied (for mode &
+    percentiles) in logarithmic buckets, HDR-histogram style - each value is
+    rounded to ``figures`` significant figures - so memory stays bounded by
+    the dynamic range of the data rather than how many values are added.
+
+    :param int figures:
+        Significant figures to keep per value. Default: ``3`` (i.e. within
+        about 0.5% of the true value).
+    """
+
+    def __init__(self, figures=3):
+        super().__init__()
+        self.figures = figures
+
+    def _bucket(self, value):
+        return _quantize(value, self.figures)
+
+    def to_dict(self):
+        """
+        Return a JSON-friendly summary, including all (non-empty) buckets.
+        """
+        return {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "significant_figures": self.figures,
+            "percentiles": {
+                str(x): self.percentile(x) for x in (50, 90, 99, 99.9)
+            },
+            "buckets": sorted(self.counts.items()),
+        }
@@ -1,10 +1,19 @@
+import json
+import os
+import re
 import sys
 import time
-from collections import defaultdict
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-from invoke import task
+from invoke import task, CommandTimedOut
 from tqdm import tqdm
 
+from . import timings
+from .imports import ImportIndex
+from .jobs import default_jobs
+from .stats import Histogram, RunningStats
+from .util import cache_path, tmpdir
 from .watch import watch
 
 
@@ -14,11 +23,17 @@ from .watch import watch
         "runner": "Use STRING to run tests instead of 'spec'.",
         "opts": "Extra flags for the test runner",
         "pty": "Whether to run tests under a pseudo-tty",
+        "record-timings": "Record per-test durations (via nose's xunit)",
     }
 )
-def test(c, module=None, runner=None, opts=None, pty=True):
+def test(
+    c, module=None, runner=None, opts=None, pty=True, record_timings=False
+):
     """
     Run a Spec or Nose-powered internal test suite.
+
+    .. versionchanged:: 4.1
+        Added the ``record_timings`` argument; see `invocations.timings`.
     """
     runner = runner or "spec"
     # Allow selecting specific submodule
@@ -32,8 +47,15 @@ def test(c, module=None, runner=None, opts=None, pty=True):
     logformat = c.config.get("tests", {}).get("logformat", None)
     if logformat is not None:
         args += f" --logging-format='{logformat}'"
-    # Use pty by default so the spec/nose/Python process buffers "correctly"
-    c.run(runner + args, pty=pty)
+    if not record_timings:
+        # Use pty by default so the spec/nose/Python process buffers
+        # "correctly"
+        c.run(runner + args, pty=pty)
+        return
+    with timings.recording(cache_path(c, timings.FILENAME)) as xml_dir:
+        xml = os.path.join(xml_dir, "results.xml")
+        args += f" --with-xunit --xunit-file={xml}"
+        c.run(runner + args, pty=pty)
 
 
 @task(help=test.help)
@@ -50,12 +72,21 @@ def integration(c, module=None, runner=None, opts=None, pty=True):
 
 
 @task
-def watch_tests(c, module=None, opts=None):
+def watch_tests(c, module=None, opts=None, affected=False):
     """
     Watch source tree and test tree for changes, rerunning tests as necessary.
 
     Honors ``tests.package`` setting re: which source directory to watch for
     changes.
+
+    :param bool affected:
+        Whether to only rerun the test modules which (transitively) import the
+        file that changed, as determined by an import-dependency index of
+        ``tests/`` and ``tests.package``. Changes the index can't account for
+        (e.g. to ``conftest.py``) still rerun everything. Default: ``False``.
+
+    .. versionchanged:: 4.1
+        Added the ``affected`` argument.
     """
     package = c.config.get("tests", {}).get("package")
     patterns = [r"\./tests/"]
@@ -67,7 +98,24 @@ def watch_tests(c, module=None, opts=None):
     c.config.run.warn = True
     test(c, **kwargs)
     # Then watch
-    watch(c, test, patterns, [r".*/\..*\.swp"], **kwargs)
+    ignores = [r".*/\..*\.swp"]
+    if not affected:
+        watch(c, test, patterns, ignores, **kwargs)
+        return
+    index = ImportIndex([package] if package else [])
+
+    def rerun(c, path, **kwargs):
+        modules = index.refresh(path)
+        if modules is None:
+            test(c, **kwargs)
+        elif modules:
+            print("Rerunning tests affected by {}".format(path))
+            selected = "--tests={}".format(",".join(modules))
+            test(c, opts=" ".join(x for x in (opts, selected) if x))
+        else:
+            print("No tests affected by {}".format(path))
+
+    watch(c, rerun, patterns, ignores, pass_path=True, **kwargs)
 
 
 @task
@@ -96,9 +144,160 @@ def coverage(c, html=True, integration_=True):
         c.run("coverage html && open htmlcov/index.html")
 
 
+def _run_trial(c, command, num, isolate=False, timeout=None):
+    """
+    Run one trial of ``command``, optionally isolated: with its own temp dir
+    & env var, and no stdin (as isolated trials run concurrently.)
+
+    Timeouts don't raise; the result is returned with ``timed_out = True``.
+    Results also gain a ``duration`` attribute: wall time in seconds.
+    """
+    kwargs = dict(hide=True, warn=True, timeout=timeout)
+    if isolate:
+        # Concurrent trials can't sensibly share our stdin
+        kwargs["in_stream"] = False
+        with tmpdir(c=c) as tmp:
+            env = {"TMPDIR": tmp, "INVOCATIONS_TRIAL": str(num)}
+            return _timed_run(c, command, env=env, **kwargs)
+    return _timed_run(c, command, **kwargs)
+
+
+def _timed_run(c, command, **kwargs):
+    start = time.perf_counter()
+    try:
+        result = c.run(command, **kwargs)
+    except CommandTimedOut as e:
+        result = e.result
+        result.timed_out = True
+    result.duration = time.perf_counter() - start
+    return result
+
+
+def _latency(stats):
+    return "p50={:.4g}s, p90={:.4g}s, p99={:.4g}s, max={:.4g}s".format(
+        *(stats.percentile(x) for x in (50, 90, 99)), stats.max
+    )
+
+
+def _timed_out(result):
+    if getattr(result, "timed_out", False):
+        return "timed out"
+
+
+def _exited_nonzero(result):
+    if result.failed:
+        return "exited {}".format(result.exited)
+
+
+def _output_matches(stream, regex):
+    pattern = re.compile(regex, re.MULTILINE)
+
+    def predicate(result):
+        if pattern.search(getattr(result, stream)):
+            return "{} matched {!r}".format(stream, regex)
+
+    return predicate
+
+
+def _failure_reason(result, predicates):
+    """
+    Return the first failure reason given by ``predicates``, or ``None``.
+    """
+    for predicate in predicates:
+        reason = predicate(result)
+        if reason:
+            return reason
+
+
+_TRACEBACK = "Traceback (most recent call last):"
+# Past this many distinct signatures, new ones are lumped together, to keep
+# memory bounded even when normalization fails to find much in common.
+_MAX_SIGNATURES = 1000
+_VOLATILE = [
+    (re.compile(r"0x[0-9a-fA-F]+"), "ADDR"),
+    (re.compile(r"(?<=[/\\])tmp\w+"), "tmp?"),
+    (re.compile(r"\d+(\.\d+)?"), "N"),
+]
+
+
+def _signature(reason, stdout, stderr, width=120):
+    """
+    Boil a failure down to a short, normalized signature for clustering.
+
+    Uses the last traceback's frames & exception line when there is one in
+    the output, otherwise the output's last line. Addresses, temp paths and
+    numbers (line numbers, timings, etc) are normalized away.
+    """
+    output = stderr if stderr.strip() else stdout
+    lines = [x.strip() for x in output.splitlines() if x.strip()]
+    if _TRACEBACK in lines:
+        start = len(lines) - lines[::-1].index(_TRACEBACK)
+        lines = lines[start:]
+        frames = [x.split(", in ")[-1] for x in lines if x.startswith("File ")]
+        summary = "{} (in {})".format(lines[-1], " > ".join(frames))
+    else:
+        summary = lines[-1] if lines else ""
+    for pattern, replacement in _VOLATILE:
+        summary = pattern.sub(replacement, summary)
+    signature = "{}: {}".format(reason, summary) if summary else reason
+    if len(signature) > width:
+        signature = signature[: width - 3] + "..."
+    return signature
+
+
+def _trials(c, command, trials, jobs, timeout=None):
+    """
+    Yield results of running ``command`` ``trials`` times.
+
+    With ``jobs`` > 1, up to that many trials run at once (each isolated; see
+    `_run_trial`) and results are yielded in order of completion. Closing the
+    generator early cancels any trials not yet started.
+    """
+    if jobs <= 1:
+        for num in range(trials):
+            yield _run_trial(c, command, num, timeout=timeout)
+        return
+    nums = iter(range(trials))
+    pending = set()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        try:
+            while True:
+                # Only keep 'jobs' trials queued up at once, so huge trial
+                # counts don't mean huge numbers of futures.
+                for num in nums:
+                    future = pool.submit(
+                        _run_trial, c, command, num, True, timeout
+                    )
+                    pending.add(future)
+                    if len(pending) >= jobs:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
 # TODO: rename to like find_errors or something more generic
 @task
-def count_errors(c, command, trials=10, verbose=False, fail_fast=False):
+def count_errors(
+    c,
+    command,
+    trials=10,
+    verbose=False,
+    fail_fast=False,
+    jobs=1,
+    keep=10,
+    percentiles=False,
+    stdout_regex=None,
+    stderr_regex=None,
+    timeout=None,
+    signatures=20,
+    histogram=None,
+):
     """
     Run ``command`` multiple times and tally statistics about failures.
 
@@ -118,51 +317,127 @@ def count_errors(c, command, trials=10, verbose=False, fail_fast=False):
         Whether to exit after the first error (i.e. "count runs til error is
         exhibited" mode.) Default: ``False``.
 
+    :param int jobs:
+        How many trials to run concurrently. When above 1, each trial gets its
+        own temporary directory (as ``$TMPDIR``) and an ``$INVOCATIONS_TRIAL``
+        env var holding its trial number, so concurrent runs needn't trample
+        one another. With ``fail_fast``, trials not yet started are cancelled
+        on the first failure (those already running are left to finish, but
+        ignored.) May be ``"auto"`` to run as many as this machine can handle
+        (see `invocations.jobs.default_jobs`.) Default: ``1``.
+
+        .. versionadded:: 4.1
+
+    :param int keep:
+        How many failed runs' stdout/stderr to retain for display (the most
+        recent ones win). Statistics are tallied as trials complete and the
+        rest of each result is discarded, so memory use doesn't grow with
+        ``trials``. Default: ``10``.
+
+        .. versionadded:: 4.1
+
+    :param bool percentiles:
+        Whether to also display the 50th/90th/99th percentiles of the time
+        between failures. Default: ``False``.
+
+        .. versionadded:: 4.1
+
+    :param str stdout_regex:
+        Also count a trial as failed if its stdout matches this regex (via
+        `re.search`, with ``re.MULTILINE``). Default: ``None``.
+
+        .. versionadded:: 4.1
+
+    :param str stderr_regex:
+        Like ``stdout_regex``, but for stderr. Default: ``None``.
+
+        .. versionadded:: 4.1
+
+    :param int timeout:
+        Count a trial as failed (and stop it) if it runs longer than this many
+        seconds. Default: ``None``.
+
+        .. versionadded:: 4.1
+
+    :param int signatures:
+        How many of the most common failure "signatures" to display at the
+        end. Failures are clustered by the reason they count as failed plus a
+        normalized rendition of their output (the last traceback's frames
+        and exception line, or the last line otherwise.) Default: ``20``.
+
+        .. versionadded:: 4.1
+
+    :param str histogram:
+        Path to write a JSON export of per-trial wall time histograms to, for
+        successful & failed trials separately. (Latency percentiles are
+        always displayed at the end of the run.) Default: ``None``.
+
+        .. versionadded:: 4.1
+
     Say ``verbose=True`` to see stderr from failed runs at the end.
 
     Say ``--fail-fast`` to error out, with error output, on the first error.
     """
-    # TODO: allow defining failure as something besides "exited 1", e.g.
-    # "stdout contained <sentinel>" or whatnot
-    goods, bads = [], []
+    predicates = [_timed_out, _exited_nonzero]
+    if stdout_regex:
+        predicates.append(_output_matches("stdout", stdout_regex))
+    if stderr_regex:
+        predicates.append(_output_matches("stderr", stderr_regex))
+    if timeout is not None:
+        timeout = float(timeout)
+    successes, failures = 0, 0
+    periods = RunningStats()
+    outputs = deque(maxlen=int(keep))
+    clusters = Counter()
+    latencies = {"successes": Histogram(), "failures": Histogram()}
     prev_error = time.time()
-    for num_runs in tqdm(range(trials), unit="trial"):
-        result = c.run(command, hide=True, warn=True)
-        if result.failed:
+    jobs = default_jobs(c) if jobs == "auto" else int(jobs)
+    results = _trials(c, command, trials, jobs, timeout)
+    for num_runs, result in enumerate(
+        tqdm(results, total=trials, unit="trial")
+    ):
+        reason = _failure_reason(result, predicates)
+        latencies["failures" if reason else "successes"].add(result.duration)
+        if reason:
             now = time.time()
-            result.since_prev_error = int(now - prev_error)
+            periods.add(int(now - prev_error))
             prev_error = now
-            bads.append(result)
+            failures += 1
+            outputs.append((result.stdout, result.stderr))
+            signature = _signature(reason, result.stdout, result.stderr)
+            if signature not in clusters and len(clusters) >= _MAX_SIGNATURES:
+                signature = "(other)"
+            clusters[signature] += 1
             # -2 is typically indicative of SIGINT in most shells
             if fail_fast or result.exited == -2:
                 break
         else:
-            goods.append(result)
+            successes += 1
+    results.close()
     num_runs += 1  # for count starting at 1, not 0
     if verbose or fail_fast:
+        if failures > len(outputs):
+            msg = "Output from the last {} of {} failures:"
+            print(msg.format(len(outputs), failures))
         # TODO: would be nice to show interwoven stdout/err but I don't believe
         # we track that at present...
-        for result in bads:
+        for stdout, stderr in outputs:
             print("")
-            print(result.stdout)
-            print(result.stderr)
+            print(stdout)
+            print(stderr)
     # Stats! TODO: errors only jeez
-    successes = len(goods)
-    failures = len(bads)
+    for kind, stats in latencies.items():
+        if stats.count:
+            print("Latency ({}): {}".format(kind, _latency(stats)))
+    if histogram:
+        with open(histogram, "w") as fd:
+            data = {key: value.to_dict() for key, value in latencies.items()}
+            json.dump(data, fd, indent=2)
     overall = "{}/{} trials failed".format(failures, num_runs)
     # Short-circuit if no errors
-    if not bads:
+    if not failures:
         print(overall)
         return
-    periods = [x.since_prev_error for x in bads]
-    # Period mean
-    mean = int(sum(periods) / float(len(periods)))
-    # Period mode
-    # TODO: use collections.Counter now that we've dropped 2.6
-    counts = defaultdict(int)
-    for period in periods:
-        counts[period] += 1
-    mode = sorted((value, key) for key, value in counts.items())[-1][1]
     # Emission of stats!
     if fail_fast:
         print("First failure occurred after {} successes".format(successes))
@@ -170,6 +445,15 @@ def count_errors(c, command, trials=10, verbose=False, fail_fast=False):
         print(overall)
     print(
         "Stats: min={}s, mean={}s, mode={}s, max={}s".format(
-            min(periods), mean, mode, max(periods)
+            periods.min, int(periods.mean), periods.mode, periods.max
         )
     )
+    if percentiles:
+        print(
+            "Percentiles: p50={}s, p90={}s, p99={}s".format(
+                *(periods.percentile(x) for x in (50, 90, 99))
+            )
+        )
+    print("Failure signatures ({} distinct):".format(len(clusters)))
+    for signature, count in clusters.most_common(int(signatures)):
+        print("{:>8}x {}".format(count, signature))
@@ -0,0 +1,252 @@
+"""
+Per-test duration data, as recorded from JUnit XML test runner output.
+
+Durations are kept in a JSON file, by default living in the project-local
+cache directory (see `invocations.util.cache_path`), which looks like::
+
+    {
+        "tests": {"<node id>": [<seconds>, ...], ...},
+        "seen": {"<node id>": <run number>, ...},
+        "count": <run number>,
+        "runs": [{"time": <epoch seconds>, "tests": <count>,
+                  "seconds": <total>}, ...]
+    }
+
+where each test's list holds its most recent durations (oldest first),
+``seen`` notes which run (counting up to ``count``, the number of runs
+recorded so far) each test was last seen in, and ``runs`` summarizes each
+recorded test run. Tests which haven't been seen for a while (e.g. because
+they were renamed or deleted) are forgotten. This data is used to split test
+suites into evenly-timed chunks (e.g. when sharding across CI nodes) and to
+report on slow or slowing-down tests.
+
+.. versionadded:: 4.1
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from statistics import median
+from xml.etree import ElementTree
+
+from .util import tmpdir
+
+
+#: Default filename (within the cache directory) for timing data.
+FILENAME = "timings.json"
+#: How many durations to remember per test.
+HISTORY = 10
+#: How many test run summaries to remember.
+RUNS = 100
+#: Tests not seen in this many recorded runs are forgotten.
+STALE = 20
+
+
+def load(path):
+    """
+    Load timing data from ``path``, returning empty data if it's missing.
+    """
+    try:
+        with open(path) as fd:
+            data = json.load(fd)
+    except (OSError, ValueError):
+        data = {}
+    if "tests" not in data:
+        data = {"tests": {}, "runs": []}
+    return data
+
+
+def save(path, data):
+    """
+    Write timing data to ``path`` (atomically; it may be shared by shards.)
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp{}".format(os.getpid()))
+    with open(tmp, "w") as fd:
+        json.dump(data, fd, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _module_path(dotted):
+    """
+    Find the longest prefix of ``dotted`` naming an existing ``.py`` file.
+
+    Returns a ``(path, remainder)`` tuple, or ``(None, None)``.
+    """
+    parts = dotted.split(".")
+    for i in range(len(parts), 0, -1):
+        path = os.path.join(*parts[:i]) + ".py"
+        if os.path.exists(path):
+            return path, parts[i:]
+    return None, None
+
+
+def parse_junit(path):
+    """
+    Return ``{node_id: seconds}`` for the test cases in JUnit XML at ``path``.
+
+    Test cases' source files come from their ``file`` attribute (as written
+    by pytest's ``xunit1`` flavor) if present; otherwise, they're inferred
+    from the ``classname`` attribute, which is also what e.g. nose writes.
+    """
+    durations = {}
+    for case in ElementTree.parse(path).iter("testcase"):
+        classname = case.get("classname", "")
+        filename = case.get("file")
+        if filename:
+            # classname is the dotted module path plus any enclosing classes
+            module = os.path.splitext(filename)[0].replace(os.sep, ".")
+            prefix = len(module) + 1
+            classes = classname[prefix:].split(".") if classname else []
+        else:
+            filename, classes = _module_path(classname)
+            if filename is None:
+                continue
+        parts = [filename] + [x for x in classes if x]
+        node = "::".join(parts + [case.get("name")])
+        durations[node] = float(case.get("time", 0))
+    return durations
+
+
+def merge(data, found, history=HISTORY, runs=RUNS, stale=STALE):
+    """
+    Fold one test run's ``{node_id: seconds}`` into timing ``data``.
+
+    Tests last seen more than ``stale`` runs ago are dropped. (Not simply
+    those missing from this run, which may have only run some of them.)
+    """
+    count = data["count"] = data.get("count", 0) + 1
+    # Data predating 'seen' counts as seen now
+    seen = data.setdefault("seen", dict.fromkeys(data["tests"], count))
+    for node, seconds in found.items():
+        durations = data["tests"].setdefault(node, [])
+        durations.append(seconds)
+        del durations[:-history]
+        seen[node] = count
+    for node in list(data["tests"]):
+        if count - seen.get(node, count) >= stale:
+            del data["tests"][node]
+            del seen[node]
+    summary = {
+        "time": time.time(),
+        "tests": len(found),
+        "seconds": sum(found.values()),
+    }
+    data["runs"].append(summary)
+    del data["runs"][:-runs]
+    return data
+
+
+@contextmanager
+def recording(path):
+    """
+    Context-manage a directory to write JUnit XML files into.
+
+    On exit, durations from any ``*.xml`` files written there are merged into
+    the timing data at ``path``, as a single test run.
+    """
+    with tmpdir() as tmp:
+        try:
+            yield tmp
+        finally:
+            found = {}
+            for xml in sorted(Path(tmp).glob("*.xml")):
+                try:
+                    found.update(parse_junit(xml))
+                except ElementTree.ParseError:
+                    pass
+            if found:
+                save(path, merge(load(path), found))
+
+
+def typical(data):
+    """
+    Return ``{node_id: seconds}``: each test's median recorded duration.
+    """
+    return {k: median(v) for k, v in data["tests"].items() if v}
+
+
+def file_durations(paths, durations):
+    """
+    Estimate how long each test module in ``paths`` takes to run.
+
+    Modules with tests in ``durations`` (a ``{node_id: seconds}`` dict, e.g.
+    from `typical`) get their tests' total. The rest are estimated from file
+    size, scaled by the seconds-per-byte of modules that do have timings (or
+    simply their size in bytes, if none do).
+
+    :returns: A ``{path: seconds}`` dict.
+    """
+    totals = {}
+    for node, seconds in durations.items():
+        filename = node.split("::", 1)[0]
+        totals[filename] = totals.get(filename, 0) + seconds
+    sizes = {x: max(os.path.getsize(x), 1) for x in paths}
+    known = [x for x in paths if x in totals]
+    rate = 1.0
+    if known:
+        rate = sum(totals[x] for x in known) / sum(sizes[x] for x in known)
+    return {x: totals.get(x, sizes[x] * rate) for x in paths}
+
+
+def partition(weights, count):
+    """
+    Split ``{item: weight}`` into ``count`` lists of roughly equal weight.
+
+    Uses greedy bin-packing: heaviest items first, each into the currently
+    lightest bin. Each resulting list is sorted.
+    """
+    bins = [[0, []] for _ in range(count)]
+    for item in sorted(weights, key=lambda x: (-weights[x], x)):
+        lightest = min(bins, key=lambda x: x[0])
+        lightest[0] += weights[item]
+        lightest[1].append(item)
+    return [sorted(x[1]) for x in bins]
+
+
+def slowest(data, count=10):
+    """
+    Return ``(node_id, seconds)`` for the ``count`` slowest tests, slowest
+    first, going by `typical` durations.
+    """
+    durations = typical(data)
+    ranked = sorted(durations.items(), key=lambda x: (-x[1], x[0]))
+    return ranked[:count]
+
+
+def slowdowns(data, baseline=None, ratio=1.2, floor=0.01):
+    """
+    Find tests whose latest duration is notably worse than their baseline.
+
+    :param dict data: Timing data to examine.
+    :param dict baseline:
+        Other timing data (e.g. from a main branch's CI cache) whose
+        `typical` durations are the baseline. By default, each test's own
+        earlier durations (excluding the latest) are used instead.
+    :param float ratio:
+        How many times slower than baseline a test must be to count.
+    :param float floor:
+        Minimum slowdown, in seconds, to count; avoids noise from tiny tests.
+
+    :returns:
+        List of ``(node_id, baseline_seconds, latest_seconds)``, worst
+        (relative) slowdown first.
+    """
+    reference = typical(baseline) if baseline is not None else None
+    found = []
+    for node, durations in data["tests"].items():
+        if not durations:
+            continue
+        latest = durations[-1]
+        if reference is not None:
+            before = reference.get(node)
+        else:
+            before = median(durations[:-1]) if len(durations) > 1 else None
+        if before is None:
+            continue
+        if latest > before * ratio and latest - before > floor:
+            found.append((node, before, latest))
+    return sorted(found, key=lambda x: (-x[2] / max(x[1], 1e-9), x[0]))
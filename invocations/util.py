@@ -1,10 +1,153 @@
+import atexit
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from pathlib import Path
 from shutil import rmtree
 from tempfile import mkdtemp
 
 
+class TmpdirPool:
+    """
+    Source of temporary directories, with optionally deferred cleanup.
+
+    :param str root:
+        Parent directory for new temporary directories, e.g. a tmpfs mount
+        such as ``/dev/shm``. Default: ``None`` (the system default.)
+    :param bool defer_cleanup:
+        Whether to delete directories in a background thread instead of
+        blocking the caller. Directories are first renamed out of the way
+        (which is instant), so their paths are immediately reusable. Call
+        `drain` to wait for pending deletions; this also happens at exit.
+        Default: ``False``.
+
+    Time spent creating and cleaning up directories is tallied in the
+    ``stats`` dict (``created``, ``create_seconds``, ``cleaned`` and
+    ``cleanup_seconds``; deferred cleanups count the background time, once
+    they finish.) Callers wanting figures for just their own directories may
+    hand `tmpdir` a dict to tally them into as well. Pools may be used from
+    multiple threads at once.
+
+    .. versionadded:: 4.1
+    """
+
+    def __init__(self, root=None, defer_cleanup=False):
+        self.root = root
+        self.defer_cleanup = defer_cleanup
+        self.stats = dict.fromkeys(
+            ("created", "create_seconds", "cleaned", "cleanup_seconds"), 0
+        )
+        self._lock = threading.Lock()
+        self._cleaner = None
+        self._pending = set()
+        if defer_cleanup:
+            # One thread is plenty; deletion is I/O bound.
+            self._cleaner = ThreadPoolExecutor(max_workers=1)
+            atexit.register(self.drain)
+
+    def _tally(self, count, seconds, start, stats):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            for target in (self.stats, stats):
+                if target is None:
+                    continue
+                target[count] = target.get(count, 0) + 1
+                target[seconds] = target.get(seconds, 0) + elapsed
+
+    def _create(self, stats=None):
+        start = time.perf_counter()
+        tmp = mkdtemp() if self.root is None else mkdtemp(dir=self.root)
+        self._tally("created", "create_seconds", start, stats)
+        return tmp
+
+    def _delete(self, path, stats=None, **kwargs):
+        start = time.perf_counter()
+        rmtree(path, **kwargs)
+        self._tally("cleaned", "cleanup_seconds", start, stats)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def cleanup(self, path, stats=None):
+        """
+        Delete ``path``, now or (if deferring cleanup) in the background.
+
+        The time taken is also tallied into ``stats``, if given.
+        """
+        if not self.defer_cleanup:
+            return self._delete(path, stats)
+        trash = "{}.deleting".format(path)
+        os.rename(path, trash)
+        future = self._cleaner.submit(
+            self._delete, trash, stats, ignore_errors=True
+        )
+        with self._lock:
+            self._pending.add(future)
+        # Finished deletions needn't be kept around (may run immediately.)
+        future.add_done_callback(self._done)
+
+    def drain(self):
+        """
+        Wait for any deferred deletions to finish.
+        """
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                return
+            for future in pending:
+                future.result()
+                self._done(future)
+
+    @contextmanager
+    def tmpdir(self, skip_cleanup=False, explicit=None, stats=None):
+        """
+        Context-manage a temporary directory; see `invocations.util.tmpdir`.
+
+        Its creation & cleanup are also tallied into ``stats`` (a dict with
+        the same keys as ``self.stats``; missing keys start at 0), if given.
+        """
+        tmp = explicit if explicit is not None else self._create(stats)
+        try:
+            yield tmp
+        finally:
+            if not skip_cleanup:
+                self.cleanup(tmp, stats)
+
+
+_default_pool = TmpdirPool()
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def tmpdir_pool(c=None):
+    """
+    Return the `TmpdirPool` configured by ``c`` (a `Context`).
+
+    Honors the ``invocations.tmpdir.root`` and
+    ``invocations.tmpdir.defer_cleanup`` config settings (see `TmpdirPool`.)
+    Pools are shared by all callers using the same settings.
+
+    .. versionadded:: 4.1
+    """
+    config = {}
+    if c is not None:
+        config = c.config.get("invocations", {}).get("tmpdir", {})
+    key = (config.get("root", None), config.get("defer_cleanup", False))
+    if key == (None, False):
+        return _default_pool
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = TmpdirPool(*key)
+        return _pools[key]
+
+
 @contextmanager
-def tmpdir(skip_cleanup=False, explicit=None):
+def tmpdir(skip_cleanup=False, explicit=None, c=None):
     """
     Context-manage a temporary directory.
 
@@ -14,10 +157,125 @@ def tmpdir(skip_cleanup=False, explicit=None):
     (If both are given, this is basically not doing anything, but it allows
     code that normally requires a secure temporary directory to 'dry run'
     instead.)
+
+    Given a `Context` as ``c``, honors its ``invocations.tmpdir`` settings;
+    see `tmpdir_pool`.
+
+    .. versionchanged:: 4.1
+        Added the ``c`` argument.
     """
-    tmp = explicit if explicit is not None else mkdtemp()
-    try:
+    with tmpdir_pool(c).tmpdir(skip_cleanup, explicit) as tmp:
         yield tmp
-    finally:
-        if not skip_cleanup:
-            rmtree(tmp)
+
+
+def parallel(func, items, workers):
+    """
+    Call ``func`` on each of ``items`` using up to ``workers`` threads.
+
+    Intended for fanning out (mostly subprocess-bound) work such as multiple
+    ``c.run`` calls.
+
+    :returns: A list of ``func``'s return values, in the order of ``items``.
+
+    .. versionadded:: 4.1
+    """
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(func, items))
+
+
+def cache_path(c, *parts):
+    """
+    Return a `~pathlib.Path` to ``parts`` within the project's cache directory.
+
+    The cache directory is controlled by the ``invocations.cache_dir`` config
+    setting, defaulting to ``.invocations`` (relative to the current working
+    directory, i.e. typically the project root.) Nothing is created on disk;
+    that's up to whoever writes to the result.
+
+    .. versionadded:: 4.1
+    """
+    root = c.config.get("invocations", {}).get("cache_dir", ".invocations")
+    return Path(root, *parts)
+
+
+_HUNK = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+")
+
+
+def _diff_path(header, prefix):
+    """
+    Return the path named by a ``---``/``+++`` diff header, or ``None``.
+    """
+    target = header[4:]
+    return target[2:] if target.startswith(prefix) else None
+
+
+def changed_lines(c, base):
+    """
+    Ask git which lines of which files changed since ``base``.
+
+    Covers both committed and uncommitted (but not untracked) changes, i.e.
+    ``git diff <base>``. Line numbers are those of ``base``'s version of each
+    file (the diff's "pre-image"), as that's what e.g. coverage data recorded
+    at ``base`` refers to; insertions are represented by the lines either
+    side of where they were inserted. Files which are new (or renamed) since
+    ``base`` are also included, under their new path, with no lines.
+
+    :returns: ``{path: set_of_line_numbers}``, paths relative to the repo root.
+
+    .. versionadded:: 4.1
+    """
+    cmd = "git diff --no-color --no-ext-diff -U0 {}".format(base)
+    diff = c.run(cmd, hide=True)
+    changes, old, path, header = {}, None, None, False
+    for line in diff.stdout.splitlines():
+        # Only look for ---/+++ file headers between a 'diff' line and the
+        # first hunk; hunk lines may look the same (e.g. a removed '-- x'.)
+        if line.startswith("diff "):
+            header, old, path = True, None, None
+            continue
+        if header and line.startswith("--- "):
+            old = _diff_path(line, "a/")
+            continue
+        if header and line.startswith("+++ "):
+            header = False
+            new = _diff_path(line, "b/")
+            if new is not None and new != old:
+                changes.setdefault(new, set())
+            path = old
+            if path is not None:
+                changes.setdefault(path, set())
+            continue
+        match = _HUNK.match(line)
+        if match and path is not None:
+            start = int(match.group(1))
+            count = int(match.group(2) or 1)
+            if count:
+                lines = range(start, start + count)
+            else:
+                # Pure insertion, just after line 'start' (which may be 0)
+                lines = [x for x in (start, start + 1) if x]
+            changes[path].update(lines)
+    return changes
+
+
+def changed_files(c, base="HEAD"):
+    """
+    Ask git which files were added or modified since ``base``.
+
+    Includes committed and uncommitted changes (i.e. ``git diff <base>``)
+    plus untracked, non-ignored files, but not deleted ones. Like git's own
+    output when run from a subdirectory, paths are relative to (and limited
+    to) the current working directory.
+
+    :returns: A sorted list of paths.
+
+    .. versionadded:: 4.1
+    """
+    diff = "git diff --name-only --relative --diff-filter=ACMR {}"
+    changed = c.run(diff.format(base), hide=True).stdout.splitlines()
+    untracked = "git ls-files --others --exclude-standard"
+    changed += c.run(untracked, hide=True).stdout.splitlines()
+    return sorted(set(x for x in changed if x))
@@ -2,25 +2,121 @@
 File-watching subroutines, built on watchdog.
 """
 
+import os
+import re
 import sys
 import time
+from functools import lru_cache
 
 
-def make_handler(ctx, task_, regexes, ignore_regexes, *args, **kwargs):
+# Constructs which change meaning (or fail to compile) when a pattern is
+# wrapped up in a larger alternation: numbered/named backreferences, named
+# groups (duplicates are an error), conditionals, and global inline flags
+# (which must lead the whole pattern).
+_UNCOMBINABLE = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?\(|\(\?[aiLmsux]+\)")
+
+
+@lru_cache(maxsize=None)
+def _combine(regexes):
+    """
+    Compile a tuple of regex strings into as few patterns as possible.
+
+    Matching any of the results is equivalent to ``any(re.match(x, path) for
+    x in regexes)``, but typically only walks the path once: most regexes are
+    joined into a single alternation. Those which can't safely be joined
+    (ones using backreferences, named groups, conditionals or global inline
+    flags such as ``(?i)``) are compiled and matched separately instead.
+
+    Results are cached, so handlers built from the same pattern lists (e.g.
+    the ubiquitous swapfile ignore) share the same compiled objects.
+
+    Returns a (possibly empty, which matches nothing) tuple of patterns.
+    """
+    joinable = [x for x in regexes if not _UNCOMBINABLE.search(x)]
+    separate = [re.compile(x) for x in regexes if _UNCOMBINABLE.search(x)]
+    if joinable:
+        pattern = "|".join("(?:{})".format(x) for x in joinable)
+        separate.insert(0, re.compile(pattern))
+    return tuple(separate)
+
+
+class Matcher:
+    """
+    Decide whether filesystem paths are interesting, given include/ignore
+    regexes.
+
+    Semantics are those of watchdog's ``RegexMatchingEventHandler``: a path
+    matches if it is not matched (via `re.match`) by any ignore regex, and is
+    matched by at least one include regex.
+    """
+
+    def __init__(self, regexes, ignore_regexes=()):
+        self.regex = _combine(tuple(regexes))
+        self.ignore = _combine(tuple(ignore_regexes))
+
+    def __call__(self, *paths):
+        # Plain loops; generator expressions cost more than the matching.
+        for path in paths:
+            for regex in self.ignore:
+                if regex.match(path):
+                    return False
+        for path in paths:
+            for regex in self.regex:
+                if regex.match(path):
+                    return True
+        return False
+
+
+def _event_paths(event):
+    paths = []
+    # Only moves have a meaningful dest_path (older watchdogs don't even have
+    # the attribute otherwise; newer ones default it to the empty string.)
+    dest = getattr(event, "dest_path", None)
+    if dest:
+        paths.append(os.fsdecode(dest))
+    if event.src_path:
+        paths.append(os.fsdecode(event.src_path))
+    return paths
+
+
+def make_handler(
+    ctx, task_, regexes, ignore_regexes, *args, pass_path=False, **kwargs
+):
+    """
+    Create a watchdog event handler calling ``task_`` on matching events.
+
+    ``task_`` is called with ``ctx`` plus any extra ``args``/``kwargs``. When
+    ``pass_path`` is ``True``, it is also given a ``path`` kwarg: the path of
+    the file that triggered the event.
+
+    .. versionchanged:: 4.1
+        Added the ``pass_path`` argument.
+    """
     args = [ctx] + list(args)
     try:
-        from watchdog.events import RegexMatchingEventHandler
+        from watchdog.events import FileSystemEventHandler
     except ImportError:
         sys.exit("If you want to use this, 'pip install watchdog' first.")
 
-    class Handler(RegexMatchingEventHandler):
+    class Handler(FileSystemEventHandler):
+        def __init__(self, matcher):
+            super().__init__()
+            self.matcher = matcher
+
+        def dispatch(self, event):
+            if self.matcher(*_event_paths(event)):
+                super().dispatch(event)
+
         def on_any_event(self, event):
+            extra = {}
+            if pass_path:
+                extra["path"] = _event_paths(event)[0]
             try:
-                task_(*args, **kwargs)
+                task_(*args, **kwargs, **extra)
             except BaseException:
                 pass
 
-    return Handler(regexes=regexes, ignore_regexes=ignore_regexes)
+    return Handler(Matcher(regexes, ignore_regexes))
 
 
 def observe(*handlers):
@@ -1,51 +1,71 @@
-from unittest.mock import call
+import json
+import os
+import re
+import sys
+from unittest.mock import patch
 
 import pytest
+from pytest_relaxed import trap
+from invoke import Exit, MockContext, Result
 
 from invocations.checks import blacken, lint, all_ as all_task
 
 
 class checks:
     class blacken_:
+        @pytest.fixture(name="project")
+        def _project(self, tmp_path, monkeypatch):
+            for path in (
+                "a.py",
+                "notes.txt",
+                "pkg/b.py",
+                "pkg/vendor/c.py",
+                "other/d.py",
+            ):
+                target = tmp_path / path
+                target.parent.mkdir(parents=True, exist_ok=True)
+                target.write_text("x = 1\n")
+            monkeypatch.chdir(tmp_path)
+            return tmp_path
+
+        _FILES = "./a.py ./other/d.py ./pkg/b.py ./pkg/vendor/c.py"
+
         @pytest.mark.parametrize(
             "kwargs,command",
             [
-                (dict(), "find . -name '*.py' | xargs black -l 79"),
-                (
-                    dict(line_length=80),
-                    "find . -name '*.py' | xargs black -l 80",
-                ),
+                (dict(), "black -l 79 {}".format(_FILES)),
+                (dict(line_length=80), "black -l 80 {}".format(_FILES)),
                 (
-                    dict(folders=["foo", "bar"]),
-                    "find foo bar -name '*.py' | xargs black -l 79",
+                    dict(folders=["pkg", "other"]),
+                    "black -l 79 other/d.py pkg/b.py pkg/vendor/c.py",
                 ),
                 (
                     # Explicit invocation that matches a default CLI
                     # invocation, since 'folders' is an iterable and thus shows
                     # up as an empty list in real life. Ehhh.
                     dict(folders=[]),
-                    "find . -name '*.py' | xargs black -l 79",
+                    "black -l 79 {}".format(_FILES),
                 ),
                 (
                     dict(check=True),
-                    "find . -name '*.py' | xargs black -l 79 --check",
+                    "black -l 79 --check {}".format(_FILES),
                 ),
                 (
                     dict(diff=True),
-                    "find . -name '*.py' | xargs black -l 79 --diff",
+                    "black -l 79 --diff {}".format(_FILES),
                 ),
                 (
                     dict(
                         diff=True,
                         check=True,
                         line_length=80,
-                        folders=["foo", "bar"],
+                        folders=["pkg"],
                     ),
-                    "find foo bar -name '*.py' | xargs black -l 80 --check --diff",  # noqa
+                    "black -l 80 --check --diff pkg/b.py pkg/vendor/c.py",
                 ),
                 (
-                    dict(find_opts="-and -not -name foo"),
-                    "find . -name '*.py' -and -not -name foo | xargs black -l 79",  # noqa
+                    dict(exclude=["vendor", "./other/*"]),
+                    "black -l 79 ./a.py ./pkg/b.py",
                 ),
             ],
             ids=[
@@ -56,36 +76,202 @@ class checks:
                 "check flag passed through",
                 "diff flag passed through",
                 "most args combined",
-                "find opts controllable",
+                "exclude controllable",
             ],
         )
-        def runs_black(self, ctx, kwargs, command):
-            blacken(ctx, **kwargs)
-            ctx.run.assert_called_once_with(command, pty=True)
+        def runs_black(self, ctx, project, kwargs, command):
+            blacken(ctx, workers=1, **kwargs)
+            ctx.run.assert_called_once_with(
+                command, hide=True, warn=True, in_stream=False
+            )
 
-        def folders_configurable(self, ctx):
+        def folders_configurable(self, ctx, project):
             # Just config -> works fine
-            ctx.blacken = dict(folders=["elsewhere"])
+            ctx.blacken = dict(folders=["other"])
             blacken(ctx)
-            assert "elsewhere" in ctx.run_command
+            assert ctx.run_command == "black -l 79 other/d.py"
 
-        def folders_config_loses_to_runtime(self, ctx):
+        def folders_config_loses_to_runtime(self, ctx, project):
             # Config + CLI opt -> CLI opt wins
-            ctx.blacken = dict(folders=["nowhere"])
-            blacken(ctx, folders=["nowhere"])
-            assert "nowhere" in ctx.run_command
+            ctx.blacken = dict(folders=["pkg"])
+            blacken(ctx, folders=["other"])
+            assert ctx.run_command == "black -l 79 other/d.py"
 
-        def find_opts_configurable(self, ctx):
-            ctx.blacken = dict(find_opts="-and -not -name foo.py")
-            blacken(ctx)
-            assert (
-                "find . -name '*.py' -and -not -name foo.py" in ctx.run_command
+        def exclude_and_workers_configurable(self, project):
+            c = MockContext(run=True, repeat=True)
+            c.blacken = dict(exclude=["*/pkg"], workers=2)
+            blacken(c)
+            assert sorted(x[1][0] for x in c.run.mock_calls) == [
+                "black -l 79 ./a.py",
+                "black -l 79 ./other/d.py",
+            ]
+
+        def skips_files_unchanged_since_last_success(self, project):
+            c = MockContext(run=True, repeat=True)
+            blacken(c, workers=1)
+            assert (project / ".invocations" / "blacken.json").exists()
+            c = MockContext(run=True, repeat=True)
+            assert blacken(c) == []
+            assert not c.run.called
+            (project / "a.py").write_text("x  =  1\n")
+            blacken(c, workers=1)
+            c.run.assert_called_once_with(
+                "black -l 79 ./a.py",
+                hide=True,
+                warn=True,
+                in_stream=False,
+            )
+
+        def cache_is_shared_between_format_and_check(self, project):
+            blacken(MockContext(run=True, repeat=True), workers=1)
+            c = MockContext(run=True, repeat=True)
+            assert blacken(c, check=True, workers=1) == []
+            assert not c.run.called
+            # And the check didn't wipe what formatting recorded
+            assert blacken(c, workers=1) == []
+            assert not c.run.called
+
+        def cache_is_per_line_length(self, project):
+            blacken(MockContext(run=True, repeat=True), workers=1)
+            c = MockContext(run=True, repeat=True)
+            blacken(c, line_length=100, workers=1)
+            assert c.run.called
+
+        def diff_alone_does_not_mark_files_clean(self, project):
+            # black --diff exits 0 even when it would reformat things
+            blacken(MockContext(run=True, repeat=True), diff=True, workers=1)
+            c = MockContext(run=True, repeat=True)
+            blacken(c, diff=True, workers=1)
+            assert c.run.called
+            # Whereas a passing --check --diff does
+            blacken(
+                MockContext(run=True, repeat=True),
+                diff=True,
+                check=True,
+                workers=1,
+            )
+            c = MockContext(run=True, repeat=True)
+            assert blacken(c, diff=True, check=True, workers=1) == []
+            assert not c.run.called
+
+        def cache_is_per_black_config(self, project):
+            blacken(MockContext(run=True, repeat=True), workers=1)
+            (project / "pyproject.toml").write_text("[project]\nname = 'x'\n")
+            c = MockContext(run=True, repeat=True)
+            assert blacken(c, workers=1) == []
+            (project / "pyproject.toml").write_text(
+                "[tool.black]\nskip-string-normalization = true\n"
+            )
+            blacken(c, workers=1)
+            assert c.run.called
+
+        def failures_are_not_cached_and_exit(self, project):
+            c = MockContext(run=Result(exited=123), repeat=True)
+            with pytest.raises(Exit) as info:
+                blacken(c, workers=1)
+            assert info.value.code == 123
+            c = MockContext(run=True, repeat=True)
+            blacken(c, workers=1)
+            assert c.run.called
+
+        @patch("invocations.checks.changed_files")
+        def changed_limits_to_changed_python_files(self, changed, project):
+            changed.return_value = ["a.py", "notes.txt", "pkg/vendor/c.py"]
+            c = MockContext(run=True, repeat=True)
+            blacken(c, changed="origin/main", exclude=["vendor"])
+            changed.assert_called_once_with(c, "origin/main")
+            c.run.assert_called_once_with(
+                "black -l 79 ./a.py",
+                hide=True,
+                warn=True,
+                in_stream=False,
             )
 
-        def find_opts_config_loses_to_runtime(self, ctx):
-            ctx.blacken = dict(find_opts="-and -not -name foo.py")
-            blacken(ctx, find_opts="-or -name '*.js'")
-            assert "find . -name '*.py' -or -name '*.js'" in ctx.run_command
+        @patch("invocations.checks.changed_files")
+        def changed_paths_are_shell_quoted(self, changed, project):
+            (project / "my file.py").write_text("")
+            changed.return_value = ["my file.py"]
+            c = MockContext(run=True, repeat=True)
+            blacken(c, changed=True)
+            c.run.assert_called_once_with(
+                "black -l 79 './my file.py'",
+                hide=True,
+                warn=True,
+                in_stream=False,
+            )
+
+        @patch("invocations.checks.changed_files", return_value=["x.rst"])
+        def changed_flag_defaults_to_HEAD(self, changed, project):
+            c = MockContext(run=True, repeat=True)
+            assert blacken(c, changed=True, find_opts="-foo") == []
+            changed.assert_called_once_with(c, "HEAD")
+            assert not c.run.called
+
+        def writes_json_report(self, project):
+            # As real black prints it, for the './'-prefixed paths we give
+            stderr = """would reformat a.py
+error: cannot format pkg/b.py: Cannot parse: 2:0: EOF in multi-line statement
+
+Oh no! 💥 💔 💥
+1 file would be reformatted, 2 files would be left unchanged, 1 file would fail to reformat.
+"""  # noqa
+            c = MockContext(run=Result(stderr=stderr, exited=123), repeat=True)
+            with pytest.raises(Exit):
+                blacken(c, workers=1, check=True, report="json")
+            with open(project / ".invocations/reports/blacken.json") as fd:
+                data = json.load(fd)
+            assert data["checker"] == "blacken"
+            assert data["command"] == "black -l 79 --check"
+            assert data["files"] == {
+                "./a.py": "would reformat",
+                "./other/d.py": "unchanged",
+                "./pkg/b.py": "error",
+                "./pkg/vendor/c.py": "unchanged",
+            }
+            batch = data["batches"][0]
+            assert batch["exited"] == 123
+            assert batch["seconds"] >= 0
+            assert data["seconds"] >= batch["seconds"]
+
+        def report_marks_skipped_files_cached(self, project):
+            blacken(MockContext(run=True, repeat=True), folders=["other"])
+            blacken(
+                MockContext(run=True, repeat=True),
+                folders=["other"],
+                report="json",
+            )
+            with open(project / ".invocations/reports/blacken.json") as fd:
+                data = json.load(fd)
+            assert data["files"] == {"other/d.py": "cached"}
+            assert data["batches"] == []
+
+        def unknown_report_formats_exit(self, ctx):
+            with pytest.raises(Exit):
+                blacken(ctx, report="xml")
+            assert not ctx.run.called
+
+        class find_opts_:
+            def use_legacy_find_pipeline(self, ctx):
+                blacken(ctx, find_opts="-and -not -name foo")
+                ctx.run.assert_called_once_with(
+                    "find . -name '*.py' -and -not -name foo | xargs black -l 79",  # noqa
+                    pty=True,
+                )
+
+            def configurable(self, ctx):
+                ctx.blacken = dict(find_opts="-and -not -name foo.py")
+                blacken(ctx)
+                assert (
+                    "find . -name '*.py' -and -not -name foo.py"
+                    in ctx.run_command
+                )
+
+            def config_loses_to_runtime(self, ctx):
+                ctx.blacken = dict(find_opts="-and -not -name foo.py")
+                blacken(ctx, find_opts="-or -name '*.js'")
+                assert (
+                    "find . -name '*.py' -or -name '*.js'" in ctx.run_command
+                )
 
         def aliased_to_format(self):
             assert blacken.aliases == ["format"]
@@ -95,13 +281,230 @@ class checks:
             lint(ctx)
             assert ctx.run_command == "flake8"
 
+        @patch("invocations.checks.changed_files")
+        def changed_lints_only_changed_python_files(self, changed, ctx):
+            changed.return_value = ["b.py", "README.rst", "a.py"]
+            lint(ctx, changed="main")
+            changed.assert_called_once_with(ctx, "main")
+            assert ctx.run_command == "flake8 a.py b.py"
+
+        @patch("invocations.checks.changed_files")
+        def changed_paths_are_shell_quoted(self, changed, ctx):
+            changed.return_value = ["my file.py", "$(boom).py"]
+            lint(ctx, changed=True)
+            assert ctx.run_command == "flake8 '$(boom).py' 'my file.py'"
+
+        @patch("invocations.checks.changed_files", return_value=[])
+        def changed_with_nothing_changed_skips_flake8(self, changed):
+            c = MockContext()
+            lint(c, changed=True)
+            changed.assert_called_once_with(c, "HEAD")
+
+    class lint_report:
+        @trap
+        def writes_per_file_results(self, tmp_path, monkeypatch):
+            (tmp_path / "a.py").write_text("import os\n")
+            (tmp_path / "b.py").write_text("")
+            monkeypatch.chdir(tmp_path)
+            diagnostic = "a.py:1:1: F401 'os' imported but unused"
+            c = MockContext(
+                run={"flake8 a.py b.py": Result(diagnostic + "\n", exited=1)}
+            )
+            result = lint(c, report="json")
+            assert result.exited == 1
+            assert sys.stdout.getvalue().startswith(diagnostic)
+            with open(tmp_path / ".invocations/reports/lint.json") as fd:
+                data = json.load(fd)
+            assert data["checker"] == "lint"
+            assert data["exited"] == 1
+            assert data["seconds"] >= 0
+            assert data["files"] == {
+                "a.py": dict(
+                    status="failed", diagnostics=[diagnostic], cached=False
+                ),
+                "b.py": dict(status="clean", diagnostics=[], cached=False),
+            }
+
+        def notes_cached_results(self, tmp_path, monkeypatch):
+            (tmp_path / "a.py").write_text("")
+            monkeypatch.chdir(tmp_path)
+            lint(MockContext(run=Result("")), cache=True)
+            lint(MockContext(), cache=True, report="json")
+            with open(tmp_path / ".invocations/reports/lint.json") as fd:
+                data = json.load(fd)
+            assert data["files"]["a.py"]["cached"] is True
+
+    class lint_cache:
+        @pytest.fixture(name="project")
+        def _project(self, tmp_path, monkeypatch):
+            (tmp_path / "a.py").write_text("import os\n")
+            (tmp_path / "b.py").write_text("x = 1\n")
+            (tmp_path / ".git").mkdir()
+            (tmp_path / ".git" / "hook.py").write_text("")
+            monkeypatch.chdir(tmp_path)
+            return tmp_path
+
+        @trap
+        def only_lints_cache_misses_and_replays_hits(self, project):
+            diagnostic = "a.py:1:1: F401 'os' imported but unused\n"
+            c = MockContext(
+                run={"flake8 a.py b.py": Result(diagnostic, exited=1)}
+            )
+            result = lint(c, cache=True)
+            assert result.stdout == diagnostic
+            assert result.exited == 1
+            assert (
+                len(list((project / ".invocations" / "lint").iterdir())) == 2
+            )
+            # Cached: no flake8 run at all, same output
+            c = MockContext()
+            result = lint(c, cache=True)
+            assert result.stdout == diagnostic
+            assert result.failed
+            assert sys.stdout.getvalue() == diagnostic * 2
+            # Changed contents: only that file is rerun
+            (project / "b.py").write_text("y = 2\n")
+            c = MockContext(run={"flake8 b.py": Result("")})
+            assert lint(c, cache=True).stdout == diagnostic
+
+        def identical_files_have_their_own_entries(self, project):
+            # E.g. per-file-ignores means flake8 results depend on paths
+            (project / "b.py").write_text("import os\n")
+            c = MockContext(
+                run={
+                    "flake8 a.py b.py": Result(
+                        "a.py:1:1: F401 oops\n", exited=1
+                    )
+                }
+            )
+            lint(c, cache=True)
+            assert (
+                len(list((project / ".invocations" / "lint").iterdir())) == 2
+            )
+            result = lint(MockContext(), cache=True)
+            assert result.stdout == "a.py:1:1: F401 oops\n"
+
+        def config_changes_invalidate(self, project):
+            lint(MockContext(run=Result("")), cache=True)
+            (project / "setup.cfg").write_text("[flake8]\nignore = F401\n")
+            c = MockContext(run=True)
+            lint(c, cache=True)
+            assert c.run.call_args[0][0] == "flake8 a.py b.py"
+
+        def honors_flake8_configured_excludes(self, project):
+            for path in ("build/b.py", "vendor/v.py", ".git/x.py"):
+                (project / path).parent.mkdir(exist_ok=True)
+                (project / path).write_text("import os\n")
+            (project / ".flake8").write_text(
+                "[flake8]\nexclude = build\nextend-exclude = ./vendor\n"
+            )
+            c = MockContext(run=True)
+            lint(c, cache=True)
+            # Configured 'exclude' replaced flake8's defaults (e.g. .git)
+            cmd = "flake8 .git/hook.py .git/x.py a.py b.py"
+            assert c.run.call_args[0][0] == cmd
+
+        @patch("invocations.checks.changed_files")
+        def changed_files_honor_flake8_excludes(self, changed, project):
+            (project / "setup.cfg").write_text("[flake8]\nexclude = build\n")
+            changed.return_value = ["a.py", "build/b.py", "build/sub/c.py"]
+            c = MockContext(run=True)
+            lint(c, changed=True)
+            assert c.run.call_args[0][0] == "flake8 a.py"
+
+        def plugin_changes_invalidate(self, project):
+            lint(MockContext(run=Result("")), cache=True)
+            with patch(
+                "invocations.checks._flake8_setup",
+                return_value="flake8 7.3.0, flake8-bugbear 24.1.0",
+            ):
+                c = MockContext(run=True)
+                lint(c, cache=True)
+            assert c.run.call_args[0][0] == "flake8 a.py b.py"
+
+        def crashes_are_not_cached(self, project):
+            lint(MockContext(run=Result("", exited=2)), cache=True)
+            assert not (project / ".invocations" / "lint").exists()
+
+        def evicts_least_recently_used(self, project):
+            lint(MockContext(run=Result("")), cache=True)
+            root = project / ".invocations" / "lint"
+            oldest, older = sorted(root.iterdir(), key=lambda x: x.name)
+            os.utime(oldest, (0, 0))
+            os.utime(older, (1, 1))
+            (project / "a.py").unlink()
+            (project / "b.py").unlink()
+            (project / "c.py").write_text("z = 3\n")
+            c = MockContext(run={"flake8 c.py": Result("")})
+            c.config.lint = dict(cache=True, cache_size=2)
+            lint(c)
+            remaining = list(root.iterdir())
+            assert len(remaining) == 2
+            assert oldest not in remaining
+            assert older in remaining
+
     class all_:
-        def runs_blacken_and_lint(self, ctx):
-            all_task(ctx)
-            assert ctx.run.call_args_list == [
-                call("find . -name '*.py' | xargs black -l 79", pty=True),
-                call("flake8", pty=True, warn=True),
-            ]
+        @pytest.fixture(name="checkers")
+        def _checkers(self):
+            with patch("invocations.checks.blacken") as blacken, patch(
+                "invocations.checks.lint"
+            ) as lint:
+                blacken.return_value = [Result("black out\n")]
+                lint.return_value = Result("flake8 out\n")
+                yield blacken, lint
+
+        @trap
+        def checks_black_and_flake8_with_hidden_output(self, checkers):
+            blacken, lint = checkers
+            results = all_task(MockContext())
+            for check in (blacken, lint):
+                ctx = check.call_args[0][0]
+                assert ctx.config.run.hide is True
+                assert ctx.config.run.warn is True
+            assert blacken.call_args[1] == dict(
+                check=True, changed=None, report=None
+            )
+            assert lint.call_args[1] == dict(changed=None, report=None)
+            assert results == {
+                "black": blacken.return_value,
+                "flake8": [lint.return_value],
+            }
+            output = sys.stdout.getvalue()
+            assert "=== black ===\nblack out\n=== flake8 ===\n" in output
+            assert re.search(r"black\s+passed\s+\d+\.\d\d", output)
+
+        def passes_changed_through(self, checkers):
+            blacken, lint = checkers
+            all_task(MockContext(), changed="main")
+            assert blacken.call_args[1]["changed"] == "main"
+            assert lint.call_args[1]["changed"] == "main"
+
+        @trap
+        def runs_extra_configured_checkers(self, checkers):
+            c = MockContext()
+            c.config.checks = dict(extra={"echoer": "echo hi"})
+            results = all_task(c)
+            assert results["echoer"][0].stdout == "hi\n"
+            assert "=== echoer ===\nhi\n" in sys.stdout.getvalue()
+
+        @trap
+        def exits_after_reporting_if_any_checker_failed(self, checkers):
+            blacken, lint = checkers
+            lint.return_value = Result("bad\n", exited=2)
+            with pytest.raises(Exit) as info:
+                all_task(MockContext())
+            assert info.value.code == 2
+            output = sys.stdout.getvalue()
+            assert re.search(r"flake8\s+FAILED", output)
+            assert re.search(r"black\s+passed", output)
+
+        @trap
+        def checkers_with_nothing_to_do_are_skipped(self, checkers):
+            blacken, lint = checkers
+            blacken.return_value = []
+            lint.return_value = None
+            all_task(MockContext())
+            assert re.search(r"flake8\s+skipped", sys.stdout.getvalue())
 
         def is_default_task(self):
             assert all_task.is_default
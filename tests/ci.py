@@ -0,0 +1,123 @@
+import hashlib
+import os
+import shlex
+
+from invoke import MockContext, Config, Result
+from pytest import fixture
+
+from invocations.ci import (
+    make_sshable,
+    make_sudouser,
+    ns,
+    restore_snapshot,
+    save_snapshot,
+    snapshot_path,
+)
+
+
+def _context(**kwargs):
+    config = Config(overrides=ns.configuration())
+    return MockContext(config=config, **kwargs)
+
+
+class make_sudouser_:
+    def creates_user_and_password_in_one_idempotent_sudo(self):
+        c = _context(sudo=True)
+        make_sudouser(c)
+        c.sudo.assert_called_once_with(
+            "sh -c 'id -u invoker >/dev/null 2>&1 || { useradd invoker"
+            " --create-home --groups sudo,circleci && echo invoker:secret"
+            " | chpasswd; }'"
+        )
+
+
+class make_sshable_:
+    def sets_up_key_in_one_su_session_unless_present(self):
+        c = _context(run=True)
+        make_sshable(c)
+        ssh = "~invoker/.ssh"
+        script = (
+            "test -f {0}/id_rsa || (mkdir -p {0} && chmod 0700 {0} &&"
+            " ssh-keygen -q -t rsa -f {0}/id_rsa -N '' &&"
+            " cp {0}/id_rsa.pub {0}/authorized_keys)"
+        ).format(ssh)
+        c.run.assert_called_once_with(
+            'sudo su invoker -c "export PATH=$PATH && {}"'.format(script)
+        )
+        assert c.config.sudo.user == "invoker"
+
+
+class snapshots:
+    @fixture(name="project")
+    def _project(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        return tmp_path
+
+    def _snapshot(self, c, content=b"tarball"):
+        path = snapshot_path(c)
+        path.parent.mkdir(parents=True)
+        path.write_bytes(content)
+        digest = hashlib.sha256(content).hexdigest()
+        path.with_name(path.name + ".sha256").write_text(digest + "\n")
+        return path
+
+    def path_is_keyed_on_sudo_config(self, project):
+        c = _context()
+        path = snapshot_path(c)
+        assert path.parent == project / ".invocations" / "ci"
+        assert path.name.startswith("sshable-")
+        c.config.ci.sudo.password = "other"
+        assert snapshot_path(c) != path
+
+    def restores_valid_snapshot_instead_of_generating(self, project):
+        c = _context(run=True)
+        path = self._snapshot(c)
+        make_sshable(c, snapshot=True)
+        script = (
+            "test -f ~invoker/.ssh/id_rsa || (tar -C ~invoker -xzf {} &&"
+            " chown -R invoker: ~invoker/.ssh)"
+        ).format(path)
+        c.run.assert_called_once_with("sudo sh -c '{}'".format(script))
+        # Later sudo() calls still run as the CI user
+        assert c.config.sudo.user == "invoker"
+        assert c.config.sudo.password == "secret"
+
+    def snapshot_paths_are_shell_quoted(self, project):
+        c = _context(run=True, repeat=True)
+        c.config.invocations = {"cache_dir": "my cache"}
+        path = self._snapshot(c)
+        assert restore_snapshot(c, path)
+        save_snapshot(c, path)
+        for command in (x[1][0] for x in c.run.mock_calls):
+            sudo, sh, flag, script = shlex.split(command)
+            assert str(path) in shlex.split(script)
+
+    def ignores_corrupt_snapshot_and_replaces_it(self, project):
+        c = _context(run=True, repeat=True)
+        path = self._snapshot(c, b"tarball")
+        path.write_bytes(b"tarbalk")
+        c.config.ci.snapshot = True
+
+        def run(command, **kwargs):
+            if "tar -C ~invoker -czf" in command:
+                path.write_bytes(b"new tarball")
+            return Result(command=command)
+
+        c.run.side_effect = run
+        make_sshable(c)
+        commands = [x[1][0] for x in c.run.mock_calls]
+        assert len(commands) == 2
+        assert commands[0].startswith("sudo su invoker")
+        assert commands[1] == (
+            "sudo sh -c 'tar -C ~invoker -czf {0} .ssh &&"
+            " chown {1}:{2} {0}'".format(path, os.getuid(), os.getgid())
+        )
+        digest = hashlib.sha256(b"new tarball").hexdigest()
+        assert path.with_name(path.name + ".sha256").read_text() == (
+            digest + "\n"
+        )
+        assert restore_snapshot(c, path)
+
+    def missing_snapshot_is_not_restored(self, project):
+        c = _context()
+        assert not restore_snapshot(c, snapshot_path(c))
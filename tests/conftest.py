@@ -4,12 +4,22 @@ from unittest.mock import patch, Mock, MagicMock, call
 from pytest import fixture
 from invoke import MockContext
 
+from invocations.environment import ci_environment
+
 # Set up icecream globally for convenience.
 from icecream import install
 
 install()
 
 
+@fixture(autouse=True)
+def fresh_ci_environment():
+    # CI detection is cached per process; tests frequently patch os.environ.
+    ci_environment.cache_clear()
+    yield
+    ci_environment.cache_clear()
+
+
 @fixture
 def ctx():
     # TODO: this would be a nice convenience in MockContext itself, though most
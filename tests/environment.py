@@ -1,7 +1,7 @@
 from unittest.mock import patch
 from pytest import mark
 
-from invocations.environment import in_ci
+from invocations.environment import CIEnvironment, ci_environment, in_ci
 
 
 @mark.parametrize(
@@ -30,3 +30,49 @@ from invocations.environment import in_ci
 def in_ci_true_when_any_expected_vars_nonempty(environ, expected):
     with patch("invocations.environment.os.environ", environ):
         assert in_ci() is expected
+
+
+def in_ci_is_computed_once_per_process():
+    with patch("invocations.environment.os.environ", dict(TRAVIS="true")):
+        assert in_ci() is True
+    with patch("invocations.environment.os.environ", dict()):
+        assert in_ci() is True
+        ci_environment.cache_clear()
+        assert in_ci() is False
+
+
+@patch("invocations.environment.cpu_count", lambda: 4)
+@mark.parametrize(
+    "environ,expected",
+    [
+        (dict(), None),
+        (
+            dict(
+                CIRCLECI="true", CIRCLE_NODE_INDEX="1", CIRCLE_NODE_TOTAL="3"
+            ),
+            CIEnvironment("circleci", 1, 3, None, 4),
+        ),
+        (
+            dict(GITLAB_CI="true", CI_NODE_INDEX="1", CI_NODE_TOTAL="3"),
+            CIEnvironment("gitlab", 0, 3, None, 4),
+        ),
+        (
+            dict(GITHUB_ACTIONS="true", RUNNER_TOOL_CACHE="/opt/tools"),
+            CIEnvironment("github", None, None, "/opt/tools", 4),
+        ),
+        (
+            dict(CIRCLECI="true", CIRCLE_NODE_INDEX="bogus"),
+            CIEnvironment("circleci", None, None, None, 4),
+        ),
+    ],
+    ids=[
+        "not on CI",
+        "zero-based node index",
+        "one-based node index",
+        "tool cache",
+        "unusable node info",
+    ],
+)
+def ci_environment_describes_provider(environ, expected):
+    with patch("invocations.environment.os.environ", environ):
+        assert ci_environment() == expected
@@ -0,0 +1,103 @@
+import os
+
+from pytest import fixture
+
+from invocations.imports import ImportIndex, find_test_modules
+
+
+@fixture(name="tree")
+def _tree(tmp_path):
+    files = {
+        "mypkg/__init__.py": "",
+        "mypkg/core.py": "import os\n",
+        "mypkg/util.py": "from .core import thing\n",
+        "mypkg/cli.py": "from . import util\n",
+        "mypkg/other.py": "",
+        "tests/conftest.py": "import mypkg\n",
+        "tests/core.py": "from mypkg.core import thing\n",
+        "tests/cli.py": "import mypkg.cli\n",
+        "tests/other.py": "from mypkg import other\n",
+        "tests/_support/helpers.py": "from mypkg import util\n",
+    }
+    for path, content in files.items():
+        target = tmp_path / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(content)
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    yield tmp_path
+    os.chdir(cwd)
+
+
+class ImportIndex_:
+    def indexes_modules_by_dotted_name(self, tree):
+        index = ImportIndex(["mypkg"])
+        assert "mypkg" in index.paths
+        assert "mypkg.core" in index.paths
+        assert "tests.core" in index.paths
+
+    def direct_importers_are_affected(self, tree):
+        index = ImportIndex(["mypkg"])
+        assert index.affected_tests("mypkg/other.py") == ["tests/other.py"]
+
+    def transitive_and_relative_importers_are_affected(self, tree):
+        index = ImportIndex(["mypkg"])
+        assert index.affected_tests("./mypkg/core.py") == [
+            "tests/cli.py",
+            "tests/core.py",
+        ]
+
+    def package_init_affects_everything_under_it(self, tree):
+        index = ImportIndex(["mypkg"])
+        assert index.affected_tests("mypkg/__init__.py") == [
+            "tests/cli.py",
+            "tests/core.py",
+            "tests/other.py",
+        ]
+
+    def test_modules_affect_themselves(self, tree):
+        index = ImportIndex(["mypkg"])
+        assert index.affected_tests("tests/core.py") == ["tests/core.py"]
+
+    def support_modules_are_not_tests(self, tree):
+        index = ImportIndex(["mypkg"])
+        assert "tests/_support/helpers.py" not in index.affected_tests(
+            "mypkg/util.py"
+        )
+
+    def conftest_and_unknown_python_files_mean_everything(self, tree):
+        index = ImportIndex(["mypkg"])
+        assert index.affected_tests("tests/conftest.py") is None
+        assert index.affected_tests("scripts/tool.py") is None
+
+    def directories_and_other_files_affect_nothing(self, tree):
+        index = ImportIndex(["mypkg"])
+        (tree / "tests" / "__pycache__").mkdir()
+        assert index.affected_tests("README.rst") == []
+        assert index.affected_tests("tests/__pycache__/core.pyc") == []
+        assert index.refresh("tests/__pycache__") == []
+        assert index.refresh("tests/_support") == []
+
+    def refresh_picks_up_new_imports(self, tree):
+        index = ImportIndex(["mypkg"])
+        assert index.affected_tests("mypkg/other.py") == ["tests/other.py"]
+        (tree / "tests" / "core.py").write_text("import mypkg.other\n")
+        assert index.refresh("tests/core.py") == ["tests/core.py"]
+        assert index.affected_tests("mypkg/other.py") == [
+            "tests/core.py",
+            "tests/other.py",
+        ]
+
+    def refresh_drops_deleted_files(self, tree):
+        index = ImportIndex(["mypkg"])
+        (tree / "tests" / "other.py").unlink()
+        index.refresh("tests/other.py")
+        assert index.affected_tests("mypkg/other.py") == []
+
+
+def find_test_modules_skips_support_files_and_conftest(tree):
+    assert find_test_modules("tests") == [
+        "tests/cli.py",
+        "tests/core.py",
+        "tests/other.py",
+    ]
@@ -0,0 +1,87 @@
+from unittest.mock import patch
+
+from invoke import MockContext
+from pytest import fixture
+
+from invocations import jobs
+from invocations.jobs import available_memory, cpu_count, default_jobs
+
+GiB = 1024**3
+
+
+@fixture(name="system")
+def _system(tmp_path):
+    """
+    Point cgroup & meminfo lookups at a scratch dir; yields a file writer.
+    """
+
+    def write(path, content):
+        target = tmp_path / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(content)
+
+    cgroup = tmp_path / "cgroup"
+    cgroup.mkdir()
+    with patch.object(jobs, "_CGROUP", str(cgroup)), patch.object(
+        jobs, "_MEMINFO", str(tmp_path / "meminfo")
+    ), patch("os.sched_getaffinity", lambda pid: {0, 1, 2, 3}, create=True):
+        yield write
+
+
+class cpu_count_:
+    def uses_affinity(self, system):
+        assert cpu_count() == 4
+
+    def rounds_up_cgroup_v2_quota(self, system):
+        system("cgroup/cpu.max", "150000 100000\n")
+        assert cpu_count() == 2
+
+    def ignores_unlimited_v2_quota(self, system):
+        system("cgroup/cpu.max", "max 100000\n")
+        assert cpu_count() == 4
+
+    def honors_cgroup_v1_quota(self, system):
+        system("cgroup/cpu/cpu.cfs_quota_us", "100000\n")
+        system("cgroup/cpu/cpu.cfs_period_us", "100000\n")
+        assert cpu_count() == 1
+
+    def ignores_unlimited_v1_quota(self, system):
+        system("cgroup/cpu/cpu.cfs_quota_us", "-1\n")
+        system("cgroup/cpu/cpu.cfs_period_us", "100000\n")
+        assert cpu_count() == 4
+
+
+class available_memory_:
+    def unknown_without_any_info(self, system):
+        assert available_memory() is None
+
+    def reads_meminfo(self, system):
+        system("meminfo", "MemTotal: 9999 kB\nMemAvailable: 2048 kB\n")
+        assert available_memory() == 2048 * 1024
+
+    def takes_smaller_of_meminfo_and_cgroup_headroom(self, system):
+        system("meminfo", "MemAvailable: {} kB\n".format(8 * GiB // 1024))
+        system("cgroup/memory.max", str(3 * GiB))
+        system("cgroup/memory.current", str(GiB))
+        assert available_memory() == 2 * GiB
+
+
+class default_jobs_:
+    def limited_by_cpus(self, system):
+        assert default_jobs() == 4
+
+    def limited_by_memory(self, system):
+        system("meminfo", "MemAvailable: {} kB\n".format(GiB // 1024))
+        assert default_jobs() == 2
+        assert default_jobs(memory_per_job=GiB) == 1
+
+    def at_least_one(self, system):
+        system("meminfo", "MemAvailable: 1 kB\n")
+        assert default_jobs() == 1
+
+    def config_wins(self, system):
+        c = MockContext()
+        c.config.invocations = {"jobs": 16}
+        assert default_jobs(c) == 16
+        c.config.invocations = {}
+        assert default_jobs(c) == 4
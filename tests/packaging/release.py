@@ -1,4 +1,5 @@
 from contextlib import contextmanager
+import json
 from os import path
 from pathlib import Path
 import re
@@ -9,7 +10,7 @@ from invoke import MockContext, Result, Config, Exit
 from docutils.utils import Reporter
 from unittest.mock import patch, call
 import pytest
-from pytest import skip
+from pytest import fixture, skip
 from pytest_relaxed import trap, raises
 
 from invocations.packaging.semantic_version_monkey import Version
@@ -33,6 +34,7 @@ from invocations.packaging.release import (
     test_install as install_test_task,  # to avoid pytest treating as test func
     ns as release_ns,
 )
+from invocations.util import tmpdir
 
 
 class release_line_:
@@ -1186,6 +1188,16 @@ class test_install_:
         ):
             assert unwanted not in c.run.mock_calls
 
+    @trap
+    def verbose_stats_only_cover_its_own_tmpdirs(self, install):
+        c = install
+        # Somebody else's tmpdir, in the shared default pool
+        with tmpdir():
+            pass
+        install_test_task(c, directory="whatever", verbose=True)
+        assert "2 created" in sys.stdout.getvalue()
+        assert "2 cleaned up" in sys.stdout.getvalue()
+
 
 class push_:
     def pushes_with_follow_tags(self):
@@ -1221,12 +1233,18 @@ class push_:
         c.run.assert_called_once_with("git push --follow-tags --no-verify")
 
 
+def _timed_context(tmp_path, c=None):
+    c = c or MockContext(run=True)
+    c.config["invocations"] = {"cache_dir": str(tmp_path)}
+    return c
+
+
 class all_task:
     @patch("invocations.packaging.release.prepare")
     @patch("invocations.packaging.release.publish")
     @patch("invocations.packaging.release.push")
-    def runs_primary_workflow(self, push, publish, prepare):
-        c = MockContext(run=True)
+    def runs_primary_workflow(self, push, publish, prepare, tmp_path):
+        c = _timed_context(tmp_path)
         all_(c)
         # TODO: this doesn't actually prove order of operations. not seeing an
         # unhairy way to do that, but not really that worried either...:P
@@ -1237,8 +1255,8 @@ class all_task:
     @patch("invocations.packaging.release.prepare")
     @patch("invocations.packaging.release.publish")
     @patch("invocations.packaging.release.push")
-    def passes_through_dry_run_flag(self, push, publish, prepare):
-        c = MockContext(run=True)
+    def passes_through_dry_run_flag(self, push, publish, prepare, tmp_path):
+        c = _timed_context(tmp_path)
         all_(c, dry_run=True)
         prepare.assert_called_once_with(c, dry_run=True)
         publish.assert_called_once_with(c, dry_run=True)
@@ -1247,6 +1265,123 @@ class all_task:
     def bound_to_name_without_underscore(self):
         assert all_.name == "all"
 
+    class timings:
+        @fixture(autouse=True)
+        def _cache_dir(self, tmp_path, monkeypatch):
+            # Keep any stray timings out of the real cache dir
+            monkeypatch.chdir(tmp_path)
+
+        @trap
+        @patch("invocations.packaging.release._project_version")
+        @patch("invocations.packaging.release.prepare")
+        @patch("invocations.packaging.release.push")
+        def times_stages_and_publish_substages(
+            self, push, prepare, version, fakepub, tmp_path
+        ):
+            version.return_value = "1.2.3"
+            c, _ = fakepub
+            all_(_timed_context(tmp_path, c))
+            stages = [
+                "prepare",
+                "publish",
+                "publish/build",
+                "publish/twine check",
+                "publish/test_install",
+                "publish/upload",
+                "push",
+            ]
+            output = sys.stdout.getvalue()
+            for name in stages + ["total"]:
+                assert name in output
+            data = json.loads((tmp_path / "release-timings.json").read_text())
+            record = data["1.2.3"]
+            assert list(record["stages"]) == sorted(stages)
+            assert record["completed"] is True
+            assert record["dry_run"] is False
+            top = ("prepare", "publish", "push")
+            total = sum(record["stages"][x] for x in top)
+            assert record["total"] == total
+
+        @trap
+        @patch("invocations.packaging.release._project_version")
+        @patch("invocations.packaging.release.prepare")
+        @patch("invocations.packaging.release.publish")
+        @patch("invocations.packaging.release.push")
+        def reports_partial_timings_on_failure(
+            self, push, publish, prepare, version, tmp_path
+        ):
+            version.return_value = "1.2.3"
+            publish.side_effect = Exit(1)
+            with pytest.raises(Exit):
+                all_(_timed_context(tmp_path), dry_run=True)
+            push.assert_not_called()
+            data = json.loads((tmp_path / "release-timings.json").read_text())
+            record = data["1.2.3+dry"]
+            assert list(record["stages"]) == ["prepare", "publish"]
+            assert record["completed"] is False
+            assert record["dry_run"] is True
+
+        @trap
+        @patch("invocations.packaging.release.prepare")
+        @patch("invocations.packaging.release.publish")
+        @patch("invocations.packaging.release.push")
+        def keeps_timings_of_other_versions(
+            self, push, publish, prepare, tmp_path
+        ):
+            path = tmp_path / "release-timings.json"
+            path.write_text(json.dumps({"0.1.0": {"total": 5}}))
+            with patch(
+                "invocations.packaging.release._project_version",
+                return_value="0.2.0",
+            ):
+                all_(_timed_context(tmp_path))
+            assert sorted(json.loads(path.read_text())) == ["0.1.0", "0.2.0"]
+
+        @trap
+        @patch("invocations.packaging.release.prepare")
+        @patch("invocations.packaging.release.publish")
+        @patch("invocations.packaging.release.push")
+        def storage_errors_do_not_mask_release_errors(
+            self, push, publish, prepare, tmp_path
+        ):
+            publish.side_effect = Exit("upload exploded")
+            # Cache dir is a file, so can't be written into
+            (tmp_path / "cache").write_text("")
+            c = _timed_context(tmp_path / "cache")
+            with pytest.raises(Exit, match="upload exploded"):
+                all_(c)
+            assert "Unable to store timings" in sys.stderr.getvalue()
+
+        @trap
+        @patch("invocations.packaging.release.prepare")
+        @patch("invocations.packaging.release.publish")
+        @patch("invocations.packaging.release.push")
+        def dry_runs_do_not_replace_real_timings(
+            self, push, publish, prepare, tmp_path
+        ):
+            path = tmp_path / "release-timings.json"
+            path.write_text(json.dumps({"0.2.0": {"total": 5}}))
+            with patch(
+                "invocations.packaging.release._project_version",
+                return_value="0.2.0",
+            ):
+                all_(_timed_context(tmp_path), dry_run=True)
+            data = json.loads(path.read_text())
+            assert data["0.2.0"] == {"total": 5}
+            assert data["0.2.0+dry"]["dry_run"] is True
+
+        @patch("invocations.packaging.release.build")
+        @patch("invocations.packaging.release.twine_check", return_value=False)
+        @patch("invocations.packaging.release.test_install")
+        @patch("invocations.packaging.release.upload")
+        def publish_alone_is_not_timed(self, *mocks):
+            c = MockContext(run=True)
+            with patch("invocations.util.rmtree"), patch(
+                "invocations.util.mkdtemp", return_value="tmpdir"
+            ):
+                publish(c)
+            assert not Path(".invocations").exists()
+
 
 class namespace:
     def contains_all_tasks(self):
@@ -0,0 +1,122 @@
+import json
+import os
+import subprocess
+import sys
+
+from invoke import Config, Context, MockContext, task
+from pytest import fixture, raises
+
+from invocations import profiling
+from invocations.profiling import Profiler, configure, disable, enable
+
+
+@fixture(autouse=True)
+def _disabled():
+    yield
+    disable()
+
+
+@task(name="mytask")
+def _mytask(c):
+    c.run("echo hi", hide=True, in_stream=False)
+
+
+class Profiler_:
+    def span_records_complete_events(self, tmp_path):
+        profiler = Profiler(tmp_path / "trace.json")
+        with profiler.span("thing", "misc", extra=1) as args:
+            args["more"] = 2
+        (event,) = profiler.events
+        assert event["name"] == "thing"
+        assert event["cat"] == "misc"
+        assert event["ph"] == "X"
+        assert event["pid"] == os.getpid()
+        assert event["dur"] >= 0
+        assert event["args"] == {"extra": 1, "more": 2}
+
+    def span_notes_exceptions(self, tmp_path):
+        profiler = Profiler(tmp_path / "trace.json")
+        with raises(ValueError):
+            with profiler.span("thing", "misc"):
+                raise ValueError("nope")
+        assert profiler.events[0]["args"]["error"] == "ValueError: nope"
+
+    def dump_writes_chrome_trace(self, tmp_path):
+        path = tmp_path / "sub" / "trace.json"
+        profiler = Profiler(path)
+        with profiler.span("thing", "misc"):
+            pass
+        assert profiler.dump() == path
+        data = json.loads(path.read_text())
+        assert [x["name"] for x in data["traceEvents"]] == ["thing"]
+
+
+class enable_:
+    def wraps_runs_and_task_calls(self, tmp_path):
+        profiler = enable(tmp_path / "trace.json")
+        _mytask(Context())
+        run, call = profiler.events
+        assert call["name"] == "mytask"
+        assert call["cat"] == "task"
+        assert run["name"] == "echo hi"
+        assert run["cat"] == "run"
+        assert run["args"] == {"command": "echo hi", "exited": 0}
+        # Inner spans lie within outer ones
+        assert call["ts"] <= run["ts"]
+        assert run["ts"] + run["dur"] <= call["ts"] + call["dur"]
+
+    def truncates_long_commands_in_names(self, tmp_path):
+        profiler = enable(tmp_path / "trace.json")
+        command = "echo {}".format("x" * 100)
+        Context().run(command, hide=True, in_stream=False)
+        (event,) = profiler.events
+        assert len(event["name"]) == profiling.NAME_LENGTH
+        assert event["name"].endswith("...")
+        assert event["args"]["command"] == command
+
+    def is_idempotent(self, tmp_path):
+        profiler = enable(tmp_path / "trace.json")
+        assert enable(tmp_path / "other.json") is profiler
+        Context().run("true", hide=True, in_stream=False)
+        assert len(profiler.events) == 1
+
+    def disable_restores_originals(self, tmp_path):
+        run = Context.run
+        profiler = enable(tmp_path / "trace.json")
+        assert Context.run is not run
+        assert disable() is profiler
+        assert Context.run is run
+        assert profiling.enabled() is None
+        assert disable() is None
+
+    def env_var_enables_and_dumps_at_exit(self, tmp_path):
+        path = tmp_path / "trace.json"
+        code = "from invoke import Context; Context().run('true')"
+        env = dict(os.environ, INVOCATIONS_PROFILE=str(path))
+        subprocess.run(
+            [sys.executable, "-c", "import invocations; " + code],
+            env=env,
+            check=True,
+        )
+        data = json.loads(path.read_text())
+        assert [x["name"] for x in data["traceEvents"]] == ["true"]
+
+
+class configure_:
+    def does_nothing_by_default(self):
+        assert configure(MockContext()) is None
+        assert profiling.enabled() is None
+
+    def enables_with_configured_path(self, tmp_path):
+        path = str(tmp_path / "trace.json")
+        c = MockContext(
+            config=Config(overrides={"invocations": {"profile": path}})
+        )
+        profiler = configure(c)
+        assert profiler is profiling.enabled()
+        assert str(profiler.path) == path
+
+    def true_means_cache_dir(self, tmp_path):
+        config = {"invocations": {"profile": True, "cache_dir": str(tmp_path)}}
+        c = MockContext(config=Config(overrides=config))
+        assert configure(c).path == tmp_path / "profile.json"
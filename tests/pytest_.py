@@ -1,8 +1,23 @@
+import json
+import os
+import re
+import sys
 from contextlib import contextmanager
+from pathlib import Path
 
-from invoke import MockContext
-from invocations.pytest import test as _test_task, coverage
-from unittest.mock import Mock, call
+from invoke import MockContext, Exit, Result
+from pytest import fixture, importorskip, raises, skip
+from pytest_relaxed import trap
+from invocations.environment import CIEnvironment
+from invocations.pytest import (
+    _WarmServer,
+    test as _test_task,
+    coverage,
+    integration,
+    timings_report,
+    watch_tests,
+)
+from unittest.mock import Mock, call, patch
 
 
 @contextmanager
@@ -17,6 +32,14 @@ def _expect(flags=None, extra_flags=None, kwargs=None):
     c.run.assert_called_once_with("pytest {}".format(flags), **kwargs)
 
 
+def _contexts(path):
+    from coverage import CoverageData
+
+    data = CoverageData(basename=str(path))
+    data.read()
+    return data.measured_contexts()
+
+
 class test_:
     def defaults_to_verbose_color_and_syscapture_with_pty_True(self):
         # Relies on default flags within expect helper
@@ -66,6 +89,229 @@ class coverage_:
         faketest1.assert_called_once_with(c, opts=flags)
         faketest2.assert_called_once_with(c, opts=flags)
 
+    class parallel_:
+        def _testers(self, *results):
+            seen = []
+
+            def make(result):
+                def tester(c, opts):
+                    seen.append((c.config.run.env["COVERAGE_FILE"], opts))
+                    return result
+
+                return tester
+
+            return seen, [make(x) for x in results]
+
+        def runs_testers_with_own_data_files_then_combines(self):
+            c = MockContext(run=True, repeat=True)
+            seen, testers = self._testers(Result("one"), Result("two"))
+            coverage(
+                c,
+                tester=testers[0],
+                additional_testers=testers[1:],
+                parallel=True,
+            )
+            assert sorted(seen) == [
+                (".coverage.0", "--cov --no-cov-on-fail --cov-report="),
+                (".coverage.1", "--cov --no-cov-on-fail --cov-report="),
+            ]
+            assert c.run.mock_calls == [
+                call("coverage erase"),
+                call("coverage combine", warn=False),
+                call("coverage report"),
+            ]
+
+        def other_report_types_use_coverage_subcommand(self):
+            c = MockContext(run=True, repeat=True)
+            seen, testers = self._testers(Result(), Result())
+            coverage(
+                c,
+                report="xml",
+                tester=testers[0],
+                additional_testers=testers[1:],
+                parallel=True,
+            )
+            assert c.run.mock_calls[-1] == call("coverage xml")
+
+        def failures_exit_after_combining(self):
+            c = MockContext(run=True, repeat=True)
+            seen, testers = self._testers(Result(), Result(exited=1))
+            with raises(Exit):
+                coverage(
+                    c,
+                    tester=testers[0],
+                    additional_testers=testers[1:],
+                    parallel=True,
+                )
+            c.run.assert_any_call("coverage combine", warn=True)
+
+        @trap
+        def testers_not_returning_results_still_show_output_and_fail(self):
+            c = MockContext(run=True, repeat=True)
+
+            def tester(c, opts):
+                c.run("echo tested; exit 3", in_stream=False)
+
+            seen, testers = self._testers(Result("fine"))
+            with raises(Exit):
+                coverage(
+                    c,
+                    tester=tester,
+                    additional_testers=testers,
+                    parallel=True,
+                )
+            output = sys.stdout.getvalue()
+            assert "=== tester ===\ntested\n" in output
+            assert "fine" in output
+            c.run.assert_any_call("coverage combine", warn=True)
+
+    class since_:
+        @fixture(name="project")
+        def _project(self, tmp_path, monkeypatch):
+            coverage = importorskip("coverage")
+            if coverage.version_info < (5,):
+                skip("Per-test contexts need coverage 5+")
+            monkeypatch.chdir(tmp_path)
+            (tmp_path / "tests").mkdir()
+            (tmp_path / "tests" / "core.py").write_text("")
+            (tmp_path / "tests" / "cli.py").write_text("")
+            cached = tmp_path / ".invocations" / "coverage"
+            cached.parent.mkdir()
+            (cached.parent / "coverage.commit").write_text("abc123\n")
+            data = coverage.CoverageData(basename=str(cached))
+            lib = str(tmp_path / "lib.py")
+            util = str(tmp_path / "util.py")
+            for context, files in (
+                ("tests/core.py::one|run", {lib: [1, 2, 3]}),
+                ("tests/core.py::two|run", {util: [1, 5]}),
+                ("tests/cli.py::three|setup", {lib: [7]}),
+                # Since deleted
+                ("tests/gone.py::four|run", {lib: [9]}),
+                # Import time, outside of any test
+                ("", {lib: [1], util: [1]}),
+            ):
+                data.set_context(context)
+                data.add_lines(files)
+            data.write()
+            return cached
+
+        def _run(self, changes, commits=None, base="main", **kwargs):
+            c = MockContext(run=True, repeat=True)
+            tester = Mock()
+            commits = commits or {"main": "abc123"}
+            with patch("invocations.pytest.changed_lines") as changed_lines:
+                changed_lines.return_value = changes
+                with patch(
+                    "invocations.pytest._commit",
+                    side_effect=lambda c, ref: commits.get(ref, ref),
+                ):
+                    coverage(c, tester=tester, since="main", **kwargs)
+            changed_lines.assert_called_once_with(c, base)
+            return c, tester
+
+        def _kept(self, project):
+            from coverage import CoverageData
+
+            data = CoverageData(basename=".coverage.cached")
+            data.read()
+            return {
+                Path(x).name: sorted(data.lines(x))
+                for x in data.measured_files()
+            }
+
+        def full_run_creates_cache_when_missing(self, tmp_path, monkeypatch):
+            monkeypatch.chdir(tmp_path)
+            (tmp_path / ".coverage").write_text("data")
+            c = MockContext(run=True, repeat=True)
+            tester = Mock()
+            with patch("invocations.pytest._commit", return_value="abc123"):
+                coverage(c, tester=tester, since="main")
+            tester.assert_called_once_with(
+                c,
+                opts="--cov --no-cov-on-fail --cov-context=test"
+                " --cov-report=term",
+            )
+            cached = tmp_path / ".invocations" / "coverage"
+            assert cached.read_text() == "data"
+            commit = cached.parent / "coverage.commit"
+            assert commit.read_text() == "abc123\n"
+
+        def reruns_all_tests_touching_changed_files(self, project):
+            c, tester = self._run({"lib.py": {2}, "README.rst": {1}})
+            (ctx,) = tester.call_args[0]
+            assert ctx.config.run.env["COVERAGE_FILE"] == ".coverage.new"
+            # Not just those which touched line 2 (lines may have moved),
+            # and not those from deleted modules
+            assert tester.call_args[1] == dict(
+                opts="--cov --no-cov-on-fail --cov-context=test"
+                " --cov-report= tests/cli.py::three tests/core.py::one"
+            )
+            # Rerun tests' old data, and any old data for changed files, is
+            # left out of what gets combined
+            assert _contexts(".coverage.cached") == {
+                "",
+                "tests/core.py::two|run",
+            }
+            assert self._kept(project) == {"util.py": [1, 5]}
+            # Only our own data files are combined, not eg shard leftovers
+            assert c.run.mock_calls == [
+                call("coverage combine .coverage.cached"),
+                call("coverage report"),
+            ]
+
+        def changed_test_modules_rerun_entirely(self, project):
+            c, tester = self._run({"tests/cli.py": {1}})
+            assert tester.call_args[1]["opts"].endswith(" tests/cli.py")
+            assert _contexts(".coverage.cached") == {
+                "",
+                "tests/core.py::one|run",
+                "tests/core.py::two|run",
+                "tests/gone.py::four|run",
+            }
+
+        def node_ids_within_rerun_modules_are_not_repeated(self, project):
+            c, tester = self._run({"tests/cli.py": {1}, "lib.py": {1}})
+            assert tester.call_args[1]["opts"].endswith(
+                " tests/cli.py tests/core.py::one"
+            )
+
+        def nothing_affected_still_reports(self, project):
+            c, tester = self._run({"other.py": {4}}, report="xml")
+            assert not tester.called
+            assert c.run.mock_calls == [
+                call("coverage combine .coverage.cached"),
+                call("coverage xml"),
+            ]
+
+        def diffs_from_cached_commit_when_since_differs(self, project):
+            c, tester = self._run(
+                {"util.py": {1}}, {"main": "def456"}, base="abc123"
+            )
+            assert tester.call_args[1]["opts"].endswith(" tests/core.py::two")
+
+        def unknown_cached_commit_means_full_run(self, project):
+            (project.parent.parent / ".coverage").write_text("new")
+            c = MockContext(run=True, repeat=True)
+            tester = Mock()
+            with patch("invocations.pytest._commit", return_value=None):
+                coverage(c, tester=tester, since="main")
+            tester.assert_called_once_with(
+                c,
+                opts="--cov --no-cov-on-fail --cov-context=test"
+                " --cov-report=term",
+            )
+            assert project.read_text() == "new"
+
+        def conftest_changes_mean_full_run(self, project):
+            (project.parent.parent / ".coverage").write_text("new")
+            c, tester = self._run({"tests/conftest.py": {1}})
+            tester.assert_called_once_with(
+                c,
+                opts="--cov --no-cov-on-fail --cov-context=test"
+                " --cov-report=term",
+            )
+            assert project.read_text() == "new"
+
     def open_html_report(self):
         c = MockContext(run=True, repeat=True)
         coverage(c, report="html")
@@ -82,3 +328,317 @@ class coverage_:
             c = MockContext(run=True, repeat=True)
             coverage(c, codecov=True)
             c.run.assert_has_calls([call("coverage xml"), call("codecov")])
+
+
+class watch_tests_:
+    @patch("invocations.pytest.watch")
+    def runs_tests_then_watches(self, watch):
+        c = MockContext(run=True)
+        watch_tests(c)
+        c.run.assert_called_once_with(
+            "pytest --verbose --color=yes --capture=sys", pty=True
+        )
+        assert watch.call_args[0][1] is _test_task
+
+    @patch("invocations.pytest.ImportIndex")
+    @patch("invocations.pytest.watch")
+    def affected_mode_reruns_only_affected_modules(self, watch, ImportIndex):
+        c = MockContext(run=True, repeat=True)
+        watch_tests(c, affected=True)
+        rerun = watch.call_args[0][1]
+        assert watch.call_args[1]["pass_path"] is True
+        ImportIndex.return_value.refresh.return_value = ["tests/a.py"]
+        rerun(c, path="./mypkg/a.py")
+        c.run.assert_called_with(
+            "pytest --verbose --color=yes --capture=sys tests/a.py", pty=True
+        )
+
+    @patch("invocations.pytest._warm_server")
+    @patch("invocations.pytest.test")
+    @patch("invocations.pytest.import_module")
+    @patch("invocations.pytest.watch")
+    def warm_mode_preloads_and_forks(self, watch, import_module, test, server):
+        c = MockContext(run=True)
+        c.config.tests = {"preload": ["numpy"]}
+        watch_tests(c, warm=True)
+        assert [x[0][0] for x in import_module.call_args_list] == [
+            "pytest",
+            "numpy",
+        ]
+        # Server is started before the watcher's threads are
+        server.assert_called_once_with()
+        test.assert_called_once_with(c, module=None, opts="", warm=True)
+        assert watch.call_args[1]["warm"] is True
+
+
+class warm_test_runs:
+    @patch("invocations.pytest._warm_server")
+    def fork_instead_of_subprocess(self, server):
+        server.return_value.run.return_value = 0
+        c = MockContext()
+        c.config.run.env = {"TERM": "xterm"}
+        c.config.tests = {"package": "mypkg"}
+        _test_task(c, warm=True)
+        server.return_value.run.assert_called_once_with(
+            ["--verbose", "--color=yes", "--capture=sys"],
+            {"TERM": "xterm"},
+            {"tests", "conftest", "mypkg"},
+        )
+
+    @patch("invocations.pytest._warm_server")
+    def failures_raise_Exit_unless_warn(self, server):
+        server.return_value.run.return_value = 1
+        c = MockContext()
+        with raises(Exit):
+            _test_task(c, warm=True)
+        c.config.run.warn = True
+        _test_task(c, warm=True)
+
+    def server_forks_runs_with_env_and_fresh_modules(
+        self, tmp_path, monkeypatch
+    ):
+        if not hasattr(os, "fork"):
+            skip("Needs fork()")
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "test_env.py").write_text(
+            "import os\n"
+            "def test_env():\n"
+            "    assert os.environ['WARM_SERVER'] == 'yes'\n"
+        )
+        args = ["-q", "-p", "no:cacheprovider", "test_env.py"]
+        server = _WarmServer()
+        try:
+            assert server.run(args, {"WARM_SERVER": "yes"}, {"tests"}) == 0
+            assert server.run(args, {"WARM_SERVER": "no"}, {"tests"}) == 1
+        finally:
+            server._requests.close()
+            os.waitpid(server.pid, 0)
+
+
+class integration_:
+    def runs_integration_folder_in_one_process(self):
+        # (Double space is pre-existing behavior from the opts concatenation)
+        extra = " integration/"
+        with _expect(extra_flags=extra) as c:
+            integration(c)
+
+    class workers_:
+        _BASE = "pytest --verbose --color=yes --capture=sys"
+
+        @patch("invocations.pytest.find_test_modules")
+        def runs_each_module_in_own_process_and_tmpdir(self, modules):
+            modules.return_value = ["integration/a.py", "integration/b.py"]
+            c = MockContext(run=True, repeat=True)
+            results = integration(c, workers="2")
+            modules.assert_called_once_with("integration")
+            assert len(results) == 2
+            cmds = sorted(x[1][0] for x in c.run.mock_calls)
+            assert cmds == [
+                "{} integration/a.py".format(self._BASE),
+                "{} integration/b.py".format(self._BASE),
+            ]
+            tmpdirs = {x[2]["env"]["TMPDIR"] for x in c.run.mock_calls}
+            assert len(tmpdirs) == 2
+
+        @trap
+        @patch("invocations.pytest.find_test_modules")
+        def prints_output_and_summary_then_exits_on_failure(self, modules):
+            modules.return_value = ["integration/a.py", "integration/b.py"]
+            c = MockContext(
+                run={
+                    "{} integration/a.py".format(self._BASE): Result("yay\n"),
+                    "{} integration/b.py".format(self._BASE): Result(
+                        "boo\n", exited=3
+                    ),
+                }
+            )
+            with raises(Exit) as info:
+                integration(c, workers="2")
+            assert info.value.code == 3
+            output = sys.stdout.getvalue()
+            assert "=== integration/a.py ===\nyay\n" in output
+            assert re.search(r"integration/a.py\s+passed\s+0", output)
+            assert re.search(r"integration/b.py\s+FAILED\s+3", output)
+
+        @patch("invocations.pytest.find_test_modules")
+        def module_selection_disables_splitting(self, modules):
+            extra = " integration/foo.py"
+            with _expect(extra_flags=extra) as c:
+                integration(c, module="foo", workers="2")
+            assert not modules.called
+
+
+class workers:
+    @patch("invocations.pytest._has_xdist", return_value=True)
+    def uses_xdist_when_available(self, has_xdist):
+        with _expect(extra_flags="-n 4") as c:
+            _test_task(c, workers="4")
+        has_xdist.assert_called_once_with(c)
+
+    @patch("invocations.pytest._has_xdist", return_value=True)
+    def auto_handed_to_xdist_verbatim(self, has_xdist):
+        with _expect(extra_flags="-n auto") as c:
+            _test_task(c, workers="auto")
+
+    @patch("invocations.pytest.find_test_modules")
+    @patch("invocations.pytest._has_xdist", return_value=False)
+    def shards_modules_across_processes_otherwise(self, has_xdist, modules):
+        modules.return_value = ["tests/a.py", "tests/b.py", "tests/c.py"]
+        c = MockContext(run=True, repeat=True)
+        _test_task(c, workers="2")
+        base = "pytest --verbose --color=yes --capture=sys"
+        kwargs = dict(hide=True, warn=True, pty=False, in_stream=False, env={})
+        assert sorted(c.run.mock_calls) == [
+            call("{} tests/a.py tests/c.py".format(base), **kwargs),
+            call("{} tests/b.py".format(base), **kwargs),
+        ]
+
+    @patch("invocations.pytest.default_jobs", return_value=3)
+    @patch("invocations.pytest.find_test_modules")
+    @patch("invocations.pytest._has_xdist", return_value=False)
+    def auto_sizes_by_default_jobs(self, has_xdist, modules, default_jobs):
+        modules.return_value = ["tests/a.py", "tests/b.py", "tests/c.py"]
+        c = MockContext(run=True, repeat=True)
+        _test_task(c, workers="auto")
+        default_jobs.assert_called_once_with(c)
+        assert len(c.run.mock_calls) == 3
+
+    @patch("invocations.pytest.find_test_modules")
+    @patch("invocations.pytest._has_xdist", return_value=False)
+    def sharded_coverage_data_is_combined(self, has_xdist, modules):
+        modules.return_value = ["tests/a.py", "tests/b.py"]
+        c = MockContext(run=True, repeat=True)
+        _test_task(c, workers="2", opts="--cov")
+        envs = sorted(
+            x[2]["env"]["COVERAGE_FILE"] for x in c.run.mock_calls[:2]
+        )
+        assert envs == [".coverage.shard0", ".coverage.shard1"]
+        assert c.run.mock_calls[-1] == call("coverage combine", warn=True)
+
+    @patch("invocations.pytest.find_test_modules")
+    @patch("invocations.pytest._has_xdist", return_value=False)
+    def any_shard_failing_fails_the_run(self, has_xdist, modules):
+        modules.return_value = ["tests/a.py", "tests/b.py"]
+        c = MockContext(run=[Result(exited=0), Result(exited=1)], repeat=False)
+        with raises(Exit):
+            _test_task(c, workers="2")
+
+    @patch("invocations.pytest.find_test_modules")
+    @patch("invocations.pytest._has_xdist", return_value=False)
+    def rejects_non_positive_or_non_integer_counts(self, has_xdist, modules):
+        modules.return_value = ["tests/a.py"]
+        for value in ("0", "-1", "lots"):
+            c = MockContext(run=True, repeat=True)
+            with raises(Exit, match="positive integer"):
+                _test_task(c, workers=value)
+            assert not c.run.called
+
+    def xdist_is_looked_for_in_the_pytest_being_run(self):
+        c = MockContext(
+            run={
+                "pytest -VV": Result(
+                    "registered third-party plugins:\n"
+                    "  pytest-xdist-3.6.1 at /venv/xdist/plugin.py\n"
+                ),
+                "pytest --verbose --color=yes --capture=sys -n 2": Result(),
+            }
+        )
+        _test_task(c, workers="2")
+
+    @patch("invocations.pytest._has_xdist", return_value=False)
+    def module_and_workers_need_xdist(self, has_xdist):
+        c = MockContext(run=True, repeat=True)
+        with raises(Exit, match="pytest-xdist"):
+            _test_task(c, module="main", workers="2")
+        assert not c.run.called
+
+    @trap
+    @patch("invocations.pytest.find_test_modules")
+    @patch("invocations.pytest._has_xdist", return_value=False)
+    def shards_without_tests_are_fine_and_results_merged(
+        self, has_xdist, modules
+    ):
+        modules.return_value = ["tests/a.py", "tests/b.py", "tests/_util.py"]
+        c = MockContext(
+            run=[
+                Result("== 2 passed, 1 warning in 0.1s ==\n"),
+                Result("== 1 passed, 2 warnings in 0.1s ==\n"),
+                Result("== no tests ran in 0.01s ==\n", exited=5),
+            ]
+        )
+        _test_task(c, workers="3")
+        output = sys.stdout.getvalue()
+        assert "no tests" in output
+        assert "Combined: 3 passed, 3 warnings (0 of 3 shards failed)" in (
+            output
+        )
+
+
+class shard:
+    @patch("invocations.pytest.find_test_modules")
+    def runs_only_given_shard_and_records_timings(self, modules, tmp_path):
+        for name in ("a", "b", "c"):
+            (tmp_path / name).write_text(name)
+        modules.return_value = [str(tmp_path / x) for x in ("a", "b", "c")]
+        c = MockContext(run=True)
+        c.config.invocations = {"cache_dir": str(tmp_path)}
+        _test_task(c, shard="2/2", verbose=False, color=False)
+        cmd = c.run.call_args[0][0]
+        assert "--junitxml=" in cmd and "-o junit_family=xunit1" in cmd
+        assert cmd.endswith(" {}".format(tmp_path / "b"))
+
+    @patch("invocations.pytest.ci_environment")
+    @patch("invocations.pytest.find_test_modules")
+    def auto_uses_ci_node_index(self, modules, ci_environment, tmp_path):
+        for name in ("a", "b", "c"):
+            (tmp_path / name).write_text(name)
+        modules.return_value = [str(tmp_path / x) for x in ("a", "b", "c")]
+        ci_environment.return_value = CIEnvironment("circleci", 1, 2, None, 1)
+        c = MockContext(run=True)
+        c.config.invocations = {"cache_dir": str(tmp_path)}
+        _test_task(c, shard="auto")
+        assert c.run.call_args[0][0].endswith(" {}".format(tmp_path / "b"))
+
+    @patch("invocations.pytest.ci_environment", return_value=None)
+    @patch("invocations.pytest.find_test_modules")
+    def auto_runs_everything_outside_ci(self, modules, _, tmp_path):
+        for name in ("a", "b"):
+            (tmp_path / name).write_text(name)
+        modules.return_value = [str(tmp_path / x) for x in ("a", "b")]
+        c = MockContext(run=True)
+        c.config.invocations = {"cache_dir": str(tmp_path)}
+        _test_task(c, shard="auto")
+        expected = " {} {}".format(tmp_path / "a", tmp_path / "b")
+        assert c.run.call_args[0][0].endswith(expected)
+
+    def bad_shard_specs_exit(self):
+        for spec in ("2", "a/b", "0/2", "3/2"):
+            with raises(Exit):
+                _test_task(MockContext(), shard=spec)
+
+    def exclusive_with_module(self):
+        with raises(Exit):
+            _test_task(MockContext(), shard="1/2", module="foo")
+
+
+class timings_report_:
+    def exits_when_nothing_recorded(self, tmp_path):
+        c = MockContext()
+        c.config.invocations = {"cache_dir": str(tmp_path)}
+        with raises(Exit):
+            timings_report(c)
+
+    @trap
+    def shows_slowest_slower_and_runs(self, tmp_path):
+        data = {
+            "tests": {"tests/a.py::fast": [0.1], "tests/a.py::slow": [1, 3]},
+            "runs": [{"time": 0, "tests": 2, "seconds": 3.1}],
+        }
+        (tmp_path / "timings.json").write_text(json.dumps(data))
+        c = MockContext()
+        c.config.invocations = {"cache_dir": str(tmp_path)}
+        timings_report(c)
+        output = sys.stdout.getvalue()
+        assert output.index("tests/a.py::slow") < output.index("::fast")
+        assert re.search(r"tests/a.py::slow\s+1.000s\s+3.000s", output)
+        assert "3.10s" in output
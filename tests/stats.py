@@ -0,0 +1,71 @@
+import json
+
+from invocations.stats import Histogram, RunningStats
+
+
+def _stats(*values):
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    return stats
+
+
+class RunningStats_:
+    def empty_stats_are_None(self):
+        stats = RunningStats()
+        assert len(stats) == 0
+        assert stats.min is None and stats.max is None
+        assert stats.mean is None and stats.mode is None
+        assert stats.percentile(50) is None
+
+    def tracks_count_min_max_mean(self):
+        stats = _stats(3, 1, 4, 1, 5)
+        assert len(stats) == 5
+        assert stats.min == 1
+        assert stats.max == 5
+        assert stats.mean == 2.8
+
+    def mode_is_most_common_value(self):
+        assert _stats(3, 1, 4, 1, 5).mode == 1
+
+    def mode_ties_go_to_largest_value(self):
+        assert _stats(2, 7, 2, 7).mode == 7
+
+    def percentiles_use_nearest_rank(self):
+        stats = _stats(*range(1, 101))
+        assert stats.percentile(50) == 50
+        assert stats.percentile(90) == 90
+        assert stats.percentile(99) == 99
+        assert stats.percentile(100) == 100
+        assert stats.percentile(0) == 1
+
+    def memory_bounded_by_distinct_values(self):
+        stats = _stats(*([1, 2] * 5000))
+        assert len(stats.counts) == 2
+        assert len(stats) == 10000
+
+
+class Histogram_:
+    def summary_stats_are_exact(self):
+        hist = Histogram()
+        for value in (0.12345, 0.5, 2.25):
+            hist.add(value)
+        assert hist.min == 0.12345
+        assert hist.max == 2.25
+        assert hist.mean == (0.12345 + 0.5 + 2.25) / 3
+
+    def values_bucketed_by_significant_figures(self):
+        hist = Histogram(figures=2)
+        for value in (0.0123, 0.0124, 0.0126, 150.4, 0):
+            hist.add(value)
+        assert hist.counts == {0.012: 2, 0.013: 1, 150: 1, 0: 1}
+        assert hist.percentile(50) == 0.012
+
+    def to_dict_is_json_friendly(self):
+        hist = Histogram()
+        hist.add(1.5)
+        hist.add(1.5)
+        data = json.loads(json.dumps(hist.to_dict()))
+        assert data["count"] == 2
+        assert data["percentiles"]["99"] == 1.5
+        assert data["buckets"] == [[1.5, 2]]
@@ -0,0 +1,136 @@
+import sys
+import time
+
+from invoke import Config, Context, Result
+from pytest_relaxed import trap
+
+from invocations.testing import (
+    count_errors,
+    _exited_nonzero,
+    _failure_reason,
+    _output_matches,
+    _signature,
+    _timed_out,
+)
+
+
+TRACEBACK = """some noise
+Traceback (most recent call last):
+  File "/tmp/tmpab12cd/thing.py", line 12, in <module>
+    main()
+  File "/tmp/tmpab12cd/thing.py", line 7, in main
+    raise ValueError("bad value 17 at 0xdeadbeef")
+ValueError: bad value 17 at 0xdeadbeef
+"""
+
+
+class failure_predicates:
+    def nonzero_exit(self):
+        assert _exited_nonzero(Result(exited=3)) == "exited 3"
+        assert _exited_nonzero(Result(exited=0)) is None
+
+    def output_regexes(self):
+        predicate = _output_matches("stdout", r"^WARN")
+        assert predicate(Result(stdout="ok\nWARN: eh")) == (
+            "stdout matched '^WARN'"
+        )
+        assert predicate(Result(stdout="ok\nnot WARN")) is None
+
+    def first_matching_predicate_wins(self):
+        result = Result(exited=1)
+        result.timed_out = True
+        reason = _failure_reason(result, [_timed_out, _exited_nonzero])
+        assert reason == "timed out"
+
+    def no_reason_means_success(self):
+        assert _failure_reason(Result(), [_timed_out, _exited_nonzero]) is None
+
+
+class signatures:
+    def tracebacks_reduce_to_frames_and_exception(self):
+        assert _signature("exited 1", "", TRACEBACK) == (
+            "exited 1: ValueError: bad value N at ADDR (in <module> > main)"
+        )
+
+    def otherwise_uses_last_line_of_output(self):
+        sig = _signature(
+            "exited 2", "took 1.5s\nretrying in /tmp/tmpx1y\n", ""
+        )
+        assert sig == "exited 2: retrying in /tmp/tmp?"
+
+    def bare_reason_without_output(self):
+        assert _signature("timed out", "", "") == "timed out"
+
+    def truncates_long_signatures(self):
+        sig = _signature("exited 1", "x" * 500, "", width=40)
+        assert len(sig) == 40
+        assert sig.endswith("...")
+
+
+def _context():
+    # Real subprocesses, as trials run on threads; but no stdin under pytest.
+    return Context(config=Config(overrides={"run": {"in_stream": False}}))
+
+
+class count_errors_:
+    class concurrent_trials:
+        @trap
+        def tallies_failures_across_jobs(self):
+            # Every third trial (0, 3, 6) fails
+            command = "test $((INVOCATIONS_TRIAL % 3)) != 0"
+            count_errors(_context(), command, trials=9, jobs=3)
+            assert "3/9 trials failed" in sys.stdout.getvalue()
+
+        @trap
+        def actually_run_at_once(self):
+            start = time.perf_counter()
+            count_errors(_context(), "sleep 0.5", trials=4, jobs=4)
+            assert time.perf_counter() - start < 1.5
+            assert "0/4 trials failed" in sys.stdout.getvalue()
+
+        @trap
+        def each_trial_gets_own_tmpdir_and_number(self, tmp_path):
+            log = tmp_path / "log"
+            command = 'echo "$INVOCATIONS_TRIAL $TMPDIR" >> {}'.format(log)
+            count_errors(_context(), command, trials=6, jobs=3)
+            lines = [x.split() for x in log.read_text().splitlines()]
+            assert sorted(int(x[0]) for x in lines) == list(range(6))
+            assert len({x[1] for x in lines}) == 6
+
+        @trap
+        def do_not_share_stdin(self):
+            # No in_stream override here; concurrent trials mustn't read ours
+            count_errors(Context(), "true", trials=4, jobs=2)
+            assert "0/4 trials failed" in sys.stdout.getvalue()
+
+    class fail_fast:
+        @trap
+        def stops_starting_trials_after_first_failure(self, tmp_path):
+            log = tmp_path / "log"
+            command = "echo $INVOCATIONS_TRIAL >> {}; "
+            command += 'test "$INVOCATIONS_TRIAL" != 1'
+            count_errors(
+                _context(),
+                command.format(log),
+                trials=100,
+                jobs=2,
+                fail_fast=True,
+            )
+            output = sys.stdout.getvalue()
+            assert "First failure occurred after" in output
+            # Only trials already queued when trial 1 failed may have run
+            assert len(log.read_text().splitlines()) < 10
+
+        @trap
+        def serial_mode_stops_immediately(self, tmp_path):
+            log = tmp_path / "log"
+            command = 'echo x >> {}; test "$(wc -l < {})" -lt 3'
+            count_errors(
+                _context(),
+                command.format(log, log),
+                trials=10,
+                fail_fast=True,
+            )
+            assert len(log.read_text().splitlines()) == 3
+            output = sys.stdout.getvalue()
+            assert "First failure occurred after 2 successes" in output
@@ -0,0 +1,168 @@
+import json
+import os
+
+from invocations.timings import (
+    file_durations,
+    load,
+    merge,
+    parse_junit,
+    partition,
+    recording,
+    slowdowns,
+    slowest,
+    typical,
+)
+
+
+JUNIT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites><testsuite name="pytest">
+<testcase classname="tests.main" file="tests/main.py" name="toplevel"
+    time="0.5" />
+<testcase classname="tests.checks.checks.lint_" file="tests/checks.py"
+    name="runs_flake8" time="1.25" />
+<testcase classname="nowhere.at.all" name="no_file_attr" time="3" />
+</testsuite></testsuites>
+"""
+
+
+class parse_junit_:
+    def yields_node_ids_and_seconds(self, tmp_path):
+        xml = tmp_path / "results.xml"
+        xml.write_text(JUNIT)
+        assert parse_junit(xml) == {
+            "tests/main.py::toplevel": 0.5,
+            "tests/checks.py::checks::lint_::runs_flake8": 1.25,
+        }
+
+    def infers_files_from_classname_without_file_attr(self, tmp_path):
+        (tmp_path / "tests").mkdir()
+        (tmp_path / "tests" / "main.py").write_text("")
+        xml = tmp_path / "nose.xml"
+        xml.write_text(
+            '<testsuite><testcase classname="tests.main.Things" name="t"'
+            ' time="1.5" /></testsuite>'
+        )
+        cwd = os.getcwd()
+        os.chdir(tmp_path)
+        try:
+            assert parse_junit(xml) == {"tests/main.py::Things::t": 1.5}
+        finally:
+            os.chdir(cwd)
+
+
+class recording_:
+    def merges_written_xml_into_existing_data(self, tmp_path):
+        path = tmp_path / "cache" / "timings.json"
+        path.parent.mkdir()
+        existing = {"tests": {"tests/main.py::toplevel": [2.0]}, "runs": []}
+        path.write_text(json.dumps(existing))
+        with recording(path) as xml_dir:
+            with open("{}/one.xml".format(xml_dir), "w") as fd:
+                fd.write(JUNIT)
+        data = load(path)
+        assert data["tests"] == {
+            "tests/main.py::toplevel": [2.0, 0.5],
+            "tests/checks.py::checks::lint_::runs_flake8": [1.25],
+        }
+        assert len(data["runs"]) == 1
+        assert data["runs"][0]["tests"] == 2
+        assert data["runs"][0]["seconds"] == 1.75
+
+    def leaves_data_alone_if_nothing_recorded(self, tmp_path):
+        path = tmp_path / "timings.json"
+        with recording(path):
+            pass
+        assert not path.exists()
+
+
+class load_:
+    def missing_or_corrupt_files_are_empty(self, tmp_path):
+        empty = {"tests": {}, "runs": []}
+        assert load(tmp_path / "nope.json") == empty
+        (tmp_path / "bad.json").write_text("{lol")
+        assert load(tmp_path / "bad.json") == empty
+
+
+class merge_:
+    def history_and_runs_are_bounded(self):
+        data = {"tests": {}, "runs": []}
+        for seconds in range(5):
+            merge(data, {"a::b": seconds}, history=3, runs=2)
+        assert data["tests"] == {"a::b": [2, 3, 4]}
+        assert [x["seconds"] for x in data["runs"]] == [3, 4]
+
+    def tests_not_seen_for_a_while_are_forgotten(self):
+        data = {"tests": {}, "runs": []}
+        merge(data, {"a::old": 1, "a::kept": 1}, stale=3)
+        merge(data, {"a::kept": 1}, stale=3)
+        merge(data, {"b::other": 1}, stale=3)
+        # Partial runs don't drop anything straight away
+        assert set(data["tests"]) == {"a::old", "a::kept", "b::other"}
+        merge(data, {"b::other": 1}, stale=3)
+        assert set(data["tests"]) == {"a::kept", "b::other"}
+        assert set(data["seen"]) == {"a::kept", "b::other"}
+
+    def data_predating_last_seen_counts_as_seen(self):
+        data = {"tests": {"a::b": [1]}, "runs": []}
+        merge(data, {"c::d": 1}, stale=2)
+        assert data["seen"] == {"a::b": 1, "c::d": 1}
+        merge(data, {"c::d": 1}, stale=2)
+        assert "a::b" in data["tests"]
+        merge(data, {"c::d": 1}, stale=2)
+        assert list(data["tests"]) == ["c::d"]
+
+
+def _data(**tests):
+    return {"tests": tests, "runs": []}
+
+
+class reports:
+    def typical_is_median(self):
+        assert typical(_data(a=[1, 5, 2])) == {"a": 2}
+
+    def slowest_tests_first(self):
+        data = _data(a=[1.0], b=[3.0], c=[2.0])
+        assert slowest(data, 2) == [("b", 3.0), ("c", 2.0)]
+
+    def slowdowns_vs_own_history_by_default(self):
+        data = _data(fine=[1.0, 1.0, 1.1], worse=[1.0, 1.0, 2.0], new=[9.0])
+        assert slowdowns(data) == [("worse", 1.0, 2.0)]
+
+    def slowdowns_vs_baseline_data(self):
+        data = _data(a=[1.0, 1.0, 1.0], b=[0.5])
+        assert slowdowns(data, baseline=_data(a=[0.5], b=[0.5])) == [
+            ("a", 0.5, 1.0)
+        ]
+
+    def tiny_slowdowns_are_noise(self):
+        assert slowdowns(_data(a=[0.001, 0.005])) == []
+
+
+class file_durations_:
+    def sums_recorded_tests_per_file(self, tmp_path):
+        path = tmp_path / "a.py"
+        path.write_text("x")
+        data = {"{}::one".format(path): 1.0, "{}::two".format(path): 2.5}
+        assert file_durations([str(path)], data) == {str(path): 3.5}
+
+    def estimates_untimed_files_from_size(self, tmp_path):
+        timed, untimed = tmp_path / "timed.py", tmp_path / "untimed.py"
+        timed.write_text("x" * 100)
+        untimed.write_text("x" * 300)
+        paths = [str(timed), str(untimed)]
+        result = file_durations(paths, {"{}::t".format(timed): 2.0})
+        assert result == {str(timed): 2.0, str(untimed): 6.0}
+
+    def uses_raw_sizes_without_any_timings(self, tmp_path):
+        path = tmp_path / "a.py"
+        path.write_text("x" * 10)
+        assert file_durations([str(path)], {}) == {str(path): 10}
+
+
+class partition_:
+    def balances_by_weight(self):
+        weights = {"a": 5, "b": 4, "c": 3, "d": 3, "e": 1}
+        assert partition(weights, 2) == [["a", "d"], ["b", "c", "e"]]
+
+    def extra_bins_are_empty(self):
+        assert partition({"a": 1}, 3) == [["a"], [], []]
@@ -0,0 +1,162 @@
+import os
+from pathlib import Path
+
+from invoke import MockContext, Result
+
+from invocations.util import (
+    TmpdirPool,
+    changed_files,
+    changed_lines,
+    parallel,
+    tmpdir,
+    tmpdir_pool,
+)
+
+
+_DIFF = """\
+diff --git a/lib.py b/lib.py
+index 1111111..2222222 100644
+--- a/lib.py
++++ b/lib.py
+@@ -3 +3 @@ def one():
+-    return 1
++    return 2
+@@ -5 +4,0 @@ def one():
+--- not a header
+@@ -10,2 +10,3 @@ def two():
++    pass
+@@ -20,4 +21,0 @@ def three():
+-    gone
+@@ -30,0 +28,2 @@ def four():
++    added
+diff --git a/old.py b/old.py
+deleted file mode 100644
+--- a/old.py
++++ /dev/null
+@@ -1 +0,0 @@
+-x = 1
+diff --git a/new.py b/new.py
+new file mode 100644
+--- /dev/null
++++ b/new.py
+@@ -0,0 +1 @@
++y = 2
+diff --git a/was.py b/now.py
+similarity index 90%
+rename from was.py
+rename to now.py
+--- a/was.py
++++ b/now.py
+@@ -0,0 +1 @@
++# header
+"""
+
+
+class changed_lines_:
+    def uses_pre_image_line_numbers(self):
+        cmd = "git diff --no-color --no-ext-diff -U0 main"
+        c = MockContext(run={cmd: Result(_DIFF)})
+        assert changed_lines(c, "main") == {
+            # Changed, deleted & inserted-around lines, numbered as of 'main'
+            "lib.py": {3, 5, 10, 11, 20, 21, 22, 23, 30, 31},
+            "old.py": {1},
+            "new.py": set(),
+            "was.py": {1},
+            "now.py": set(),
+        }
+
+
+class changed_files_:
+    def combines_diff_and_untracked_files(self):
+        c = MockContext(
+            run={
+                "git diff --name-only --relative --diff-filter=ACMR main": Result(  # noqa
+                    "b.py\nREADME.rst\n"
+                ),
+                "git ls-files --others --exclude-standard": Result("a.py\n"),
+            }
+        )
+        assert changed_files(c, "main") == ["README.rst", "a.py", "b.py"]
+
+
+class TmpdirPool_:
+    def creates_under_root_and_cleans_up(self, tmp_path):
+        pool = TmpdirPool(root=str(tmp_path))
+        with pool.tmpdir() as tmp:
+            assert os.path.dirname(tmp) == str(tmp_path)
+            (Path(tmp) / "file").write_text("hi")
+        assert not os.path.exists(tmp)
+        assert pool.stats["created"] == pool.stats["cleaned"] == 1
+        assert pool.stats["create_seconds"] >= 0
+        assert pool.stats["cleanup_seconds"] >= 0
+
+    def deferred_cleanup_renames_then_deletes_in_background(self, tmp_path):
+        pool = TmpdirPool(root=str(tmp_path), defer_cleanup=True)
+        with pool.tmpdir() as tmp:
+            (Path(tmp) / "file").write_text("hi")
+        # Original path is free immediately, even if deletion is pending
+        assert not os.path.exists(tmp)
+        pool.drain()
+        assert list(tmp_path.iterdir()) == []
+        assert pool.stats["cleaned"] == 1
+
+    def finished_deferred_cleanups_are_forgotten(self, tmp_path):
+        pool = TmpdirPool(root=str(tmp_path), defer_cleanup=True)
+        for _ in range(5):
+            with pool.tmpdir():
+                pass
+        pool.drain()
+        assert not pool._pending
+        assert pool.stats["cleaned"] == 5
+
+    def stats_are_thread_safe(self, tmp_path):
+        pool = TmpdirPool(root=str(tmp_path), defer_cleanup=True)
+
+        def use(_):
+            with pool.tmpdir():
+                pass
+
+        parallel(use, range(200), 8)
+        pool.drain()
+        assert pool.stats["created"] == pool.stats["cleaned"] == 200
+        assert list(tmp_path.iterdir()) == []
+
+    def per_caller_stats_are_tallied_too(self, tmp_path):
+        pool = TmpdirPool(root=str(tmp_path), defer_cleanup=True)
+        with pool.tmpdir():
+            pass
+        mine = {}
+        with pool.tmpdir(stats=mine):
+            pass
+        pool.drain()
+        assert mine["created"] == mine["cleaned"] == 1
+        assert pool.stats["created"] == pool.stats["cleaned"] == 2
+
+    def skip_cleanup_and_explicit_honored(self, tmp_path):
+        pool = TmpdirPool(defer_cleanup=True)
+        with pool.tmpdir(skip_cleanup=True, explicit=str(tmp_path)) as tmp:
+            assert tmp == str(tmp_path)
+        assert tmp_path.exists()
+        assert pool.stats["created"] == 0
+
+
+class tmpdir_pool_:
+    def default_pool_without_config(self):
+        assert tmpdir_pool() is tmpdir_pool(MockContext())
+
+    def pools_shared_per_config(self, tmp_path):
+        c = MockContext()
+        settings = {"root": str(tmp_path), "defer_cleanup": True}
+        c.config.invocations = {"tmpdir": settings}
+        pool = tmpdir_pool(c)
+        assert pool is tmpdir_pool(c)
+        assert pool is not tmpdir_pool()
+        assert pool.root == str(tmp_path)
+        assert pool.defer_cleanup is True
+
+    def tmpdir_uses_context_config(self, tmp_path):
+        c = MockContext()
+        c.config.invocations = {"tmpdir": {"root": str(tmp_path)}}
+        with tmpdir(c=c) as tmp:
+            assert os.path.dirname(tmp) == str(tmp_path)
+        assert not os.path.exists(tmp)
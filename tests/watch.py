@@ -0,0 +1,66 @@
+from unittest.mock import Mock
+
+from watchdog.events import FileModifiedEvent, FileMovedEvent
+
+from invocations.watch import Matcher, make_handler
+
+
+class Matcher_:
+    def matches_any_include_regex(self):
+        matcher = Matcher([r"\./tests/", r"\./mypkg/"])
+        assert matcher("./tests/main.py")
+        assert matcher("./mypkg/__init__.py")
+        assert not matcher("./docs/index.rst")
+
+    def regexes_are_anchored_at_start_like_re_match(self):
+        assert not Matcher([r"tests/"])("./tests/main.py")
+
+    def ignores_win_over_includes(self):
+        matcher = Matcher([r"\./tests/"], [r".*/\..*\.swp"])
+        assert not matcher("./tests/.main.py.swp")
+        assert matcher("./tests/main.py")
+
+    def no_include_regexes_matches_nothing(self):
+        assert not Matcher([])("./anything")
+
+    def any_given_path_may_match(self):
+        matcher = Matcher([r"\./tests/"])
+        assert matcher("./elsewhere.py", "./tests/main.py")
+
+    def backreferences_keep_working(self):
+        matcher = Matcher([r"\./(\w+)/\1\.py", r"\./(?P<x>\w)(?P=x)"])
+        assert matcher("./foo/foo.py")
+        assert not matcher("./foo/bar.py")
+        assert matcher("./zz")
+
+    def inline_global_flags_keep_working(self):
+        matcher = Matcher([r"\./tests/", r"(?i)\./DOCS/"])
+        assert matcher("./docs/index.rst")
+        assert matcher("./tests/main.py")
+        assert not matcher("./TESTS/main.py")
+
+    def identical_pattern_lists_share_compiled_regexes(self):
+        one = Matcher([r"\./a/"], [r".*\.swp"])
+        two = Matcher([r"\./b/"], [r".*\.swp"])
+        assert one.ignore is two.ignore
+
+
+class make_handler_:
+    def runs_task_for_matching_events(self):
+        task_ = Mock()
+        handler = make_handler("ctx", task_, [r"\./tests/"], [], module="x")
+        handler.dispatch(FileModifiedEvent("./tests/main.py"))
+        task_.assert_called_once_with("ctx", module="x")
+
+    def skips_nonmatching_and_ignored_events(self):
+        task_ = Mock()
+        handler = make_handler("ctx", task_, [r"\./tests/"], [r".*\.swp"])
+        handler.dispatch(FileModifiedEvent("./docs/index.rst"))
+        handler.dispatch(FileModifiedEvent("./tests/.main.py.swp"))
+        assert not task_.called
+
+    def honors_move_destinations(self):
+        task_ = Mock()
+        handler = make_handler("ctx", task_, [r"\./tests/"], [])
+        handler.dispatch(FileMovedEvent("/tmp/foo.py", "./tests/foo.py"))
+        assert task_.called